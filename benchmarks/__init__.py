@@ -0,0 +1,4 @@
+"""Offline benchmarks for the Elexon API client.
+
+Run each module directly, e.g. ``python -m benchmarks.bench_session``.
+"""
@@ -0,0 +1,74 @@
+"""
+bench_executor.py
+=================
+
+Concurrent ``query_df_async`` on large responses, parsing on the
+event loop (default), in a thread pool and in a process pool (the
+client ``executor``).
+
+Reports the throughput and the event loop lag: the worst delay of
+a coroutine waking up every millisecond, i.e. how long the loop was
+blocked. Throughput only scales with the process pool if the machine
+has more than one core.
+
+    python -m benchmarks.bench_executor [n_queries] [n_items] [n_workers]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from elexon_api import Client, query_df_async
+
+from .stub_server import StubServer
+
+SERVICE_CODE = 'PHYBMDATA'
+PARAMS = {'SettlementDate': dt.date(2019, 6, 15), 'SettlementPeriod': '*'}
+
+
+async def _monitor_lag(stop: asyncio.Event, interval: float = 0.001) -> float:
+    worst = 0.
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(client: Client, n_queries: int) -> tuple:
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_lag(stop))
+    start = time.perf_counter()
+    dfs = await asyncio.gather(*[query_df_async(client, SERVICE_CODE, **PARAMS)
+                                 for _ in range(n_queries)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lag = await monitor
+    await client.aclose()
+    return elapsed, lag, sum(map(len, dfs))
+
+
+def main(n_queries: int = 16, n_items: int = 20_000, n_workers: int = None) -> None:
+    n_workers = n_workers or os.cpu_count()
+    print(f"{n_queries} queries of {n_items} items, {n_workers} workers, "
+          f"{os.cpu_count()} cores")
+    print(f"{'executor':<10} {'queries/s':>10} {'rows/s':>12} {'max lag (ms)':>13}")
+    with StubServer(n_items=n_items, fixtures=True) as server:
+        for name, executor in [('none', None),
+                               ('threads', ThreadPoolExecutor(n_workers)),
+                               ('processes', ProcessPoolExecutor(n_workers))]:
+            client = Client('stub-key', base_url=server.base_url, executor=executor)
+            # warm up (imports in the workers, payload of the stub)
+            asyncio.run(run(client, 1))
+            elapsed, lag, n_rows = asyncio.run(run(client, n_queries))
+            print(f"{name:<10} {n_queries / elapsed:>10.2f} {n_rows / elapsed:>12.0f} "
+                  f"{lag * 1e3:>13.1f}")
+            if executor is not None:
+                executor.shutdown()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,66 @@
+"""
+bench_import.py
+===============
+
+Import time of the package, measured with ``python -X importtime``
+in a fresh interpreter per case.
+
+Also a regression check: exits with status 1 if a case loads one
+of the heavy dependencies, which should only be imported when a
+DataFrame, async or Parquet feature is first used.
+
+    python -m benchmarks.bench_import [n_runs]
+"""
+
+import sys
+import subprocess
+from statistics import median
+from typing import Dict, Tuple
+
+HEAVY_MODULES = ['pandas', 'numpy', 'xmltodict', 'aiohttp', 'pyarrow']
+
+# {case: statement}
+CASES = {
+    'package': "import elexon_api",
+    'client': "from elexon_api import Client, query",
+    'config': "from elexon_api.config import REQUIRED_D",
+}
+
+
+def measure(statement: str) -> Tuple[float, Dict[str, float]]:
+    """Total import time (ms) of statement, and time of heavy modules loaded."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True, check=True)
+    total = 0.
+    heavy = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip())
+        name = name.strip()
+        cumulative = int(cumulative) / 1000
+        # top-level imports are indented by one space
+        if depth == 1:
+            total += cumulative
+        if name in HEAVY_MODULES:
+            heavy[name] = cumulative
+    return total, heavy
+
+
+def main(n_runs: int = 5) -> None:
+    failed = False
+    print(f"{'case':<8} {'import (ms)':>12}  heavy modules loaded")
+    for case, statement in CASES.items():
+        runs = [measure(statement) for _ in range(n_runs)]
+        heavy = runs[-1][1]
+        print(f"{case:<8} {median(r[0] for r in runs):>12.1f}  "
+              + (', '.join(f"{k} ({v:.0f} ms)" for k, v in heavy.items()) or '-'))
+        failed = failed or bool(heavy)
+    if failed:
+        print("Heavy dependencies are imported eagerly.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
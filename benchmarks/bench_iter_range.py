@@ -0,0 +1,76 @@
+"""
+bench_iter_range.py
+===================
+
+Peak RSS of pulling a range of days of ``PHYBMDATA`` from the stub
+server: :func:`~elexon_api.query_range` (one DataFrame) against
+:func:`~elexon_api.write_range` (chunks streamed to a CSV file).
+The peak of ``query_range`` grows with the range, the streamed
+one should not.
+
+Each measurement runs in a fresh process, with its own stub server.
+
+    python -m benchmarks.bench_iter_range [n_items] [n_days ...]
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+
+from .stub_server import StubServer
+
+SERVICE_CODE = 'PHYBMDATA'
+START = '2019-01-01'
+MODES = ['query_range', 'write_range']
+
+
+def _max_rss_mb() -> float:
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(mode: str, n_items: int, n_days: int) -> dict:
+    import pandas as pd
+    from elexon_api import Client, query_range, write_range, CsvSink
+
+    end = pd.Timestamp(START) + pd.Timedelta(days=n_days - 1)
+    with StubServer(n_items=n_items, fixtures=True) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        client = Client('stub-key', base_url=server.base_url)
+        # payload built by the server, and imports, before measuring
+        server.get_body(SERVICE_CODE, '')
+        rss_before = _max_rss_mb()
+        start = time.perf_counter()
+        if mode == 'query_range':
+            n_rows = len(query_range(client, SERVICE_CODE, START, end))
+        else:
+            n_rows = write_range(client, SERVICE_CODE, START, end,
+                                 CsvSink(os.path.join(tmp, 'out.csv')))
+        elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'rows': n_rows,
+            'peak_rss_mb': _max_rss_mb() - rss_before}
+
+
+def main(n_items: int = 20_000, *days: int) -> None:
+    days = days or (4, 16)
+    print(f"{'mode':<12} {'days':>5} {'rows':>9} {'seconds':>8} {'peak RSS MB':>12}")
+    for n_days in days:
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, '-m', __spec__.name, 'run', mode, str(n_items), str(n_days)],
+                check=True, capture_output=True, text=True).stdout
+            r = json.loads(out)
+            print(f"{mode:<12} {n_days:>5} {r['rows']:>9} {r['seconds']:>8.2f} "
+                  f"{r['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['run']:
+        mode, n_items, n_days = sys.argv[2:]
+        print(json.dumps(run_case(mode, int(n_items), int(n_days))))
+    else:
+        main(*map(int, sys.argv[1:]))
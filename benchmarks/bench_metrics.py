@@ -0,0 +1,49 @@
+"""
+bench_metrics.py
+================
+
+Overhead of query instrumentation, on queries served by an
+in-memory cache (no network, so the overhead is not hidden by
+the request time), then a summary of queries to the stub server.
+
+    python -m benchmarks.bench_metrics [n_calls]
+"""
+
+import sys
+import timeit
+import datetime as dt
+
+from elexon_api import Client, query, ResponseCache
+from elexon_api.metrics import Metrics, MetricsAggregator
+
+from .stub_server import StubServer
+
+PARAMS = {'SettlementDate': dt.date(2019, 6, 15), 'Period': '*'}
+
+
+def main(n_calls: int = 2000) -> None:
+    with StubServer(n_items=1) as server:
+        print(f"{'metrics':<20} {'cached query (us)':>18}")
+        for name, metrics in [('disabled', None),
+                              ('no-op', Metrics()),
+                              ('aggregator', MetricsAggregator())]:
+            client = Client('stub-key', base_url=server.base_url,
+                            cache=ResponseCache(':memory:'), metrics=metrics)
+            query(client, 'B1770', **PARAMS)
+            t = min(timeit.repeat(lambda: query(client, 'B1770', **PARAMS),
+                                  number=n_calls, repeat=5))
+            print(f"{name:<20} {t / n_calls * 1e6:>18.1f}")
+            client.close()
+
+    with StubServer(n_items=500) as server:
+        metrics = MetricsAggregator()
+        with Client('stub-key', base_url=server.base_url, metrics=metrics) as client:
+            for day in range(1, 31):
+                query(client, 'B1770', SettlementDate=dt.date(2019, 6, day),
+                      Period='*')
+        print()
+        print(metrics.report())
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,92 @@
+"""
+bench_panel.py
+==============
+
+Joining several services on settlement periods, over ``n_days``:
+:func:`~elexon_api.panel.join_panel` (one index join of typed frames)
+against successive ``pd.merge`` of string columns, as done by hand
+on ``extract_df`` outputs.
+
+Frames are built in memory, shaped like ``FUELHH`` (one row per
+period), ``B1770`` (two price categories) and ``DERSYSDATA``
+(several record types).
+
+    python -m benchmarks.bench_panel [n_days ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from elexon_api.panel import join_panel
+
+PERIODS = 48
+
+
+def make_frame(n_days: int, labels: dict, values: list,
+               date_column: str = 'settlementDate') -> pd.DataFrame:
+    """One row per day, period and combination of ``labels``."""
+    dates = pd.date_range('2019-01-01', periods=n_days, freq='D')
+    index = pd.MultiIndex.from_product(
+        [dates, np.arange(1, PERIODS + 1, dtype='int16'), *labels.values()],
+        names=[date_column, 'settlementPeriod', *labels])
+    df = index.to_frame(index=False)
+    rng = np.random.default_rng(0)
+    for name in values:
+        df[name] = rng.normal(size=len(df)).astype('float32')
+    for name in labels:
+        df[name] = df[name].astype('category')
+    return df
+
+
+def make_frames(n_days: int) -> dict:
+    return {
+        'FUELHH': make_frame(n_days, {}, ['ccgt', 'coal', 'nuclear', 'wind'],
+                             'startTimeOfHalfHrPeriod'),
+        'B1770': make_frame(n_days, {'priceCategory': ['Excess', 'Insufficient']},
+                            ['imbalancePriceAmountGBP']),
+        'DERSYSDATA': make_frame(n_days, {'recordType': ['SSP', 'SBP', 'NIV', 'PAR']},
+                                 ['systemSellPrice', 'systemBuyPrice']),
+    }
+
+
+def merge_by_hand(frames: dict) -> pd.DataFrame:
+    """Strings (as from ``extract_df``), pivoted and merged one by one."""
+    result = None
+    for service_code, df in frames.items():
+        df = df.astype(str).rename(columns={'startTimeOfHalfHrPeriod': 'settlementDate'})
+        keys = [c for c in ('priceCategory', 'recordType') if c in df]
+        if keys:
+            df = df.pivot(index=['settlementDate', 'settlementPeriod'], columns=keys).reset_index()
+            df.columns = ['_'.join(c).strip('_') for c in df.columns]
+        df = df.rename(columns=lambda c: c if c.startswith('settlement')
+                       else f"{service_code}_{c}")
+        result = df if result is None else result.merge(
+            df, on=['settlementDate', 'settlementPeriod'], how='outer')
+    return result
+
+
+def _best_of(f, *args, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(*days: int) -> None:
+    days = days or (30, 365)
+    print(f"{'days':>6} {'rows':>7} {'join_panel (ms)':>16} {'merge (ms)':>11}")
+    for n_days in days:
+        frames = make_frames(n_days)
+        n_rows = len(join_panel(frames))
+        t_panel = _best_of(join_panel, frames)
+        t_merge = _best_of(merge_by_hand, frames)
+        print(f"{n_days:>6} {n_rows:>7} {t_panel * 1e3:>16.1f} {t_merge * 1e3:>11.1f}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
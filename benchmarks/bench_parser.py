@@ -0,0 +1,68 @@
+"""
+bench_parser.py
+===============
+
+Time and peak RSS of :mod:`xmltodict` + :func:`~elexon_api.extract_df`
+against the streaming parser of :mod:`elexon_api.parser`.
+
+Each measurement runs in a fresh process, so that peak RSS
+(``ru_maxrss``) is not polluted by the other parser.
+
+    python -m benchmarks.bench_parser
+"""
+
+import sys
+import json
+import time
+import resource
+import subprocess
+
+from .fixtures import get_payload_path
+
+CASES = [('B1770', 100), ('FREQ', 20_000), ('PHYBMDATA', 100_000)]
+PARSERS = ['xmltodict', 'stream']
+
+
+def _max_rss_mb() -> float:
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(parser: str, service_code: str, n_items: int) -> dict:
+    import xmltodict
+    from elexon_api import extract_df
+    from elexon_api.parser import parse_df
+
+    payload = get_payload_path(service_code, n_items).read_bytes()
+    rss_before = _max_rss_mb()
+    start = time.perf_counter()
+    if parser == 'xmltodict':
+        df = extract_df(xmltodict.parse(payload)['response'])
+    else:
+        _, df = parse_df(payload)
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 
+            'peak_rss_mb': _max_rss_mb() - rss_before,
+            'payload_mb': len(payload) / 2**20, 
+            'rows': len(df)}
+
+
+def main() -> None:
+    print(f"{'service':<10} {'items':>8} {'MB':>6} {'parser':<10} {'seconds':>8} {'peak RSS MB':>12}")
+    for service_code, n_items in CASES:
+        get_payload_path(service_code, n_items)
+        for parser in PARSERS:
+            out = subprocess.run(
+                [sys.executable, '-m', __spec__.name, parser, service_code, str(n_items)],
+                check=True, capture_output=True, text=True).stdout
+            r = json.loads(out)
+            print(f"{service_code:<10} {n_items:>8} {r['payload_mb']:>6.1f} {parser:<10} "
+                  f"{r['seconds']:>8.3f} {r['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        parser, service_code, n_items = sys.argv[1:]
+        print(json.dumps(run_case(parser, service_code, int(n_items))))
+    else:
+        main()
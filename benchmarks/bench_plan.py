@@ -0,0 +1,90 @@
+"""
+bench_plan.py
+=============
+
+Preparing and validating query parameters: the per-call functions
+the client used before (copied below) against a precompiled
+:class:`~elexon_api.plan.ServicePlan`.
+
+    python -m benchmarks.bench_plan [n_calls]
+"""
+
+import sys
+import timeit
+import datetime as dt
+
+import pandas as pd
+
+from elexon_api.config import (DATE_FORMAT, TIME_FORMAT, DATETIME_FORMAT,
+                               DATE_PARAMS, TIME_PARAMS, DATETIME_PARAMS,
+                               REQUIRED_D, DEFAULT_PARAM_VALUES, API_BASE_URL,
+                               API_VERSION)
+from elexon_api.plan import get_plan
+
+CASES = {
+    'B1770': {'SettlementDate': dt.date(2019, 6, 15)},
+    'FREQ': {'FromDateTime': dt.datetime(2019, 6, 15), 
+             'ToDateTime': dt.datetime(2019, 6, 16)},
+    'B1010': {'StartDate': dt.date(2019, 6, 15), 'StartTime': dt.time(0),
+              'EndDate': dt.date(2019, 6, 16), 'EndTime': dt.time(0)},
+}
+
+
+def legacy_prepare(api_key, service_code: str, params: dict) -> dict:
+    params['APIKey'] = api_key
+    params.update({
+        k:v for k,v in DEFAULT_PARAM_VALUES.items() 
+        if k in REQUIRED_D[service_code] 
+        and params.get(k) is None})
+    params.update({
+        k:v.strftime(DATE_FORMAT) 
+        for k,v in params.items() 
+        if k in DATE_PARAMS 
+        and isinstance(v, (dt.date, dt.datetime, pd.Timestamp))}) 
+    params.update({
+        k:v.strftime(TIME_FORMAT) 
+        for k,v in params.items() 
+        if k in TIME_PARAMS 
+        and isinstance(v, (dt.time, dt.datetime, pd.Timestamp))})
+    params.update({
+        k:v.strftime(DATETIME_FORMAT) 
+        for k,v in params.items() 
+        if k in DATETIME_PARAMS 
+        and isinstance(v, (dt.datetime, pd.Timestamp))})
+    return params
+
+
+def legacy_validate(service_code: str, params: dict) -> None:
+    if service_code not in REQUIRED_D.keys():
+        raise ValueError(service_code)
+    passed_set = set(params.keys())
+    required_set = set(REQUIRED_D[service_code])
+    if passed_set != required_set:
+        if not required_set.issubset(passed_set):
+            raise ValueError(service_code)
+
+
+def legacy(service_code: str, params: dict) -> tuple:
+    params = legacy_prepare('key', service_code, dict(params))
+    legacy_validate(service_code, params)
+    url = f"{API_BASE_URL}/{service_code}/{API_VERSION}"
+    return url, params
+
+
+def planned(service_code: str, params: dict) -> tuple:
+    plan = get_plan(service_code, API_BASE_URL, API_VERSION)
+    return plan.url, plan.build('key', dict(params))
+
+
+def main(n_calls: int = 100_000) -> None:
+    print(f"{'service':<8} {'legacy (us)':>12} {'plan (us)':>10} {'speedup':>8}")
+    for service_code, params in CASES.items():
+        assert legacy(service_code, params) == planned(service_code, params)
+        t_legacy = timeit.timeit(lambda: legacy(service_code, params), number=n_calls)
+        t_plan = timeit.timeit(lambda: planned(service_code, params), number=n_calls)
+        print(f"{service_code:<8} {t_legacy / n_calls * 1e6:>12.2f} "
+              f"{t_plan / n_calls * 1e6:>10.2f} {t_legacy / t_plan:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,89 @@
+"""
+bench_record_type.py
+====================
+
+Splitting items by record type, from XML: :mod:`xmltodict` followed
+by :func:`~elexon_api.extract_df_by_record_type` (one frame per record
+type, from the lists of items split by
+:func:`~elexon_api.utils.split_list_of_dicts`), against
+:func:`~elexon_api.parser.parse_frames_by_record_type` (a single frame,
+split by a sort on the factorized ``recordType``). Both give the same
+columns for each record type, which is checked.
+
+Items are those of ``PHYBMDATA`` fixtures, with some fields left out
+or empty, so that record types have different fields.
+
+    python -m benchmarks.bench_record_type [n_items ...]
+"""
+
+import sys
+import time
+
+import xmltodict
+
+from elexon_api import extract_df_by_record_type
+from elexon_api.parser import parse_frames_by_record_type
+
+from .fixtures import make_items, HEADER, FOOTER
+
+SIZES = [10_000, 100_000, 1_000_000]
+N_TEMPLATES = 1000
+
+
+def make_templates() -> list:
+    """Items with the last field left out of some record types and
+    the third one empty in others."""
+    templates = []
+    for item in make_items('PHYBMDATA', N_TEMPLATES):
+        fields = list(item.items())
+        if item['recordType'] in ('BOALF', 'MEL'):
+            fields = fields[:-1]
+        elif item['recordType'] == 'PN':
+            fields[2] = (fields[2][0], '')
+        templates.append(fields)
+    return templates
+
+
+def make_payload(n_items: int) -> bytes:
+    # copies of a few templates, to keep memory reasonable at 1M items
+    templates = ["<item>" + "".join(f"<{k}>{v}</{k}>" for k, v in item) + "</item>"
+                 for item in make_templates()]
+    items = "".join(templates[i % N_TEMPLATES] for i in range(n_items))
+    header = HEADER.format(service_code='PHYBMDATA', query='')
+    return (header + items + FOOTER).encode('utf-8')
+
+
+def _time(f, *args) -> float:
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def _report(label: str, n_items: int, t_old: float, t_new: float) -> None:
+    print(f"{label:<10} {n_items:>10} {t_old:>14.3f} {t_new:>11.3f} {t_old / t_new:>8.1f}x")
+
+
+def extract_with_xmltodict(payload: bytes) -> dict:
+    return extract_df_by_record_type(xmltodict.parse(payload)['response'], 'PHYBMDATA')
+
+
+def check_columns(payload: bytes) -> None:
+    old = extract_with_xmltodict(payload)
+    _, new = parse_frames_by_record_type(payload, 'PHYBMDATA')
+    assert list(old) == list(new)
+    for record_type, df in old.items():
+        assert list(df.columns) == list(new[record_type].columns), record_type
+
+
+def main(*sizes: int) -> None:
+    check_columns(make_payload(N_TEMPLATES))
+    print(f"{'input':<10} {'items':>10} {'xmltodict (s)':>14} {'stream (s)':>11} {'speedup':>8}")
+    for n_items in sizes or SIZES:
+        payload = make_payload(n_items)
+        _report("XML", n_items,
+                _time(extract_with_xmltodict, payload),
+                _time(parse_frames_by_record_type, payload, 'PHYBMDATA'))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,62 @@
+"""
+bench_retry.py
+==============
+
+Range queries against a stub server throttling every few requests
+(429 with ``Retry-After``), with and without retries.
+
+    python -m benchmarks.bench_retry
+"""
+
+import time
+import asyncio
+
+from elexon_api import Client, query_range, query_async
+from elexon_api.backfill import split_range
+from elexon_api.scheduler import Scheduler
+
+from .stub_server import StubServer
+
+SERVICE_CODE = 'B1770'
+START, END = '2019-01-01', '2019-03-31'
+
+
+def run_sync(scheduler: Scheduler) -> None:
+    with StubServer(fail_every=7, retry_after=0.05) as server:
+        client = Client('stub-key', base_url=server.base_url, scheduler=scheduler)
+        start = time.perf_counter()
+        try:
+            df = query_range(client, SERVICE_CODE, START, END, max_workers=8)
+            outcome = f"{len(df)} rows"
+        except Exception as e:
+            outcome = f"failed: {e!r}"
+        elapsed = time.perf_counter() - start
+        client.close()
+        print(f"sync,  max_retries={scheduler.max_retries}: {outcome}, "
+              f"{server.n_errors} throttled, {scheduler.retries} retries, {elapsed:.2f}s")
+
+
+async def run_async(scheduler: Scheduler) -> None:
+    with StubServer(fail_every=7, retry_after=0.05) as server:
+        chunks = split_range(SERVICE_CODE, START, END)
+        async with Client('stub-key', base_url=server.base_url, 
+                          scheduler=scheduler) as client:
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(query_async(client, SERVICE_CODE, **p) for p in chunks),
+                return_exceptions=True)
+            elapsed = time.perf_counter() - start
+        n_failed = sum(isinstance(r, Exception) for r in results)
+        print(f"async, max_retries={scheduler.max_retries}, rate=50/s: "
+              f"{len(results) - n_failed}/{len(results)} ok, "
+              f"{server.n_errors} throttled, {scheduler.retries} retries, {elapsed:.2f}s")
+
+
+def main() -> None:
+    run_sync(Scheduler(max_retries=0))
+    run_sync(Scheduler(max_in_flight=4))
+    asyncio.run(run_async(Scheduler(rate=50, burst=10, max_in_flight=8)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+bench_session.py
+================
+
+Requests/sec against the local stub server, with a fresh connection
+per request (the previous behaviour) and with the pooled sessions
+owned by :class:`~elexon_api.Client`. Both paths parse and validate
+the response. The stub serves plain HTTP on localhost, so the gap
+is a lower bound of the saving against the real (TLS) endpoint.
+
+    python -m benchmarks.bench_session [n_requests]
+"""
+
+import sys
+import time
+import asyncio
+
+import aiohttp
+import requests
+import xmltodict
+
+from elexon_api import Client, query, query_async
+from elexon_api.client import (prepare_query_params, get_service_url, 
+                               validate_response)
+from elexon_api.config import HEADER
+
+from .stub_server import StubServer
+
+SERVICE_CODE = 'B1770'
+PARAMS = {'SettlementDate': '2019-06-15', 'Period': '*'}
+
+
+def _report(label: str, n: int, elapsed: float) -> None:
+    print(f"{label:<32} {n / elapsed:10.1f} req/s")
+
+
+def bench_sync_unpooled(client: Client, n: int) -> float:
+    url = get_service_url(client.base_url, client.api_version, SERVICE_CODE)
+    params = prepare_query_params(client.api_key, SERVICE_CODE, dict(PARAMS))
+    start = time.perf_counter()
+    for _ in range(n):
+        response = requests.get(url, params=params, headers=HEADER)
+        response.raise_for_status()
+        r_dict = xmltodict.parse(response.text)['response']
+        validate_response(SERVICE_CODE, params, r_dict)
+    return time.perf_counter() - start
+
+
+def bench_sync_pooled(client: Client, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        query(client, SERVICE_CODE, **PARAMS)
+    return time.perf_counter() - start
+
+
+async def bench_async_unpooled(client: Client, n: int) -> float:
+    url = get_service_url(client.base_url, client.api_version, SERVICE_CODE)
+    params = prepare_query_params(client.api_key, SERVICE_CODE, dict(PARAMS))
+
+    async def _one():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, params=params, headers=HEADER) as response:
+                response.raise_for_status()
+                r_text = await response.text()
+        r_dict = xmltodict.parse(r_text)['response']
+        validate_response(SERVICE_CODE, params, r_dict)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_one() for _ in range(n)))
+    return time.perf_counter() - start
+
+
+async def bench_async_pooled(client: Client, n: int) -> float:
+    async with client:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(query_async(client, SERVICE_CODE, **PARAMS) for _ in range(n)))
+        return time.perf_counter() - start
+
+
+def main(n: int = 500) -> None:
+    with StubServer() as server:
+        with Client('stub-key', base_url=server.base_url) as client:
+            _report("sync, new connection per call", n, bench_sync_unpooled(client, n))
+            _report("sync, pooled session", n, bench_sync_pooled(client, n))
+        client = Client('stub-key', base_url=server.base_url)
+        _report("async, new session per call", n, 
+                asyncio.run(bench_async_unpooled(client, n)))
+        _report("async, pooled session", n, 
+                asyncio.run(bench_async_pooled(client, n)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
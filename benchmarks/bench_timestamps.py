@@ -0,0 +1,71 @@
+"""
+bench_timestamps.py
+===================
+
+UTC start of settlement periods over ``n_days``:
+:func:`~elexon_api.utils.get_period_start_utc` (one conversion per
+date, periods added as offsets) against converting each row with
+``datetime`` arithmetic, as done after ``extract_df``.
+
+    python -m benchmarks.bench_timestamps [n_days ...]
+"""
+
+import sys
+import time
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from elexon_api.utils import get_period_start_utc, get_periods_per_day
+
+TZ = ZoneInfo('Europe/London')
+
+
+def make_frame(n_days: int) -> pd.DataFrame:
+    """One row per settlement period, clock-change days included."""
+    dates = pd.date_range('2015-01-01', periods=n_days, freq='D')
+    n_periods = get_periods_per_day(dates)
+    return pd.DataFrame({
+        'settlementDate': dates.repeat(n_periods),
+        'settlementPeriod': np.concatenate([np.arange(1, n + 1) for n in n_periods]),
+    })
+
+
+def convert_by_row(df: pd.DataFrame) -> pd.Series:
+    def _convert(date, period):
+        midnight = dt.datetime.combine(date.date(), dt.time(), tzinfo=TZ)
+        return (midnight.astimezone(dt.timezone.utc)
+                + dt.timedelta(minutes=30 * (int(period) - 1)))
+    return pd.Series([_convert(d, p) for d, p in
+                      zip(df['settlementDate'], df['settlementPeriod'])])
+
+
+def convert_vectorized(df: pd.DataFrame) -> pd.DatetimeIndex:
+    return get_period_start_utc(df['settlementDate'], df['settlementPeriod'])
+
+
+def _best_of(f, *args, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(*days: int) -> None:
+    days = days or (365, 5 * 365)
+    print(f"{'days':>6} {'rows':>8} {'vectorized (ms)':>16} {'by row (ms)':>12}")
+    for n_days in days:
+        df = make_frame(n_days)
+        expected = convert_by_row(df)
+        assert (convert_vectorized(df) == pd.DatetimeIndex(expected)).all()
+        t_vector = _best_of(convert_vectorized, df)
+        t_row = _best_of(convert_by_row, df, repeat=1)
+        print(f"{n_days:>6} {len(df):>8} {t_vector * 1e3:>16.1f} {t_row * 1e3:>12.1f}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
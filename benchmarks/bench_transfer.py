@@ -0,0 +1,75 @@
+"""
+bench_transfer.py
+=================
+
+Transfer of large ``PHYBMDATA`` responses through a link of limited
+bandwidth (simulated by the stub server), for sync queries:
+
+* ``identity``: uncompressed responses;
+* ``gzip``: compressed responses (the client default);
+* ``revalidate``: expired cached responses, revalidated by
+  conditional requests answered with 304.
+
+Reports bytes on the wire (``wire_bytes`` counter of the metrics),
+the compression ratio and the time per query.
+
+    python -m benchmarks.bench_transfer [n_queries] [n_items] [MB/s]
+"""
+
+import sys
+import time
+import datetime as dt
+
+from elexon_api import Client, query_df, ResponseCache, MetricsAggregator
+from elexon_api.config import HEADER
+
+from .stub_server import StubServer
+
+SERVICE_CODE = 'PHYBMDATA'
+PARAMS = {'SettlementDate': dt.date(2019, 6, 15), 'SettlementPeriod': '*'}
+MODES = {
+    'identity': {**HEADER, 'Accept-Encoding': 'identity'},
+    'gzip': HEADER,
+    'revalidate': HEADER,
+}
+
+
+def run(server: StubServer, mode: str, n_queries: int) -> dict:
+    metrics = MetricsAggregator()
+    cache = ResponseCache(':memory:') if mode == 'revalidate' else None
+    with Client('stub-key', base_url=server.base_url,
+                cache=cache, metrics=metrics) as client:
+        # warm up: connection, imports and cached response
+        query_df(client, SERVICE_CODE, header=MODES[mode], **PARAMS)
+        metrics.clear()
+        elapsed = 0.
+        for _ in range(n_queries):
+            if cache is not None:
+                # expire the entry, it is revalidated by the next query
+                with cache._conn:
+                    cache._conn.execute("UPDATE responses SET expires = 0")
+            start = time.perf_counter()
+            query_df(client, SERVICE_CODE, header=MODES[mode], **PARAMS)
+            elapsed += time.perf_counter() - start
+    counts = {name: value for (_, name), value in metrics.get_counts().items()}
+    return {'seconds': elapsed / n_queries,
+            'bytes': counts.get('bytes', 0) / n_queries,
+            'wire_bytes': counts.get('wire_bytes', 0) / n_queries,
+            'not_modified': counts.get('not_modified', 0)}
+
+
+def main(n_queries: int = 10, n_items: int = 20_000, mb_per_s: float = 10.) -> None:
+    print(f"{n_queries} queries of {n_items} items, link of {mb_per_s:g} MB/s")
+    print(f"{'mode':<11} {'body (kB)':>10} {'wire (kB)':>10} {'ratio':>6} "
+          f"{'304s':>5} {'s/query':>8}")
+    with StubServer(n_items=n_items, fixtures=True, compress=True, etag=True,
+                    bandwidth=mb_per_s * 1e6) as server:
+        for mode in MODES:
+            r = run(server, mode, n_queries)
+            ratio = r['bytes'] / r['wire_bytes'] if r['wire_bytes'] else float('nan')
+            print(f"{mode:<11} {r['bytes'] / 1e3:>10.0f} {r['wire_bytes'] / 1e3:>10.0f} "
+                  f"{ratio:>6.1f} {r['not_modified']:>5.0f} {r['seconds']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]), *map(float, sys.argv[3:4]))
@@ -0,0 +1,185 @@
+"""
+fixtures.py
+===========
+
+Synthetic BMRS payloads, shaped like recorded responses.
+
+Each service is described by the fields of its items, and a
+function generating the value of a field for the ``i``-th item
+(``None`` if the item has no such field, e.g. for fields specific
+to some record types).
+
+The payloads are generated rather than recorded: recording needs
+an API key and network access, which the benchmarks are meant to
+run without, and generated payloads can be scaled to any number of
+items. Field names, order and value formats follow BMRS responses,
+but values are random, so timings of parsing and type conversion
+are representative, not those of compression or of repeated values.
+Recorded responses (``<service_code>.xml``) put in ``RECORDED_DIR``
+(``ELEXON_BENCH_PAYLOADS``, defaults to ``benchmarks/payloads``) are
+used instead, whatever the number of items asked.
+"""
+
+import os
+import random
+import tempfile
+from pathlib import Path
+from typing import Dict, Callable, List, Optional
+
+HEADER = (
+    "<?xml version='1.0' encoding='UTF-8'?>"
+    "<response>"
+    "<responseMetadata>"
+    "<httpCode>200</httpCode>"
+    "<errorType>Ok</errorType>"
+    "<description>Success</description>"
+    "<queryString>{query}</queryString>"
+    "</responseMetadata>"
+    "<responseBody>"
+    "<dataItem>{service_code}</dataItem>"
+    "<responseList>")
+
+FOOTER = "</responseList></responseBody></response>"
+
+FIXTURES_DIR = Path(tempfile.gettempdir()) / 'elexon_api_fixtures'
+RECORDED_DIR = Path(os.environ.get('ELEXON_BENCH_PAYLOADS',
+                                   Path(__file__).parent / 'payloads'))
+
+PHYBMDATA_RECORD_TYPES = ['PN', 'QPN', 'MEL', 'MIL', 'BOALF', 'BOD']
+BM_UNITS = [f"T_UNIT-{i}" for i in range(200)]
+DERSYSDATA_RECORD_TYPES = ['SSP', 'SBP', 'NIV', 'BSAD', 'RPAR', 'PAR', 'TLM', 'STOR']
+FUEL_TYPES = ['CCGT', 'OCGT', 'OIL', 'COAL', 'NUCLEAR', 'WIND', 'PS', 'NPSHYD',
+              'INTFR', 'INTIRL', 'INTNED', 'INTEW', 'BIOMASS', 'OTHER']
+
+
+def _period(i: int) -> int:
+    return i % 48 + 1
+
+
+def _time(i: int) -> str:
+    return f"2019-06-15 {(i // 120) % 24:02d}:{(i // 2) % 60:02d}:{(i % 2) * 30:02d}"
+
+
+def _dersys_record_type(i: int) -> str:
+    return DERSYSDATA_RECORD_TYPES[i % len(DERSYSDATA_RECORD_TYPES)]
+
+
+def _only(record_types: str, value: Callable[[int], object]) -> Callable[[int], object]:
+    """Field only present in items of some DERSYSDATA record types."""
+    record_types = record_types.split()
+    return lambda i: value(i) if _dersys_record_type(i) in record_types else None
+
+
+SERVICE_FIELDS: Dict[str, Dict[str, Callable[[int], object]]] = {
+    'B1770': {
+        'documentType'              : lambda i: 'Imbalance prices',
+        'businessType'              : lambda i: 'Balance energy deviation',
+        'processType'               : lambda i: 'Realised',
+        'timeSeriesID'              : lambda i: f"ELX-EMFIP-IMBP-TS-{i}",
+        'settlementDate'            : lambda i: '2019-06-15',
+        'settlementPeriod'          : _period,
+        'imbalancePriceAmountGBP'   : lambda i: f"{random.uniform(-50, 150):.5f}",
+        'priceCategory'             : lambda i: ('Excess balance', 'Insufficient balance')[i % 2],
+        'curveType'                 : lambda i: 'Sequential fixed size block',
+        'resolution'                : lambda i: 'PT30M',
+        'activeFlag'                : lambda i: 'Y',
+    },
+    'PHYBMDATA': {
+        'recordType'                : lambda i: PHYBMDATA_RECORD_TYPES[i % len(PHYBMDATA_RECORD_TYPES)],
+        'bmUnitID'                  : lambda i: BM_UNITS[i % len(BM_UNITS)],
+        'bmUnitType'                : lambda i: 'T',
+        'leadPartyName'             : lambda i: 'Some Generation Ltd',
+        'ngcBmUnitName'             : lambda i: f"UNIT-{i % len(BM_UNITS)}",
+        'settlementDate'            : lambda i: '2019-06-15',
+        'settlementPeriod'          : _period,
+        'timeFrom'                  : _time,
+        'pnLevelFrom'               : lambda i: f"{random.uniform(0, 500):.3f}",
+        'timeTo'                    : _time,
+        'pnLevelTo'                 : lambda i: f"{random.uniform(0, 500):.3f}",
+        'activeFlag'                : lambda i: 'Y',
+    },
+    'DERSYSDATA': {
+        'recordType'                : _dersys_record_type,
+        'settlementDate'            : lambda i: '2019-06-15',
+        'settlementPeriod'          : _period,
+        'systemSellPrice'           : _only('SSP PAR RPAR', lambda i: f"{random.uniform(-50, 150):.5f}"),
+        'systemBuyPrice'            : _only('SBP PAR RPAR', lambda i: f"{random.uniform(-50, 150):.5f}"),
+        'bSADDefault'               : _only('BSAD', lambda i: ('T', 'F')[i % 2]),
+        'priceDerivationCode'       : _only('SSP SBP', lambda i: ('N', 'P', 'A')[i % 3]),
+        'reserveScarcityPrice'      : _only('STOR', lambda i: f"{random.uniform(0, 50):.2f}"),
+        'indicativeNetImbalanceVolume': _only('NIV', lambda i: f"{random.uniform(-800, 800):.4f}"),
+        'sellPriceAdjustment'       : _only('SSP BSAD', lambda i: f"{random.uniform(-5, 5):.2f}"),
+        'buyPriceAdjustment'        : _only('SBP BSAD', lambda i: f"{random.uniform(-5, 5):.2f}"),
+        'replacementPrice'          : _only('RPAR', lambda i: f"{random.uniform(0, 100):.5f}"),
+        'replacementPriceReferenceVolume': _only('RPAR', lambda i: f"{random.uniform(0, 500):.3f}"),
+        'totalSystemAcceptedOfferVolume': _only('TLM PAR', lambda i: f"{random.uniform(0, 2000):.4f}"),
+        'totalSystemAcceptedBidVolume': _only('TLM PAR', lambda i: f"{random.uniform(-2000, 0):.4f}"),
+        'activeFlag'                : lambda i: 'Y',
+    },
+    'FREQ': {
+        'recordType'                : lambda i: 'FREQ',
+        'reportSnapshotTime'        : _time,
+        'spotTime'                  : _time,
+        'frequency'                 : lambda i: f"{random.uniform(49.8, 50.2):.3f}",
+        'activeFlag'                : lambda i: 'Y',
+    },
+    'FUELHH': {
+        'recordType'                : lambda i: 'FUELHH',
+        'startTimeOfHalfHrPeriod'   : lambda i: '2019-06-15',
+        'settlementPeriod'          : _period,
+        **{f.lower(): (lambda i: str(random.randint(0, 20000))) for f in FUEL_TYPES},
+        'activeFlag'                : lambda i: 'Y',
+    },
+}
+
+
+def make_items(service_code: str, n_items: int, seed: int = 0) -> List[dict]:
+    """Items of a response, as dictionaries of strings."""
+    random.seed(seed)
+    fields = SERVICE_FIELDS[service_code]
+    items = []
+    for i in range(n_items):
+        values = ((k, f(i)) for k, f in fields.items())
+        items.append({k: str(v) for k, v in values if v is not None})
+    return items
+
+
+def make_payload(service_code: str, n_items: int,
+                 query: str = '', seed: int = 0) -> bytes:
+    """Full XML response with ``n_items`` items."""
+    parts = [HEADER.format(service_code=service_code, query=query)]
+    for item in make_items(service_code, n_items, seed):
+        parts.append("<item>")
+        parts.extend(f"<{k}>{v}</{k}>" for k, v in item.items())
+        parts.append("</item>")
+    parts.append(FOOTER)
+    return "".join(parts).encode('utf-8')
+
+
+def get_recorded_path(service_code: str) -> Optional[Path]:
+    """Path of the recorded response of a service, ``None`` if missing."""
+    path = RECORDED_DIR / f"{service_code}.xml"
+    return path if path.is_file() else None
+
+
+def load_payload(service_code: str, n_items: int) -> bytes:
+    """Recorded response of a service if there is one, else a synthetic one."""
+    path = get_recorded_path(service_code)
+    if path is not None:
+        return path.read_bytes()
+    return make_payload(service_code, n_items)
+
+
+def get_payload_path(service_code: str, n_items: int) -> Path:
+    """Write payload to the temporary directory once, and return its path.
+
+    The recorded response of the service, if there is one.
+    """
+    recorded = get_recorded_path(service_code)
+    if recorded is not None:
+        return recorded
+    path = FIXTURES_DIR / f"{service_code}_{n_items}.xml"
+    if not path.is_file():
+        FIXTURES_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(make_payload(service_code, n_items))
+    return path
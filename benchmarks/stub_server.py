@@ -0,0 +1,272 @@
+"""
+stub_server.py
+==============
+
+Local HTTP server mimicking the BMRS API, used by the benchmarks.
+
+Responses are, in order of preference: recorded responses found in
+``payload_dir`` (``<service_code>.xml``), synthetic payloads of
+:mod:`.fixtures` (if ``fixtures``) or a generic response.
+They can be gzipped, carry an ``ETag`` (answering conditional
+requests with 304) and be sent through a link of limited bandwidth.
+Windows larger than ``max_window`` get an API error, like queries
+rejected by BMRS.
+"""
+
+import gzip
+import time
+import hashlib
+import threading
+import datetime as dt
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .fixtures import SERVICE_FIELDS, make_payload
+
+SUCCESS_BODY = (
+    "<?xml version='1.0' encoding='UTF-8'?>"
+    "<response>"
+    "<responseMetadata>"
+    "<httpCode>200</httpCode>"
+    "<errorType>Ok</errorType>"
+    "<description>Success</description>"
+    "<queryString>{query}</queryString>"
+    "</responseMetadata>"
+    "<responseBody>"
+    "<dataItem>{service_code}</dataItem>"
+    "<responseList>{items}</responseList>"
+    "</responseBody>"
+    "</response>")
+
+ERROR_BODY = (
+    "<?xml version='1.0' encoding='UTF-8'?>"
+    "<response>"
+    "<responseMetadata>"
+    "<httpCode>400</httpCode>"
+    "<errorType>Bad Request</errorType>"
+    "<description>{description}</description>"
+    "<queryString>{query}</queryString>"
+    "</responseMetadata>"
+    "</response>")
+
+# (from, to) parameters of windows
+WINDOW_PARAMS = [('FromDate', 'ToDate'), ('FromSettlementDate', 'ToSettlementDate'),
+                 ('FromClearedDate', 'ToClearedDate'), ('FromDateTime', 'ToDateTime'),
+                 ('StartDate', 'EndDate')]
+
+ITEM = ("<item>"
+        "<recordType>{service_code}</recordType>"
+        "<settlementDate>2019-06-15</settlementDate>"
+        "<settlementPeriod>{period}</settlementPeriod>"
+        "<quantity>{quantity}</quantity>"
+        "</item>")
+
+
+def get_window_days(query: dict) -> float:
+    """Days covered by the window of a query, 0 if not windowed."""
+    for from_param, to_param in WINDOW_PARAMS:
+        if from_param in query and to_param in query:
+            t0 = dt.datetime.fromisoformat(query[from_param][0])
+            t1 = dt.datetime.fromisoformat(query[to_param][0])
+            if len(query[to_param][0]) == 10:
+                # date bounds are inclusive
+                t1 += dt.timedelta(days=1)
+            return (t1 - t0) / dt.timedelta(days=1)
+    return 0.
+
+
+def make_body(service_code: str, query: str = '', n_items: int = 48) -> bytes:
+    """Build a successful response with ``n_items`` items."""
+    items = "".join(
+        ITEM.format(service_code=service_code, 
+                    period=i % 48 + 1, 
+                    quantity=f"{i * 1.5:.3f}")
+        for i in range(n_items))
+    body = SUCCESS_BODY.format(
+        service_code=service_code, query=query, items=items)
+    return body.encode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        error = self.server.get_error()
+        if error is not None:
+            status, headers = error
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        url = urlparse(self.path)
+        service_code = url.path.strip('/').split('/')[-2]
+        max_window = self.server.max_window
+        if max_window and get_window_days(parse_qs(url.query)) > max_window:
+            with self.server._lock:
+                self.server.n_rejected += 1
+            body = ERROR_BODY.format(description='Date range too large',
+                                     query='').encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        body = self.server.get_body(service_code, url.query)
+        etag = None
+        if self.server.etag:
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if self.server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = self.server.get_gzipped(service_code, url.query)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self._write(body)
+
+    def _write(self, body: bytes, chunk_size: int = 2**16) -> None:
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for i in range(0, len(body), chunk_size):
+            chunk = body[i:i + chunk_size]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded stub server, serving a fixed number of items per response.
+
+    Use as a context manager, the server runs in a background thread.
+
+    Parameters
+    ----------
+    n_items : int
+        Items in each response.
+    port : int
+        Port to listen on, any free one if 0.
+    fail_every : int
+        If positive, every ``fail_every``-th request gets ``fail_status``.
+    fail_status : int
+        Status of injected errors, e.g. 429 to simulate throttling.
+    retry_after : float
+        If passed, value of the ``Retry-After`` header of injected errors.
+    latency : float
+        Delay (seconds) before each response.
+    fixtures : bool
+        If true, serve the payloads of :mod:`.fixtures` (``n_items``
+        items) for the services they describe.
+    payload_dir : str or Path
+        Directory of recorded responses, served as they are.
+    compress : bool
+        If true, gzip responses to clients accepting it.
+    etag : bool
+        If true, send the ``ETag`` of responses, and answer 304
+        to requests with a matching ``If-None-Match``.
+    bandwidth : float
+        If passed, bytes per second at which bodies are sent.
+    max_window : float
+        If passed, largest window (days) accepted, larger ones get
+        an API error.
+    """
+    daemon_threads = True
+
+    def __init__(self, n_items: int = 48, port: int = 0,
+                 fail_every: int = 0, fail_status: int = 429,
+                 retry_after: float = None, latency: float = 0.,
+                 fixtures: bool = False, payload_dir=None,
+                 compress: bool = False, etag: bool = False,
+                 bandwidth: float = None, max_window: float = None):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.n_items = n_items
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.latency = latency
+        self.fixtures = fixtures
+        self.payload_dir = None if payload_dir is None else Path(payload_dir)
+        self.compress = compress
+        self.etag = etag
+        self.bandwidth = bandwidth
+        self.max_window = max_window
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_rejected = 0
+        self._lock = threading.Lock()
+        self._bodies = {}
+        self._gzipped = {}
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # clients closing pooled connections are not errors here
+        pass
+
+    def get_error(self):
+        """Status and headers of an injected error, or ``None``."""
+        with self._lock:
+            self.n_requests += 1
+            if not self.fail_every or self.n_requests % self.fail_every:
+                return None
+            self.n_errors += 1
+        headers = {}
+        if self.retry_after is not None:
+            headers['Retry-After'] = str(self.retry_after)
+        return self.fail_status, headers
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address
+        return f"http://{host}:{port}/BMRS"
+
+    def get_body(self, service_code: str, query: str) -> bytes:
+        # queryString is not echoed, so bodies can be reused
+        if service_code not in self._bodies:
+            self._bodies[service_code] = self._load_body(service_code)
+        return self._bodies[service_code]
+
+    def get_gzipped(self, service_code: str, query: str) -> bytes:
+        if service_code not in self._gzipped:
+            self._gzipped[service_code] = gzip.compress(
+                self.get_body(service_code, query), compresslevel=6)
+        return self._gzipped[service_code]
+
+    def _load_body(self, service_code: str) -> bytes:
+        if self.payload_dir is not None:
+            path = self.payload_dir / f"{service_code}.xml"
+            if path.is_file():
+                return path.read_bytes()
+        if self.fixtures and service_code in SERVICE_FIELDS:
+            return make_payload(service_code, self.n_items)
+        return make_body(service_code, n_items=self.n_items)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,253 @@
+"""
+suite.py
+========
+
+Benchmark suite, run offline against the local stub server
+(see :mod:`.stub_server`) and the payloads of :mod:`.fixtures`,
+synthetic unless recorded responses are put in its ``RECORDED_DIR``:
+
+* ``B1770``: small items, no record type;
+* ``PHYBMDATA``: large responses, a few record types;
+* ``DERSYSDATA``: many record types, with different fields;
+* ``FREQ``: datetime window.
+
+Cases are written as `asv <https://asv.readthedocs.io>`_ benchmarks
+(``asv run``, see ``asv.conf.json``): ``time_*`` for durations,
+``track_*`` for the memory kept per response. They can be run
+without asv:
+
+    python -m benchmarks.suite [n_items ...]
+"""
+
+import sys
+import time
+import tracemalloc
+import asyncio
+import datetime as dt
+import itertools
+from statistics import median
+
+import xmltodict
+
+from elexon_api import (Client, Response, query, query_df, query_async, 
+                        query_df_async, extract_df, extract_df_by_record_type)
+
+from elexon_api.parser import parse_frames_by_record_type
+
+from .fixtures import RECORDED_DIR, SERVICE_FIELDS, load_payload
+from .stub_server import StubServer
+
+SERVICES = ['B1770', 'PHYBMDATA', 'DERSYSDATA', 'FREQ']
+SIZES = [100, 10_000]
+LATENCY = 0.   # seconds, added by the stub to each response
+N_CONCURRENT = 10
+
+QUERY_PARAMS = {
+    'B1770': {'SettlementDate': dt.date(2019, 6, 15), 'Period': '*'},
+    'PHYBMDATA': {'SettlementDate': dt.date(2019, 6, 15), 'SettlementPeriod': '*'},
+    'DERSYSDATA': {'FromSettlementDate': dt.date(2019, 6, 15),
+                   'ToSettlementDate': dt.date(2019, 6, 15),
+                   'SettlementPeriod': '*'},
+    'FREQ': {'FromDateTime': dt.datetime(2019, 6, 15),
+             'ToDateTime': dt.datetime(2019, 6, 16)},
+}
+
+
+class Query:
+    """Sync queries, through a pooled session."""
+    params = [SERVICES, SIZES]
+    param_names = ['service_code', 'n_items']
+    timeout = 300
+
+    def setup(self, service_code, n_items):
+        self.server = StubServer(n_items=n_items, latency=LATENCY,
+                                 fixtures=True, payload_dir=RECORDED_DIR).__enter__()
+        self.client = Client('stub-key', base_url=self.server.base_url)
+        # open the connection and build the payload
+        query(self.client, service_code, **QUERY_PARAMS[service_code])
+
+    def teardown(self, service_code, n_items):
+        self.client.close()
+        self.server.__exit__(None, None, None)
+
+    def time_query(self, service_code, n_items):
+        query(self.client, service_code, **QUERY_PARAMS[service_code])
+
+    def time_query_df(self, service_code, n_items):
+        query_df(self.client, service_code, **QUERY_PARAMS[service_code])
+
+
+class QueryAsync:
+    """Async queries, one at a time and ``N_CONCURRENT`` at once."""
+    params = [SERVICES, SIZES]
+    param_names = ['service_code', 'n_items']
+    timeout = 300
+
+    def setup(self, service_code, n_items):
+        self.server = StubServer(n_items=n_items, latency=LATENCY,
+                                 fixtures=True, payload_dir=RECORDED_DIR).__enter__()
+        self.client = Client('stub-key', base_url=self.server.base_url)
+        # the async session is bound to the loop, keep the same one
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(
+            query_async(self.client, service_code, **QUERY_PARAMS[service_code]))
+
+    def teardown(self, service_code, n_items):
+        self.loop.run_until_complete(self.client.aclose())
+        self.loop.close()
+        self.server.__exit__(None, None, None)
+
+    def time_query_async(self, service_code, n_items):
+        self.loop.run_until_complete(
+            query_async(self.client, service_code, **QUERY_PARAMS[service_code]))
+
+    def time_query_df_async(self, service_code, n_items):
+        self.loop.run_until_complete(
+            query_df_async(self.client, service_code, **QUERY_PARAMS[service_code]))
+
+    def time_query_async_concurrent(self, service_code, n_items):
+        async def _gather():
+            return await asyncio.gather(*[
+                query_async(self.client, service_code, **QUERY_PARAMS[service_code])
+                for _ in range(N_CONCURRENT)])
+        self.loop.run_until_complete(_gather())
+
+
+class Extract:
+    """DataFrames from responses parsed by :mod:`xmltodict`."""
+    params = [SERVICES, SIZES]
+    param_names = ['service_code', 'n_items']
+
+    def setup(self, service_code, n_items):
+        self.payload = load_payload(service_code, n_items)
+        self.r_dict = xmltodict.parse(self.payload)['response']
+
+    def time_parse(self, service_code, n_items):
+        xmltodict.parse(self.payload)
+
+    def time_extract_df(self, service_code, n_items):
+        extract_df(self.r_dict)
+
+    def time_extract_df_dtypes(self, service_code, n_items):
+        extract_df(self.r_dict, service_code)
+
+
+class ExtractByRecordType:
+    """One DataFrame per record type, for services which have them:
+    split of the :mod:`xmltodict` items (alone, and with parse and
+    dtypes) against the vectorized split of the streamed body."""
+    params = [SERVICES, SIZES]
+    param_names = ['service_code', 'n_items']
+
+    def setup(self, service_code, n_items):
+        if 'recordType' not in SERVICE_FIELDS[service_code]:
+            # asv skips cases whose setup raises NotImplementedError
+            raise NotImplementedError
+        self.payload = load_payload(service_code, n_items)
+        self.r_dict = xmltodict.parse(self.payload)['response']
+
+    def time_extract_df_by_record_type(self, service_code, n_items):
+        extract_df_by_record_type(self.r_dict)
+
+    def time_parse_extract_df_by_record_type(self, service_code, n_items):
+        r_dict = xmltodict.parse(self.payload)['response']
+        extract_df_by_record_type(r_dict, service_code)
+
+    def time_parse_frames_by_record_type(self, service_code, n_items):
+        parse_frames_by_record_type(self.payload, service_code)
+
+
+def get_retained_bytes(f, *args) -> int:
+    """Memory allocated by ``f(*args)`` and still held by its result."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = f(*args)
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+class ResponseMemory:
+    """Memory kept per response: :mod:`xmltodict` dictionary (as returned
+    by ``query``) against :class:`~elexon_api.Response` (``query_response``),
+    with and without its memoized DataFrame. The response body is counted
+    in the latter, which keeps it."""
+    params = [SERVICES, SIZES]
+    param_names = ['service_code', 'n_items']
+    unit = 'bytes'
+
+    def setup(self, service_code, n_items):
+        self.payload = load_payload(service_code, n_items)
+        # imports and caches (e.g. dtypes) are not kept by the responses
+        Response.from_bytes(self.payload, service_code).to_df()
+
+    def _copy_payload(self) -> bytes:
+        # a new body, as downloaded by a query
+        return bytes(memoryview(self.payload))
+
+    def track_dict(self, service_code, n_items):
+        return get_retained_bytes(
+            lambda: xmltodict.parse(self._copy_payload())['response'])
+
+    def track_response(self, service_code, n_items):
+        return get_retained_bytes(
+            lambda: Response.from_bytes(self._copy_payload(), service_code))
+
+    def track_response_df(self, service_code, n_items):
+        def _response_with_df():
+            response = Response.from_bytes(self._copy_payload(), service_code)
+            response.to_df()
+            return response
+        return get_retained_bytes(_response_with_df)
+
+
+BENCHMARKS = [Query, QueryAsync, Extract, ExtractByRecordType, ResponseMemory]
+
+
+#--------------------------------------------------------
+#                   STANDALONE RUNNER
+#--------------------------------------------------------
+def _time(f, *args, min_time: float = 0.2, max_runs: int = 100) -> list:
+    """Durations of successive calls, until ``min_time`` has elapsed.
+
+    After a first call (warm-up, e.g. lazy imports), not timed.
+    """
+    f(*args)
+    times = []
+    while not times or (sum(times) < min_time and len(times) < max_runs):
+        start = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(benchmarks=BENCHMARKS, sizes=SIZES) -> None:
+    print(f"{'benchmark':<50} {'service':<11} {'n_items':>8} "
+          f"{'min (ms)':>10} {'median (ms)':>12}")
+    for cls in benchmarks:
+        for params in itertools.product(cls.params[0], sizes):
+            bench = cls()
+            try:
+                bench.setup(*params)
+            except NotImplementedError:
+                continue
+            try:
+                for name in sorted(n for n in dir(cls) if n.startswith('time_')):
+                    times = _time(getattr(bench, name), *params)
+                    print(f"{cls.__name__ + '.' + name:<50} {params[0]:<11} "
+                          f"{params[1]:>8} {min(times) * 1e3:>10.2f} "
+                          f"{median(times) * 1e3:>12.2f}")
+                for name in sorted(n for n in dir(cls) if n.startswith('track_')):
+                    value = getattr(bench, name)(*params)
+                    print(f"{cls.__name__ + '.' + name:<50} {params[0]:<11} "
+                          f"{params[1]:>8} {value:>10,} {cls.unit}")
+            finally:
+                if hasattr(bench, 'teardown'):
+                    bench.teardown(*params)
+
+
+if __name__ == '__main__':
+    run(sizes=[int(n) for n in sys.argv[1:]] or SIZES)
@@ -1,23 +1,123 @@
+"""
+Elexon API client.
+
+Attributes are imported on first access (PEP 562), so that
+``import elexon_api`` stays cheap: pandas, xmltodict, aiohttp and
+pyarrow are only loaded when a feature using them is first used.
+"""
+
+import importlib
+import importlib.util
+
 from . import config
-from .utils import get_required_parameters, extract_df, extract_df_by_record_type
-from .client import Client, query
 
 import logging
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
-try:
-    import aiohttp
-    async_available = True
-except ImportError:
-    async_available = False
+# {attribute: module}
+_LAZY_ATTRS = {
+    'get_required_parameters': 'utils',
+    'extract_df': 'utils',
+    'extract_df_by_record_type': 'utils',
+    'Client': 'client',
+    'query': 'client',
+    'query_df': 'client',
+    'query_response': 'client',
+    'Response': 'response',
+    'query_range': 'backfill',
+    'iter_range': 'backfill',
+    'aiter_range': 'backfill',
+    'write_range': 'backfill',
+    'CsvSink': 'backfill',
+    'ResponseCache': 'cache',
+    'Scheduler': 'scheduler',
+    'IncrementalSync': 'sync',
+    'SingleFlight': 'singleflight',
+    'MetricsAggregator': 'metrics',
+    'query_async': 'async_client',
+    'query_df_async': 'async_client',
+    'query_response_async': 'async_client',
+    'query_many_async': 'async_client',
+    'query_many': 'async_client',
+    'query_panel': 'panel',
+    'query_panel_async': 'panel',
+    'ParquetStore': 'storage',
+    'JobQueue': 'jobs',
+    'Poller': 'poller',
+}
+
+async_available = importlib.util.find_spec('aiohttp') is not None
+parquet_available = importlib.util.find_spec('pyarrow') is not None
 
 if async_available:
-    from .async_client import query_async
     logger.info("Async client available.")
 else:
     logger.info("Async client not available, aiohttp is needed.")
     def query_async(*args, **kwargs):
         raise NotImplementedError(
-            "query_async is not available" 
-            + " because aiohttp is not installed.")
\ No newline at end of file
+            "query_async is not available"
+            + " because aiohttp is not installed.")
+
+    def query_df_async(*args, **kwargs):
+        raise NotImplementedError(
+            "query_df_async is not available"
+            + " because aiohttp is not installed.")
+
+    def query_response_async(*args, **kwargs):
+        raise NotImplementedError(
+            "query_response_async is not available"
+            + " because aiohttp is not installed.")
+
+    def query_many_async(*args, **kwargs):
+        raise NotImplementedError(
+            "query_many_async is not available"
+            + " because aiohttp is not installed.")
+
+    def query_many(*args, **kwargs):
+        raise NotImplementedError(
+            "query_many is not available"
+            + " because aiohttp is not installed.")
+
+    def query_panel(*args, **kwargs):
+        raise NotImplementedError(
+            "query_panel is not available"
+            + " because aiohttp is not installed.")
+
+    def query_panel_async(*args, **kwargs):
+        raise NotImplementedError(
+            "query_panel_async is not available"
+            + " because aiohttp is not installed.")
+
+    def aiter_range(*args, **kwargs):
+        raise NotImplementedError(
+            "aiter_range is not available"
+            + " because aiohttp is not installed.")
+
+    class Poller:
+        def __init__(self, *args, **kwargs):
+            raise NotImplementedError(
+                "Poller is not available"
+                + " because aiohttp is not installed.")
+
+if not parquet_available:
+    logger.info("Parquet storage not available, pyarrow is needed.")
+    class ParquetStore:
+        def __init__(self, *args, **kwargs):
+            raise NotImplementedError(
+                "ParquetStore is not available"
+                + " because pyarrow is not installed.")
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    # cache, so that __getattr__ is only called once per attribute
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
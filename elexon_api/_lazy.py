@@ -0,0 +1,43 @@
+"""
+_lazy.py
+========
+
+Deferred imports of heavy dependencies.
+
+``pd = lazy_import('pandas')`` returns a placeholder module which
+imports pandas when one of its attributes is first accessed, so that
+importing :mod:`elexon_api` does not pay for pandas, requests
+or xmltodict until they are used. Modules using it need
+``from __future__ import annotations``, so that annotations
+such as ``pd.DataFrame`` are not evaluated at definition time.
+"""
+
+import sys
+import importlib
+import importlib.util
+from types import ModuleType
+
+
+class _LazyModule(ModuleType):
+    """Placeholder of a module, imported on first attribute access.
+
+    The actual import goes through the import system, whose
+    per-module locks make it safe to trigger from several threads
+    (:class:`importlib.util.LazyLoader` is not, before Python 3.12).
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # copy the namespace, so that next lookups do not get here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Import module on first attribute access."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
@@ -5,16 +5,27 @@ async_client.py
 Async implementation of Elexon API Client.
 """
 
+from __future__ import annotations
+
+import asyncio
 import aiohttp
-import xmltodict
 from collections import OrderedDict
+from typing import (Any, AsyncIterator, Awaitable, Callable, Iterable, 
+                    List, NamedTuple, Tuple)
 
-from .config import HEADER
+from .config import HEADER, DEFAULT_MAX_WORKERS
 from .client import Client
-from .client import (prepare_query_params,
-                     validate_params, 
-                     get_service_url, 
-                     validate_response)
+from .client import (validate_response, store_body, parse_df_task,
+                     lookup_entry, get_fetched_body)
+from .plan import get_plan
+from .cache import make_cache_key
+from .parser import parse_response, columns_to_df
+from .response import Response
+from .metrics import Recorder, NULL_RECORDER, get_recorder
+
+from ._lazy import lazy_import
+xmltodict = lazy_import('xmltodict')
+pd = lazy_import('pandas')
 
 import logging
 logger = logging.getLogger(__name__)
@@ -42,19 +53,233 @@ async def query_async(client: Client,
     **params
         Parameters for query.
     """
-    params = prepare_query_params(client.api_key, service_code, params)
-    if check_query: validate_params(service_code, params)
-    url = get_service_url(client.base_url, client.api_version, service_code)
-    
-    # TODO recycle session?
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params, headers=header) as response:
-            response.raise_for_status()
-            r_text = await response.text()
-    
-    r_dict = xmltodict.parse(r_text)['response']
-    
-    if check_response: 
-        validate_response(service_code, params, r_dict)
-    return r_dict
+    recorder = get_recorder(client.metrics, service_code)
+    plan = get_plan(service_code, client.base_url, client.api_version)
+    params = plan.build(client.api_key, params, check=check_query)
+    recorder.lap('prepare')
+
+    async def _query():
+        with recorder:
+            r_bytes, from_cache, validators = await fetch_body_async(
+                client, service_code, params, header, recorder)
+            r_dict = xmltodict.parse(r_bytes)['response']
+            recorder.lap('parse')
+
+            if check_response: 
+                validate_response(service_code, params, r_dict)
+                recorder.lap('validate')
+
+            if not from_cache:
+                store_body(client, service_code, params, r_bytes, validators)
+                recorder.lap('store')
+            return r_dict
+    return await coalesce_async(client, 'query', service_code, params, _query)
+
+
+async def query_df_async(client: Client, 
+                         service_code: str, 
+                         header: dict = HEADER, 
+                         check_query: bool = True,
+                         check_response: bool = True, 
+                         **params) -> pd.DataFrame:
+    """Query Elexon API and return items as a DataFrame.
+
+    Async version of :func:`~elexon_api.client.query_df`. If the
+    client has an ``executor``, the response is parsed in it while
+    the event loop keeps serving other queries.
+    """
+    recorder = get_recorder(client.metrics, service_code)
+    plan = get_plan(service_code, client.base_url, client.api_version)
+    params = plan.build(client.api_key, params, check=check_query)
+    recorder.lap('prepare')
+
+    async def _query():
+        with recorder:
+            r_bytes, from_cache, validators = await fetch_body_async(
+                client, service_code, params, header, recorder)
+            if client.executor is not None:
+                df = await asyncio.get_running_loop().run_in_executor(
+                    client.executor, parse_df_task, 
+                    r_bytes, service_code, params, check_response)
+                recorder.lap('offload')
+            else:
+                r_dict, columns = parse_response(r_bytes)
+                recorder.lap('parse')
+
+                if check_response: 
+                    validate_response(service_code, params, r_dict)
+                    recorder.lap('validate')
+
+                df = columns_to_df(columns, service_code)
+                recorder.lap('extract')
+            recorder.count('rows', len(df))
+
+            if not from_cache:
+                store_body(client, service_code, params, r_bytes, validators)
+                recorder.lap('store')
+            return df
+    return await coalesce_async(client, 'query_df', service_code, params, _query)
+
+
+async def query_response_async(client: Client, 
+                               service_code: str, 
+                               header: dict = HEADER, 
+                               check_query: bool = True,
+                               check_response: bool = True, 
+                               **params) -> Response:
+    """Query Elexon API and return a compact :class:`~elexon_api.response.Response`.
+
+    Async version of :func:`~elexon_api.client.query_response`.
+    """
+    recorder = get_recorder(client.metrics, service_code)
+    plan = get_plan(service_code, client.base_url, client.api_version)
+    params = plan.build(client.api_key, params, check=check_query)
+    recorder.lap('prepare')
+
+    async def _query():
+        with recorder:
+            r_bytes, from_cache, validators = await fetch_body_async(
+                client, service_code, params, header, recorder)
+            response = Response.from_bytes(r_bytes, service_code, params)
+            recorder.lap('parse')
+
+            if check_response: 
+                response.validate()
+                recorder.lap('validate')
+
+            if not from_cache:
+                store_body(client, service_code, params, r_bytes, validators)
+                recorder.lap('store')
+            return response
+    return await coalesce_async(client, 'query_response', service_code, params, _query)
+
+
+async def coalesce_async(client: Client, 
+                         kind: str, 
+                         service_code: str, 
+                         params: dict, 
+                         fn: Callable[[], Awaitable]) -> Any:
+    """Await ``fn()``, sharing the result of identical calls in flight.
+
+    Async version of :func:`~elexon_api.client.coalesce`.
+    """
+    if client.single_flight is None:
+        return await fn()
+    key = (kind, make_cache_key(service_code, params))
+    return await client.single_flight.do_async(key, fn)
+
+
+async def fetch_body_async(client: Client, 
+                           service_code: str, 
+                           params: dict, 
+                           header: dict = HEADER,
+                           recorder: Recorder = NULL_RECORDER) -> Tuple[bytes, bool, dict]:
+    """Get raw response body, from the client cache if possible.
+
+    Async version of :func:`~elexon_api.client.fetch_body`.
+    """
+    entry = lookup_entry(client, service_code, params, recorder)
+    if entry is not None and entry.fresh:
+        return entry.body, True, {}
+
+    url = get_plan(service_code, client.base_url, client.api_version).url
+    if entry is not None:
+        header = {**header, **entry.validators}
+    session = client.get_async_session()
+    result = await client.scheduler.fetch_response_async(
+        session, url, params, header, recorder)
+    return get_fetched_body(client, service_code, params, entry, result, recorder)
+
+
+class QueryResult(NamedTuple):
+    """Outcome of one query of a batch."""
+    index: int
+    service_code: str
+    params: dict
+    result: Any = None
+    exception: BaseException = None
+
+
+async def query_many_async(client: Client,
+                           queries: Iterable[Tuple[str, dict]],
+                           max_concurrency: int = DEFAULT_MAX_WORKERS,
+                           ordered: bool = False,
+                           progress: Callable[[int, int], None] = None,
+                           query_func: Callable[..., Awaitable] = query_async,
+                           **kwargs) -> AsyncIterator[QueryResult]:
+    """Run a batch of queries, yielding results as they complete.
+
+    All queries share the client session. A failed query does not
+    cancel the others, its exception is returned in the result.
+
+    Parameters
+    ----------
+    client : Client
+    queries : iterable
+        ``(service_code, params)`` pairs.
+    max_concurrency : int
+        Maximum number of queries running at once.
+    ordered : bool
+        If true, yield results in input order, else as they complete.
+    progress : callable
+        Called with ``(n_done, n_total)`` after each query.
+    query_func : coroutine function
+        Query to run, e.g. :func:`query_df_async`.
+    **kwargs
+        Passed to every query (e.g. ``check_response``).
+    """
+    queries = list(queries)
+    n_total = len(queries)
+    pending = iter(enumerate(queries))
+    results: asyncio.Queue = asyncio.Queue()
 
+    async def _worker():
+        for i, (service_code, params) in pending:
+            try:
+                r = await query_func(client, service_code, **kwargs, **params)
+                results.put_nowait(QueryResult(i, service_code, params, r))
+            except Exception as e:
+                logger.warning(f"Query {i} ({service_code}) failed: {e!r}")
+                results.put_nowait(QueryResult(i, service_code, params, exception=e))
+
+    workers = [asyncio.ensure_future(_worker()) 
+               for _ in range(min(max_concurrency, n_total))]
+    buffer = {}
+    next_index = 0
+    try:
+        for n_done in range(1, n_total + 1):
+            result = await results.get()
+            if progress is not None:
+                progress(n_done, n_total)
+            if not ordered:
+                yield result
+                continue
+            buffer[result.index] = result
+            while next_index in buffer:
+                yield buffer.pop(next_index)
+                next_index += 1
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+
+def query_many(client: Client,
+               queries: Iterable[Tuple[str, dict]],
+               max_concurrency: int = DEFAULT_MAX_WORKERS,
+               progress: Callable[[int, int], None] = None,
+               query_func: Callable[..., Awaitable] = query_async,
+               **kwargs) -> List[QueryResult]:
+    """Run a batch of queries, return results in input order.
+
+    Sync wrapper of :func:`query_many_async`, running its own event
+    loop: it cannot be called from a running loop (e.g. a notebook
+    cell), use :func:`query_many_async` there.
+    """
+    async def _collect():
+        try:
+            return [r async for r in query_many_async(
+                client, queries, max_concurrency=max_concurrency, 
+                ordered=True, progress=progress, query_func=query_func, **kwargs)]
+        finally:
+            await client.close_async_session()
+    return asyncio.run(_collect())
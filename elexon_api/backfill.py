@@ -0,0 +1,647 @@
+"""
+backfill.py
+===========
+
+Query a service over a date range.
+
+The range is split into one request per day, week, month, year
+or date window, depending on the parameters required by the
+service, and the requests are run concurrently on a thread pool
+sharing the client's connection pool.
+
+Unless a fixed ``window`` is passed, windows are sized by the
+client's :class:`~elexon_api.windows.AdaptiveWindow` as they are
+sent, so that later windows benefit from what earlier ones taught.
+A window which fails (API error, timeout, server error) is bisected
+and its halves queried again, down to the smallest window, and
+their items stitched back together.
+
+:func:`query_range` returns a single DataFrame. For ranges too long
+to fit in memory, :func:`iter_range` (and :func:`aiter_range`) yield
+one chunk at a time, holding at most ``max_pending`` parsed chunks,
+and :func:`write_range` streams them into a sink (e.g. a
+:class:`CsvSink`, or :meth:`~elexon_api.storage.ParquetStore.write`).
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+import asyncio
+import datetime as dt
+import itertools
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator,
+                    List, Optional, Tuple)
+
+import requests
+
+from .config import (SERVICE_TO_GROUP, GROUP_TO_RANGE_SPLIT,
+                     DEFAULT_WINDOW, DEFAULT_MAX_WORKERS, DEFAULT_MAX_PENDING,
+                     MONTH_FORMAT, HEADER)
+from .client import Client, query, query_df
+from .utils import (ElexonAPIException, NoContentError, extract_df, has_items,
+                    apply_dtypes)
+
+from ._lazy import lazy_import
+pd = lazy_import('pandas')
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# (start, end) parameter names of windowed groups
+WINDOW_PARAMS = {
+    5   :   ("StartDate", "EndDate"),
+    6   :   ("FromDate", "ToDate"),
+    7   :   ("FromClearedDate", "ToClearedDate"),
+    9   :   ("FromDateTime", "ToDateTime"),
+    12  :   ("FromSettlementDate", "ToSettlementDate"),
+    15  :   ("FromSettlementDate", "ToSettlementDate"),
+}
+
+# groups whose windows are bounded by datetimes rather than dates
+DATETIME_WINDOW_GROUPS = {5, 9}
+
+# client errors which a smaller window may avoid, besides server errors
+WINDOW_ERROR_STATUSES = {408, 413, 414}
+
+# parts of API error descriptions meaning that a window holds too much data
+WINDOW_ERROR_DESCRIPTIONS = ('too large', 'too long', 'too many', 'exceed')
+
+# errors of sync queries after which a window is bisected
+WINDOW_ERRORS = (ElexonAPIException, requests.ConnectionError,
+                 requests.Timeout, requests.HTTPError)
+
+
+def query_range(client: Client,
+                service_code: str,
+                start,
+                end,
+                max_workers: int = DEFAULT_MAX_WORKERS,
+                window: int = None,
+                header: dict = HEADER,
+                check_query: bool = True,
+                check_response: bool = True,
+                **params) -> pd.DataFrame:
+    """Query Elexon API over a date range.
+
+    Parameters
+    ----------
+    client : Client
+    service_code : str
+    start, end
+        Range bounds, anything accepted by :class:`~pandas.Timestamp`.
+        Both ends are included.
+    max_workers : int
+        Maximum number of concurrent requests.
+    window : int
+        Days covered by each request, for windowed services.
+        If ``None``, set by the client ``window_sizer``.
+    header : dict
+        Header for the :func:`~requests.get` call.
+    check_query : bool
+        If true, validate the query inputs.
+    check_response : bool
+        If true, validate response.
+    **params
+        Additional parameters, passed to every query.
+
+    Returns
+    -------
+    pd.DataFrame
+        Items of all responses, in range order, with the dtypes of the
+        service. Requests with nothing published are skipped.
+    """
+    def _query(chunk_params: dict) -> Optional[pd.DataFrame]:
+        try:
+            r_dict = query(client, service_code, header=header,
+                           check_query=check_query,
+                           check_response=check_response,
+                           **{**params, **chunk_params})
+        except NoContentError:
+            return None
+        if not has_items(r_dict):
+            return None
+        return extract_df(r_dict, service_code, metrics=client.metrics)
+
+    def _combine(dfs: List[Optional[pd.DataFrame]]) -> Optional[pd.DataFrame]:
+        dfs = [df for df in dfs if df is not None]
+        return concat_frames(dfs, service_code) if dfs else None
+
+    chunks, fn = get_range_requests(client, service_code, start, end, 
+                                    window, _query, _combine)
+    dfs = list(_iter_frames(fn, chunks, max_workers))
+    if not dfs:
+        return pd.DataFrame()
+    return concat_frames(dfs, service_code)
+
+
+def iter_range(client: Client,
+               service_code: str,
+               start,
+               end,
+               max_pending: int = DEFAULT_MAX_PENDING,
+               chunk_rows: int = None,
+               window: int = None,
+               header: dict = HEADER,
+               check_query: bool = True,
+               check_response: bool = True,
+               **params) -> Iterator[pd.DataFrame]:
+    """Query Elexon API over a date range, one chunk at a time.
+
+    Memory-bounded counterpart of :func:`query_range`. Requests run
+    concurrently, but at most ``max_pending`` of them are in flight or
+    waiting to be consumed: the next request is only sent once a chunk
+    has been taken, so memory does not grow with the length of the range.
+
+    Parameters
+    ----------
+    client : Client
+    service_code : str
+    start, end
+        Range bounds, both included.
+    max_pending : int
+        Maximum number of parsed chunks held at once (including the
+        one being consumed), and of concurrent requests.
+    chunk_rows : int
+        If passed, yield chunks of this many rows (the last one can be
+        shorter) instead of one chunk per request.
+    window, header, check_query, check_response, **params
+        See :func:`query_range`.
+
+    Yields
+    ------
+    pd.DataFrame
+        Items of each request, in range order, with the dtypes of the
+        service (see :func:`~elexon_api.client.query_df`). Requests
+        without items, or with nothing published, are skipped.
+    """
+    def _query(request_params: dict) -> pd.DataFrame:
+        try:
+            return query_df(client, service_code, header=header,
+                            check_query=check_query,
+                            check_response=check_response,
+                            **{**params, **request_params})
+        except NoContentError:
+            return pd.DataFrame()
+
+    range_requests, fn = get_range_requests(
+        client, service_code, start, end, window, _query, 
+        lambda dfs: concat_frames(dfs, service_code))
+    frames = _iter_frames(fn, range_requests, max_pending)
+    if chunk_rows is None:
+        yield from frames
+        return
+    rechunker = _Rechunker(service_code, chunk_rows)
+    for df in frames:
+        yield from rechunker.add(df)
+    yield from rechunker.flush()
+
+
+def _iter_frames(fn: Callable[[Any], Optional[pd.DataFrame]], 
+                 range_requests: Iterable,
+                 max_pending: int) -> Iterator[pd.DataFrame]:
+    """Results of ``fn`` on each request, in order, skipping empty ones."""
+    range_requests = iter(range_requests)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_pending) as executor:
+        try:
+            for request_params in itertools.islice(range_requests, max_pending):
+                pending.append(executor.submit(fn, request_params))
+            while pending:
+                df = pending.popleft().result()
+                if df is not None and not df.empty:
+                    yield df
+                del df
+                # only now, so that the consumed chunk counts as pending
+                request_params = next(range_requests, None)
+                if request_params is not None:
+                    pending.append(executor.submit(fn, request_params))
+        finally:
+            # consumer stopped early, or a request failed
+            for future in pending:
+                future.cancel()
+
+
+async def aiter_range(client: Client,
+                      service_code: str,
+                      start,
+                      end,
+                      max_pending: int = DEFAULT_MAX_PENDING,
+                      chunk_rows: int = None,
+                      window: int = None,
+                      header: dict = HEADER,
+                      check_query: bool = True,
+                      check_response: bool = True,
+                      **params) -> AsyncIterator[pd.DataFrame]:
+    """Query Elexon API over a date range, one chunk at a time.
+
+    Async version of :func:`iter_range`, through
+    :func:`~elexon_api.async_client.query_df_async`.
+    """
+    from .async_client import query_df_async
+
+    async def _query(request_params: dict) -> pd.DataFrame:
+        try:
+            return await query_df_async(
+                client, service_code, header=header,
+                check_query=check_query,
+                check_response=check_response,
+                **{**params, **request_params})
+        except NoContentError:
+            return pd.DataFrame()
+
+    range_requests, fn = get_range_requests(
+        client, service_code, start, end, window, _query, 
+        lambda dfs: concat_frames(dfs, service_code), is_async=True)
+    range_requests = iter(range_requests)
+
+    def _submit(request) -> asyncio.Task:
+        return asyncio.ensure_future(fn(request))
+
+    rechunker = None if chunk_rows is None else _Rechunker(service_code, chunk_rows)
+    pending = deque(_submit(p) for p in itertools.islice(range_requests, max_pending))
+    try:
+        while pending:
+            df = await pending.popleft()
+            if rechunker is None:
+                if not df.empty:
+                    yield df
+            else:
+                for chunk in rechunker.add(df):
+                    yield chunk
+            del df
+            request_params = next(range_requests, None)
+            if request_params is not None:
+                pending.append(_submit(request_params))
+        if rechunker is not None:
+            for chunk in rechunker.flush():
+                yield chunk
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class _Rechunker:
+    """Regroup frames into chunks of ``chunk_rows`` rows."""
+
+    def __init__(self, service_code: str, chunk_rows: int):
+        if chunk_rows < 1:
+            raise ElexonAPIException(f"chunk_rows must be positive: {chunk_rows}.")
+        self.service_code = service_code
+        self.chunk_rows = chunk_rows
+        self._buffer: List[pd.DataFrame] = []
+        self._n_rows = 0
+
+    def add(self, df: pd.DataFrame) -> Iterator[pd.DataFrame]:
+        if df.empty:
+            return
+        self._buffer.append(df)
+        self._n_rows += len(df)
+        while self._n_rows >= self.chunk_rows:
+            merged = self._merge()
+            yield merged.iloc[:self.chunk_rows].reset_index(drop=True)
+            rest = merged.iloc[self.chunk_rows:]
+            self._buffer, self._n_rows = [rest], len(rest)
+
+    def flush(self) -> Iterator[pd.DataFrame]:
+        if self._n_rows:
+            yield self._merge().reset_index(drop=True)
+        self._buffer, self._n_rows = [], 0
+
+    def _merge(self) -> pd.DataFrame:
+        return concat_frames(self._buffer, self.service_code)
+
+
+def write_range(client: Client,
+                service_code: str,
+                start,
+                end,
+                sink: Callable[[pd.DataFrame], None],
+                **kwargs) -> int:
+    """Stream a date range into ``sink``, chunk by chunk.
+
+    Parameters
+    ----------
+    client : Client
+    service_code : str
+    start, end
+        Range bounds, both included.
+    sink : callable
+        Called with each chunk, e.g. a :class:`CsvSink` or
+        ``lambda df: store.write(df, service_code)`` for a
+        :class:`~elexon_api.storage.ParquetStore`.
+    **kwargs
+        Passed to :func:`iter_range`.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    n_rows = 0
+    for df in iter_range(client, service_code, start, end, **kwargs):
+        sink(df)
+        n_rows += len(df)
+    return n_rows
+
+
+class CsvSink:
+    """Append chunks to a CSV file.
+
+    The columns of the first chunk are written as header, and
+    used for the following chunks (other columns are dropped).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.columns = None
+
+    def __call__(self, df: pd.DataFrame) -> None:
+        if self.columns is None:
+            self.columns = list(df.columns)
+            df.to_csv(self.path, index=False)
+            return
+        extra = df.columns.difference(self.columns)
+        if len(extra):
+            logger.warning(f"Columns not in {self.path} header dropped: {list(extra)}")
+        df.reindex(columns=self.columns).to_csv(
+            self.path, mode='a', header=False, index=False)
+
+
+def split_range(service_code: str, start, end,
+                window: int = DEFAULT_WINDOW) -> List[dict]:
+    """Split date range into the parameters of each request.
+
+    Parameters
+    ----------
+    service_code : str
+    start, end
+        Range bounds, both included.
+    window : int
+        Days covered by each request, for windowed services.
+    """
+    group, split = _get_split(service_code)
+    start, end = _get_bounds(start, end, group)
+
+    if split == 'window':
+        return [get_window_params(group, t0, t1)
+                for t0, t1 in iter_windows(group, start, end, lambda: window)]
+
+    days = pd.date_range(start.normalize(), end.normalize(), freq='D')
+    if split == 'day':
+        name = "FromSettlementDate" if group == 16 else "SettlementDate"
+        return [{name: day.date()} for day in days]
+    if split == 'week':
+        keys = days.isocalendar()[['year', 'week']].itertuples(index=False)
+        return [{'Year': int(y), 'Week': int(w)} for y, w in dict.fromkeys(keys)]
+    if split == 'month':
+        keys = dict.fromkeys((d.year, d.strftime(MONTH_FORMAT)) for d in days)
+        return [{'Year': y, 'Month': m} for y, m in keys]
+    if split == 'year':
+        return [{'Year': int(y)} for y in dict.fromkeys(days.year)]
+    raise ElexonAPIException(f"Unknown range split: {split}.")
+
+
+def _get_split(service_code: str) -> Tuple[int, str]:
+    """Group of service and how its ranges are split."""
+    if service_code not in SERVICE_TO_GROUP:
+        raise ElexonAPIException(f"Unknown service_code: {service_code}.")
+    group = SERVICE_TO_GROUP[service_code]
+    split = GROUP_TO_RANGE_SPLIT.get(group)
+    if split is None:
+        raise ElexonAPIException(
+            f"{service_code} does not take date parameters.")
+    return group, split
+
+
+def _get_bounds(start, end, group: int = None
+                ) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """Range bounds as timestamps.
+
+    For groups windowed by datetimes, an ``end`` given as a date
+    includes its whole day.
+    """
+    is_date_end = _is_date_only(end)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if group in DATETIME_WINDOW_GROUPS and is_date_end:
+        end = end.normalize() + dt.timedelta(days=1, seconds=-1)
+    if end < start:
+        raise ElexonAPIException(f"Range end {end} is before start {start}.")
+    return start, end
+
+
+def _is_date_only(value) -> bool:
+    """Whether a range bound is a date, without time of day."""
+    if isinstance(value, str):
+        return len(value.strip()) <= len('YYYY-MM-DD')
+    return isinstance(value, dt.date) and not isinstance(value, dt.datetime)
+
+
+#--------------------------------------------------------
+#                       WINDOWS
+#--------------------------------------------------------
+def get_range_requests(client: Client,
+                       service_code: str,
+                       start,
+                       end,
+                       window: Optional[int],
+                       fn: Callable[[dict], Any],
+                       combine: Callable[[List[Any]], Any],
+                       is_async: bool = False) -> Tuple[Iterable, Callable]:
+    """Requests of a range, and the function querying one of them.
+
+    For services which are not windowed, requests are the parameters
+    of :func:`split_range`, queried by ``fn``. For windowed services,
+    they are ``(start, end)`` windows, produced lazily with the size
+    ``window`` (days) or, if ``None``, the size given by the client
+    ``window_sizer`` when they are sent. Windows are queried by ``fn``,
+    bisected if they fail, and the results of the pieces are merged
+    by ``combine``.
+    If ``is_async``, ``fn`` and the returned function are coroutine functions.
+    """
+    group, split = _get_split(service_code)
+    if split != 'window':
+        return split_range(service_code, start, end), fn
+    start, end = _get_bounds(start, end, group)
+    logger.info(f"Querying {service_code} from {start} to {end} by windows.")
+    sizer = client.window_sizer
+    if window is None:
+        get_window = lambda: sizer.get_window(service_code)
+    else:
+        get_window = lambda: window
+    windows = iter_windows(group, start, end, get_window)
+
+    if is_async:
+        async def _query_async(bounds):
+            return combine(await query_window_async(
+                fn, service_code, group, bounds, sizer))
+        return windows, _query_async
+
+    def _query(bounds):
+        return combine(query_window(fn, service_code, group, bounds, sizer))
+    return windows, _query
+
+
+def iter_windows(group: int, start: pd.Timestamp, end: pd.Timestamp,
+                 get_window: Callable[[], float]
+                 ) -> Iterator[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """Split range into consecutive, non overlapping windows.
+
+    Bounds are inclusive: dates, or datetimes up to the second before
+    the next window. The size of each window (days) is asked to
+    ``get_window`` when the window is produced. Date windows cover
+    whole days.
+    """
+    if group in DATETIME_WINDOW_GROUPS:
+        unit = dt.timedelta(seconds=1)
+    else:
+        unit = dt.timedelta(days=1)
+        start, end = start.normalize(), end.normalize()
+    t0 = start
+    while t0 <= end:
+        step = max(unit, _floor(dt.timedelta(days=get_window()), unit))
+        t1 = min(t0 + step - unit, end)
+        yield t0, t1
+        t0 = t1 + unit
+
+
+def _floor(delta: dt.timedelta, unit: dt.timedelta) -> dt.timedelta:
+    return (delta // unit) * unit
+
+
+def get_window_params(group: int, t0: pd.Timestamp, t1: pd.Timestamp) -> dict:
+    """Parameters of the request of a window."""
+    if group == 5:
+        return {'StartDate': t0.date(), 'StartTime': t0.time(),
+                'EndDate': t1.date(), 'EndTime': t1.time()}
+    from_param, to_param = WINDOW_PARAMS[group]
+    if group in DATETIME_WINDOW_GROUPS:
+        return {from_param: t0.to_pydatetime(), to_param: t1.to_pydatetime()}
+    return {from_param: t0.date(), to_param: t1.date()}
+
+
+def get_window_days(group: int, t0: pd.Timestamp, t1: pd.Timestamp) -> float:
+    """Size of a window (days), bounds included."""
+    if group in DATETIME_WINDOW_GROUPS:
+        return (t1 - t0 + dt.timedelta(seconds=1)) / dt.timedelta(days=1)
+    return (t1 - t0).days + 1
+
+
+def bisect_window(group: int, t0: pd.Timestamp, t1: pd.Timestamp,
+                  min_window: float) -> Optional[list]:
+    """Two halves of a window, ``None`` if it is the smallest one."""
+    if group in DATETIME_WINDOW_GROUPS:
+        unit = dt.timedelta(seconds=1)
+        min_step = max(unit, _floor(dt.timedelta(days=min_window), unit))
+    else:
+        unit = min_step = dt.timedelta(days=1)
+    span = t1 - t0 + unit
+    if span < 2 * min_step:
+        return None
+    middle = t0 + max(min_step, _floor(span / 2, unit))
+    return [(t0, middle - unit), (middle, t1)]
+
+
+def is_window_error(error: Exception) -> bool:
+    """Whether a failed request may succeed with a smaller window.
+
+    Timeouts, dropped connections, server errors and API errors whose
+    description means too much data (see ``WINDOW_ERROR_DESCRIPTIONS``),
+    but not e.g. a rejected API key or a bad parameter.
+    """
+    if isinstance(error, (requests.Timeout, requests.ConnectionError,
+                          asyncio.TimeoutError)):
+        return True
+    aiohttp = sys.modules.get('aiohttp')
+    if aiohttp is not None and isinstance(error, aiohttp.ClientConnectionError):
+        return True
+    description = getattr(error, 'description', None)
+    if description is not None:
+        description = str(description).lower()
+        return any(part in description for part in WINDOW_ERROR_DESCRIPTIONS)
+    status = getattr(error, 'status', None)
+    response = getattr(error, 'response', None)
+    if response is not None:
+        status = getattr(response, 'status_code', status)
+    if status is None:
+        return False
+    return status >= 500 or status in WINDOW_ERROR_STATUSES
+
+
+def query_window(fn: Callable[[dict], Any],
+                 service_code: str,
+                 group: int,
+                 bounds: Tuple[pd.Timestamp, pd.Timestamp],
+                 window_sizer: 'AdaptiveWindow') -> List[Any]:
+    """Query a window, bisecting it while it fails.
+
+    Returns
+    -------
+    list
+        Results of ``fn`` for the window, or for its pieces in order.
+    """
+    t0, t1 = bounds
+    days = get_window_days(group, t0, t1)
+    start = time.perf_counter()
+    try:
+        result = fn(get_window_params(group, t0, t1))
+    except WINDOW_ERRORS as e:
+        halves = _on_window_error(e, service_code, group, bounds, window_sizer)
+        return [r for half in halves
+                for r in query_window(fn, service_code, group, half, window_sizer)]
+    window_sizer.record_success(service_code, days, time.perf_counter() - start)
+    return [result]
+
+
+async def query_window_async(fn: Callable[[dict], Awaitable],
+                             service_code: str,
+                             group: int,
+                             bounds: Tuple[pd.Timestamp, pd.Timestamp],
+                             window_sizer: 'AdaptiveWindow') -> List[Any]:
+    """Query a window, bisecting it while it fails.
+
+    Async version of :func:`query_window`.
+    """
+    import aiohttp
+
+    t0, t1 = bounds
+    days = get_window_days(group, t0, t1)
+    start = time.perf_counter()
+    try:
+        result = await fn(get_window_params(group, t0, t1))
+    except (ElexonAPIException, aiohttp.ClientConnectionError,
+            aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+        halves = _on_window_error(e, service_code, group, bounds, window_sizer)
+        results = []
+        for half in halves:
+            results += await query_window_async(fn, service_code, group, half, 
+                                                window_sizer)
+        return results
+    window_sizer.record_success(service_code, days, time.perf_counter() - start)
+    return [result]
+
+
+def _on_window_error(error, service_code, group, bounds, window_sizer) -> list:
+    """Halves of a failed window, re-raise if it cannot be bisected."""
+    t0, t1 = bounds
+    halves = None
+    if is_window_error(error):
+        halves = bisect_window(group, t0, t1, window_sizer.min_window)
+    if halves is None:
+        raise error
+    window_sizer.record_failure(service_code, get_window_days(group, t0, t1))
+    logger.warning(f"{service_code} window {t0} - {t1} failed, bisecting: {error!r}")
+    return halves
+
+
+def concat_frames(dfs: List[pd.DataFrame], service_code: str) -> pd.DataFrame:
+    """Stitch typed frames of consecutive windows."""
+    dfs = [df for df in dfs if not df.empty] or dfs[:1]
+    if len(dfs) == 1:
+        return dfs[0]
+    # categories differ between frames, restore dtypes after concat
+    return apply_dtypes(pd.concat(dfs, ignore_index=True), service_code)
@@ -0,0 +1,289 @@
+"""
+cache.py
+========
+
+Persistent cache of raw API responses, stored in SQLite.
+
+Entries are keyed by service code and query parameters (the
+API key excluded). Responses for settlement dates older than
+:data:`~elexon_api.config.CACHE_FINAL_AFTER` days never expire,
+more recent ones expire after a service-specific TTL.
+Expired entries keep the validators of the response (``ETag``,
+``Last-Modified``), if any, so that the client can revalidate
+them with a conditional request instead of downloading them
+again. The least recently used entries are evicted when the
+cache grows larger than ``max_bytes``.
+"""
+
+import time
+import sqlite3
+import calendar
+import threading
+import datetime as dt
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from .config import (DATE_FORMAT, DATE_PARAMS, DATETIME_PARAMS, MONTH_FORMAT,
+                     CACHE_FILENAME, CACHE_MAX_BYTES, DEFAULT_CACHE_TTL,
+                     CACHE_FINAL_AFTER, CACHE_TTL_D)
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key             TEXT PRIMARY KEY,
+    service_code    TEXT NOT NULL,
+    body            BLOB NOT NULL,
+    size            INTEGER NOT NULL,
+    created         REAL NOT NULL,
+    expires         REAL,
+    accessed        REAL NOT NULL,
+    etag            TEXT,
+    last_modified   TEXT
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+class CacheEntry(NamedTuple):
+    """Cached response, with its validators."""
+    body: bytes
+    fresh: bool
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def validators(self) -> dict:
+        """Headers of a conditional request revalidating the entry."""
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def get_cache_path(filename: str = CACHE_FILENAME) -> Path:
+    """Default location of the cache database."""
+    return Path.home() / '.cache' / 'elexon_api' / filename
+
+
+def make_cache_key(service_code: str, params: dict) -> str:
+    """Normalized key for a query, excluding the API key."""
+    query = "&".join(f"{k}={params[k]}"
+                     for k in sorted(params) if k != 'APIKey')
+    return f"{service_code}?{query}"
+
+
+def get_ttl(service_code: str, params: dict,
+            today: dt.date = None) -> Optional[float]:
+    """Time to live of a response (seconds), ``None`` if it never expires.
+
+    Parameters
+    ----------
+    service_code : str
+    params : dict
+        Query parameters, as formatted by
+        :func:`~elexon_api.client.prepare_query_params`.
+    today : datetime.date
+        Reference date, defaults to today.
+    """
+    today = today or dt.date.today()
+    try:
+        last_date = _get_last_date(params)
+    except (ValueError, TypeError, OverflowError):
+        # the API accepts more formats than parsed here, keep the query cacheable
+        logger.info(f"Dates of {service_code} query not recognized: {params}.")
+        last_date = None
+    if last_date is not None:
+        if (today - last_date).days > CACHE_FINAL_AFTER:
+            return None
+    return CACHE_TTL_D.get(service_code, DEFAULT_CACHE_TTL)
+
+
+def _get_last_date(params: dict) -> Optional[dt.date]:
+    """Latest date covered by the query parameters, ``None`` if unknown."""
+    dates = [_parse_date(v) for k, v in params.items()
+             if k in DATE_PARAMS or k in DATETIME_PARAMS]
+    if dates:
+        return None if None in dates else max(dates)
+
+    year = params.get('Year')
+    if year is None:
+        return None
+    year = int(year)
+    if 'Week' in params:
+        return dt.date.fromisocalendar(year, int(params['Week']), 7)
+    if 'Month' in params:
+        month = _parse_month(params['Month'])
+        if month is None:
+            return None
+        return dt.date(year, month, calendar.monthrange(year, month)[1])
+    return dt.date(year, 12, 31)
+
+
+def _parse_date(value) -> Optional[dt.date]:
+    """Date of a date or datetime parameter: date, datetime (or
+    Timestamp), or ISO string. ``None`` if not recognized."""
+    if isinstance(value, dt.datetime):
+        return value.date()
+    if isinstance(value, dt.date):
+        return value
+    try:
+        return dt.datetime.strptime(str(value).strip()[:10], DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def _parse_month(value) -> Optional[int]:
+    """Month number of a ``Month`` parameter: number, or abbreviated
+    or full month name. ``None`` if not recognized."""
+    text = str(value).strip()
+    if text.isdigit():
+        month = int(text)
+        return month if 1 <= month <= 12 else None
+    for month_format in (MONTH_FORMAT, '%B'):
+        try:
+            return dt.datetime.strptime(text, month_format).month
+        except ValueError:
+            pass
+    return None
+
+
+class ResponseCache:
+    """SQLite-backed cache of raw XML responses, with LRU eviction.
+
+    Parameters
+    ----------
+    path : str or Path
+        Database file, defaults to :func:`get_cache_path`.
+        Use ``':memory:'`` for a non persistent cache.
+    max_bytes : int
+        Maximum total size of the cached responses.
+
+    Attributes
+    ----------
+    hits, misses, evictions : int
+        Counters since the cache was opened.
+    revalidated : int
+        Expired entries found unchanged by a conditional request
+        (see :meth:`refresh`), also counted in ``misses``.
+    """
+
+    def __init__(self, path=None, max_bytes: int = CACHE_MAX_BYTES):
+        if path is None:
+            path = get_cache_path()
+        if str(path) != ':memory:':
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def lookup(self, service_code: str, params: dict) -> Optional[bytes]:
+        """Get cached response, ``None`` if missing or expired."""
+        entry = self.lookup_entry(service_code, params)
+        if entry is None or not entry.fresh:
+            return None
+        return entry.body
+
+    def lookup_entry(self, service_code: str, params: dict) -> Optional[CacheEntry]:
+        """Get cached response and its validators, ``None`` if missing.
+
+        Expired entries are returned (not fresh) if they have validators,
+        otherwise they are dropped. Both count as misses.
+        """
+        key = make_cache_key(service_code, params)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT body, expires, etag, last_modified "
+                "FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body, expires, etag, last_modified = row
+            if expires is not None and expires <= now:
+                self.misses += 1
+                if etag is None and last_modified is None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                return CacheEntry(body, False, etag, last_modified)
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        logger.debug(f"Cache hit: {key}")
+        return CacheEntry(body, True, etag, last_modified)
+
+    def store(self, service_code: str, params: dict, body: bytes,
+              etag: str = None, last_modified: str = None) -> None:
+        """Store response and its validators, evicting old entries if needed."""
+        key = make_cache_key(service_code, params)
+        ttl = get_ttl(service_code, params)
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        size = len(body)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, service_code, body, size, "
+                "created, expires, accessed, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, service_code, body, size, now, expires, now,
+                 etag, last_modified))
+            self._evict()
+
+    def refresh(self, service_code: str, params: dict) -> None:
+        """Restart the TTL of an entry found unchanged (304 response)."""
+        key = make_cache_key(service_code, params)
+        ttl = get_ttl(service_code, params)
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE responses SET expires = ?, accessed = ? WHERE key = ?",
+                (expires, now, key))
+            self.revalidated += 1
+        logger.debug(f"Cache revalidated: {key}")
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until below ``max_bytes``."""
+        total, = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed")
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        """Counters and current size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'revalidated': self.revalidated,
+                'entries': entries, 'bytes': size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
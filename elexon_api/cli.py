@@ -0,0 +1,129 @@
+"""
+cli.py
+======
+
+``elexon-export``: bulk export of services over a date range.
+
+The range is expanded into work units (see :mod:`~elexon_api.jobs`),
+run by several worker processes, each result written to its own file
+as soon as it is parsed: nothing is collected in memory. The queue is
+kept in the output directory, so running the same command again
+resumes the export, skipping the units already written.
+
+    elexon-export B1770 FUELHH --from 2019-01-01 --to 2019-12-31 \\
+        --format parquet --workers 4 --output data/
+"""
+
+import sys
+import argparse
+from pathlib import Path
+from typing import List
+
+from .config import (DEFAULT_WINDOW, JOB_FILENAME, JOB_LEASE, JOB_MAX_ATTEMPTS,
+                     JOB_REPORT_INTERVAL)
+from .jobs import FORMATS, JobQueue, JobProgress, expand_units, run_workers
+from .utils import ElexonAPIException, get_api_key_path
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='elexon-export',
+        description="Export services of the Elexon API over a date range, "
+                    "one file per request. Run again to resume.")
+    parser.add_argument('service_codes', metavar='SERVICE', nargs='+')
+    parser.add_argument('--from', dest='start', required=True,
+                        help="First settlement date (or datetime).")
+    parser.add_argument('--to', dest='end', required=True,
+                        help="Last settlement date (or datetime), included.")
+    parser.add_argument('--format', choices=FORMATS, default='parquet')
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes (default: number of cores).")
+    parser.add_argument('--output', default='.',
+                        help="Output directory, also holding the job queue.")
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW,
+                        help="Days per request of windowed services.")
+    parser.add_argument('--param', action='append', default=[], metavar='KEY=VALUE',
+                        help="Additional query parameter, can be repeated.")
+    parser.add_argument('--job', default=None,
+                        help="Job name (default: from services, range and format).")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Retry units which failed all their attempts.")
+    parser.add_argument('--lease', type=float, default=JOB_LEASE,
+                        help="Seconds after which a unit of a dead worker is retried.")
+    parser.add_argument('--max-attempts', type=int, default=JOB_MAX_ATTEMPTS,
+                        help="Attempts of a unit before it stays failed.")
+    parser.add_argument('--key-file', default=None,
+                        help="File of the API key (default: in package directory).")
+    parser.add_argument('--base-url', default=None)
+    parser.add_argument('--interval', type=float, default=JOB_REPORT_INTERVAL,
+                        help="Seconds between progress lines.")
+    parser.add_argument('--verbose', '-v', action='store_true')
+    return parser
+
+
+def parse_params(pairs: List[str]) -> dict:
+    """``['KEY=VALUE', ...]`` to a dict."""
+    params = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep or not key:
+            raise ElexonAPIException(f"Bad parameter: {pair}, use KEY=VALUE.")
+        params[key] = value
+    return params
+
+
+def read_api_key(key_file: str = None) -> str:
+    """API key, from ``key_file`` or the package directory."""
+    path = Path(key_file) if key_file is not None else get_api_key_path()
+    if not path.is_file():
+        raise ElexonAPIException(f"{path} not found.")
+    return path.read_text().strip()
+
+
+def print_progress(progress: JobProgress) -> None:
+    print(progress, file=sys.stderr, flush=True)
+
+
+def main(argv: List[str] = None) -> int:
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    try:
+        api_key = read_api_key(args.key_file)
+        params = parse_params(args.param)
+        units = expand_units(args.service_codes, args.start, args.end,
+                             window=args.window, **params)
+    except (ElexonAPIException, ValueError) as e:
+        print(f"elexon-export: {e}", file=sys.stderr)
+        return 2
+
+    output = Path(args.output)
+    path = output / JOB_FILENAME
+    job = args.job or ':'.join(['+'.join(args.service_codes), args.start, args.end,
+                                args.format])
+    queue_kwargs = {'lease': args.lease, 'max_attempts': args.max_attempts}
+    queue = JobQueue(path, job, **queue_kwargs)
+    n_new = queue.add(units)
+    if args.retry_failed:
+        queue.retry_failed()
+    before = queue.progress()
+    print(f"{job}: {before.total} units, {n_new} new, {before.done} already done.",
+          file=sys.stderr)
+
+    client_kwargs = {'base_url': args.base_url} if args.base_url else {}
+    state = run_workers(path, output, api_key, n_workers=args.workers, job=job,
+                        progress=print_progress, report_interval=args.interval,
+                        fmt=args.format, client_kwargs=client_kwargs,
+                        **queue_kwargs)
+    for unit_id, error in queue.get_errors().items():
+        print(f"unit {unit_id} failed: {error}", file=sys.stderr)
+    queue.close()
+    return 1 if state.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,31 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import importlib.util
 import requests
-import xmltodict
-import datetime as dt
-import pandas as pd
 from collections import OrderedDict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, Tuple
 
 from .config import (API_BASE_URL, API_VERSION, 
-                     DATE_FORMAT, TIME_FORMAT, DATETIME_FORMAT, 
-                     DATE_PARAMS, TIME_PARAMS, DATETIME_PARAMS, 
-                     REQUIRED_D, RESPONSE_D, DEFAULT_PARAM_VALUES,
-                     API_KEY_FILENAME, HEADER)
+                     RESPONSE_D, API_KEY_FILENAME, HEADER,
+                     POOL_CONNECTIONS, POOL_MAXSIZE, KEEPALIVE_TIMEOUT,
+                     ACCEPT_ENCODING, BROTLI_MODULES)
 
 from .utils import ElexonAPIException
 from .utils import get_api_key_path
+from .parser import parse_response, columns_to_df
+from .response import Response, validate_metadata
+from .scheduler import Scheduler
+from .windows import AdaptiveWindow
+from .metrics import Recorder, NULL_RECORDER, get_recorder, make_trace_config
+from .cache import make_cache_key
+from .plan import get_plan, format_params
+
+from ._lazy import lazy_import
+xmltodict = lazy_import('xmltodict')
+pd = lazy_import('pandas')
 
 import logging
 logger = logging.getLogger(__name__)
@@ -21,9 +34,58 @@ logger.addHandler(logging.NullHandler())
 
 @dataclass(frozen=True)
 class Client:
+    """Elexon API client.
+
+    Owns the connection pools used by :func:`query` and
+    :func:`~elexon_api.async_client.query_async`. Sessions are
+    created lazily on first use and reused by every following
+    query, so repeated calls share keep-alive connections.
+    Both ask for compressed responses (see :func:`get_accept_encoding`).
+    Use as a (async) context manager, or call :meth:`close`/
+    :meth:`aclose`, to release the connections.
+
+    Pass a :class:`~elexon_api.cache.ResponseCache` as ``cache``
+    to reuse stored responses instead of querying the API.
+    Expired responses are revalidated with a conditional request,
+    and reused if the API answers ``304 Not Modified``.
+    Rate limit, retries and timeouts are set by ``scheduler``
+    (see :class:`~elexon_api.scheduler.Scheduler`).
+    Pass a :class:`~elexon_api.singleflight.SingleFlight` as
+    ``single_flight`` to share the result of identical queries
+    running at the same time.
+    Pass a :class:`~elexon_api.metrics.Metrics` as ``metrics``
+    to record the duration of each stage of the queries.
+    Pass a :class:`~concurrent.futures.ProcessPoolExecutor` as
+    ``executor`` to parse the responses of :func:`query_df` and
+    :func:`~elexon_api.async_client.query_df_async` in worker
+    processes, so that parsing neither holds the GIL of the calling
+    process nor blocks its event loop (see :func:`parse_df_task`).
+    Windows of the range queries of windowed services are sized by
+    ``window_sizer`` (see :class:`~elexon_api.windows.AdaptiveWindow`).
+    """
     api_key: str
     base_url: str = API_BASE_URL
     api_version : str = API_VERSION
+    pool_connections: int = POOL_CONNECTIONS
+    pool_maxsize: int = POOL_MAXSIZE
+    keepalive_timeout: float = KEEPALIVE_TIMEOUT
+    cache: 'ResponseCache' = field(default=None, repr=False, compare=False)
+    scheduler: Scheduler = field(
+        default_factory=Scheduler, repr=False, compare=False)
+    single_flight: 'SingleFlight' = field(default=None, repr=False, compare=False)
+    metrics: 'Metrics' = field(default=None, repr=False, compare=False)
+    executor: 'Executor' = field(default=None, repr=False, compare=False)
+    window_sizer: AdaptiveWindow = field(
+        default_factory=AdaptiveWindow, repr=False, compare=False)
+
+    _session: requests.Session = field(
+        default=None, init=False, repr=False, compare=False)
+    _async_session: 'aiohttp.ClientSession' = field(
+        default=None, init=False, repr=False, compare=False)
+    _async_loop: asyncio.AbstractEventLoop = field(
+        default=None, init=False, repr=False, compare=False)
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False, compare=False)
 
     @classmethod
     def from_key_file(cls, key_file:str=None, *args, **kwargs):
@@ -42,6 +104,91 @@ class Client:
             api_key = f.read()
         return cls(api_key, *args, **kwargs)
 
+    @property
+    def session(self) -> requests.Session:
+        """Pooled session for sync queries, created on first use."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    object.__setattr__(self, '_session', self._new_session())
+        return self._session
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = get_accept_encoding()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get_async_session(self) -> 'aiohttp.ClientSession':
+        """Pooled session for async queries, created on first use.
+
+        Must be called from within a running event loop.
+        aiohttp sessions are bound to the loop that created them,
+        so a new one is opened if the running loop has changed.
+        """
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._async_session
+        if session is None or session.closed or self._async_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.pool_maxsize,
+                keepalive_timeout=self.keepalive_timeout)
+            trace_configs = None if self.metrics is None else [make_trace_config()]
+            session = aiohttp.ClientSession(
+                connector=connector, trace_configs=trace_configs,
+                headers={'Accept-Encoding': get_accept_encoding()})
+            object.__setattr__(self, '_async_session', session)
+            object.__setattr__(self, '_async_loop', loop)
+        return session
+
+    def close(self) -> None:
+        """Close the sync session."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                object.__setattr__(self, '_session', None)
+
+    async def close_async_session(self) -> None:
+        """Close the async session."""
+        session = self._async_session
+        if session is not None and not session.closed:
+            await session.close()
+        object.__setattr__(self, '_async_session', None)
+        object.__setattr__(self, '_async_loop', None)
+
+    async def aclose(self) -> None:
+        """Close both the async and the sync sessions."""
+        await self.close_async_session()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+def get_accept_encoding() -> str:
+    """Value of the ``Accept-Encoding`` header of the client sessions.
+
+    gzip and deflate, and brotli if one of :data:`~elexon_api.config.BROTLI_MODULES`
+    is installed: requests (urllib3) and aiohttp decode the same codings.
+    """
+    if any(importlib.util.find_spec(name) for name in BROTLI_MODULES):
+        return f"{ACCEPT_ENCODING}, br"
+    return ACCEPT_ENCODING
+
 
 def query(client: Client,
           service_code: str, 
@@ -64,19 +211,223 @@ def query(client: Client,
     **params
         Parameters for query.
     """
-    params = prepare_query_params(client.api_key, service_code, params)
-    if check_query: validate_params(service_code, params)
-    url = get_service_url(client.base_url, client.api_version, service_code)
-    
-    # TODO recycle session?
-    response = requests.get(url, params=params, headers=header)
-    response.raise_for_status()
-    r_dict = xmltodict.parse(response.text)['response']
-
-    if check_response: 
+    recorder = get_recorder(client.metrics, service_code)
+    plan = get_plan(service_code, client.base_url, client.api_version)
+    params = plan.build(client.api_key, params, check=check_query)
+    recorder.lap('prepare')
+
+    def _query():
+        with recorder:
+            r_bytes, from_cache, validators = fetch_body(
+                client, service_code, params, header, recorder)
+            r_dict = xmltodict.parse(r_bytes)['response']
+            recorder.lap('parse')
+
+            if check_response: 
+                validate_response(service_code, params, r_dict)
+                recorder.lap('validate')
+
+            if not from_cache:
+                store_body(client, service_code, params, r_bytes, validators)
+                recorder.lap('store')
+            return r_dict
+    return coalesce(client, 'query', service_code, params, _query)
+
+
+def query_df(client: Client,
+             service_code: str, 
+             header: dict = HEADER, 
+             check_query: bool = True,
+             check_response: bool = True, 
+             **params) -> pd.DataFrame:
+    """Query Elexon API and return items as a DataFrame.
+
+    Uses the streaming parser of :mod:`~elexon_api.parser`,
+    which is faster and lighter than :func:`query` followed
+    by :func:`~elexon_api.utils.extract_df` on large responses,
+    and converts columns to the dtypes of the service.
+    If the client has an ``executor``, the response is parsed in it.
+    Parameters are the same as for :func:`query`.
+    """
+    recorder = get_recorder(client.metrics, service_code)
+    plan = get_plan(service_code, client.base_url, client.api_version)
+    params = plan.build(client.api_key, params, check=check_query)
+    recorder.lap('prepare')
+
+    def _query():
+        with recorder:
+            r_bytes, from_cache, validators = fetch_body(
+                client, service_code, params, header, recorder)
+            if client.executor is not None:
+                df = client.executor.submit(
+                    parse_df_task, r_bytes, service_code, params, check_response).result()
+                recorder.lap('offload')
+            else:
+                r_dict, columns = parse_response(r_bytes)
+                recorder.lap('parse')
+
+                if check_response: 
+                    validate_response(service_code, params, r_dict)
+                    recorder.lap('validate')
+
+                df = columns_to_df(columns, service_code)
+                recorder.lap('extract')
+            recorder.count('rows', len(df))
+
+            if not from_cache:
+                store_body(client, service_code, params, r_bytes, validators)
+                recorder.lap('store')
+            return df
+    return coalesce(client, 'query_df', service_code, params, _query)
+
+
+def query_response(client: Client,
+                   service_code: str, 
+                   header: dict = HEADER, 
+                   check_query: bool = True,
+                   check_response: bool = True, 
+                   **params) -> Response:
+    """Query Elexon API and return a compact :class:`~elexon_api.response.Response`.
+
+    Only the metadata is parsed, items are parsed on demand by
+    :meth:`~elexon_api.response.Response.to_df`. Much lighter to
+    keep than the result of :func:`query`.
+    Parameters are the same as for :func:`query`.
+    """
+    recorder = get_recorder(client.metrics, service_code)
+    plan = get_plan(service_code, client.base_url, client.api_version)
+    params = plan.build(client.api_key, params, check=check_query)
+    recorder.lap('prepare')
+
+    def _query():
+        with recorder:
+            r_bytes, from_cache, validators = fetch_body(
+                client, service_code, params, header, recorder)
+            response = Response.from_bytes(r_bytes, service_code, params)
+            recorder.lap('parse')
+
+            if check_response: 
+                response.validate()
+                recorder.lap('validate')
+
+            if not from_cache:
+                store_body(client, service_code, params, r_bytes, validators)
+                recorder.lap('store')
+            return response
+    return coalesce(client, 'query_response', service_code, params, _query)
+
+
+def parse_df_task(r_bytes: bytes, 
+                  service_code: str, 
+                  params: dict, 
+                  check_response: bool = True) -> pd.DataFrame:
+    """Parse response body, validate it and build its DataFrame.
+
+    Run by the client executor: arguments are plain data and the
+    function is importable, so it can be sent to worker processes.
+    The typed DataFrame (numbers, datetimes and categories, see
+    :func:`~elexon_api.utils.apply_dtypes`) is sent back as a few
+    NumPy buffers, much smaller than the parsed dictionary.
+    """
+    r_dict, columns = parse_response(r_bytes)
+    if check_response:
         validate_response(service_code, params, r_dict)
-    
-    return r_dict
+    return columns_to_df(columns, service_code)
+
+
+def coalesce(client: Client, 
+             kind: str, 
+             service_code: str, 
+             params: dict, 
+             fn: Callable[[], Any]) -> Any:
+    """Call ``fn``, sharing the result of identical calls in flight.
+
+    Only if the client has a :class:`~elexon_api.singleflight.SingleFlight`,
+    otherwise just call ``fn``. Calls are identical if they have the same
+    ``kind`` (e.g. query function), service code and parameters.
+    """
+    if client.single_flight is None:
+        return fn()
+    key = (kind, make_cache_key(service_code, params))
+    return client.single_flight.do(key, fn)
+
+
+def fetch_body(client: Client, 
+               service_code: str, 
+               params: dict, 
+               header: dict = HEADER,
+               recorder: Recorder = NULL_RECORDER) -> Tuple[bytes, bool, dict]:
+    """Get raw response body, from the client cache if possible.
+
+    An expired cached response with validators is revalidated
+    by a conditional request, and reused if not modified.
+    Stages are recorded by ``recorder`` (see :mod:`~elexon_api.metrics`).
+
+    Returns
+    -------
+    r_bytes : bytes
+    from_cache : bool
+        True if the body was found in the cache (possibly revalidated).
+    validators : dict
+        ``etag`` and ``last_modified`` of the response, for :func:`store_body`.
+    """
+    entry = lookup_entry(client, service_code, params, recorder)
+    if entry is not None and entry.fresh:
+        return entry.body, True, {}
+
+    url = get_plan(service_code, client.base_url, client.api_version).url
+    if entry is not None:
+        header = {**header, **entry.validators}
+    result = client.scheduler.fetch_response(
+        client.session, url, params, header, recorder)
+    return get_fetched_body(client, service_code, params, entry, result, recorder)
+
+
+def lookup_entry(client: Client, 
+                 service_code: str, 
+                 params: dict,
+                 recorder: Recorder = NULL_RECORDER) -> Optional['CacheEntry']:
+    """Cached response (possibly expired), if the client has a cache."""
+    if client.cache is None:
+        return None
+    entry = client.cache.lookup_entry(service_code, params)
+    recorder.lap('cache')
+    if entry is not None and entry.fresh:
+        recorder.count('cache_hits')
+    else:
+        recorder.count('cache_misses')
+    return entry
+
+
+def get_fetched_body(client: Client, 
+                     service_code: str, 
+                     params: dict, 
+                     entry: Optional['CacheEntry'], 
+                     result: 'FetchResult',
+                     recorder: Recorder = NULL_RECORDER) -> Tuple[bytes, bool, dict]:
+    """Body of a (conditional) request, cached body if not modified.
+
+    See :func:`fetch_body`.
+    """
+    if result.not_modified and entry is not None:
+        client.cache.refresh(service_code, params)
+        recorder.count('revalidated')
+        return entry.body, True, {}
+    if result.not_modified:
+        raise ElexonAPIException(
+            f"Unexpected 304 response to {service_code} query without cached body")
+    validators = {'etag': result.etag, 'last_modified': result.last_modified}
+    return result.body, False, validators
+
+
+def store_body(client: Client, 
+               service_code: str, 
+               params: dict, 
+               r_bytes: bytes,
+               validators: dict = None) -> None:
+    """Store raw response body and its validators in the client cache, if any."""
+    if client.cache is not None:
+        client.cache.store(service_code, params, r_bytes, **(validators or {}))
 
 
 def get_service_url(base_url, api_version, service_code) -> str:
@@ -84,38 +435,16 @@ def get_service_url(base_url, api_version, service_code) -> str:
 
 
 def prepare_query_params(api_key, service_code: str, params: dict) -> dict:
-    """Prepare parameters for query."""
-    params['APIKey'] = api_key
-
-    # Use default value for required params which are not defined
-    params.update({
-        k:v for k,v in DEFAULT_PARAM_VALUES.items() 
-        if k in REQUIRED_D[service_code] 
-        and params.get(k) is None})
+    """Prepare parameters for query.
 
-    params = format_datetime_params(params)
-
-    return params
+    See :meth:`~elexon_api.plan.ServicePlan.build`.
+    """
+    return get_plan(service_code).build(api_key, params, check=False)
 
 
 def format_datetime_params(params: dict) -> dict:
     """Update date, time and datetime params."""
-    params.update({
-        k:v.strftime(DATE_FORMAT) 
-        for k,v in params.items() 
-        if k in DATE_PARAMS 
-        and isinstance(v, (dt.date, dt.datetime, pd.Timestamp))}) 
-    params.update({
-        k:v.strftime(TIME_FORMAT) 
-        for k,v in params.items() 
-        if k in TIME_PARAMS 
-        and isinstance(v, (dt.time, dt.datetime, pd.Timestamp))})
-    params.update({
-        k:v.strftime(DATETIME_FORMAT) 
-        for k,v in params.items() 
-        if k in DATETIME_PARAMS 
-        and isinstance(v, (dt.datetime, pd.Timestamp))})
-    return params
+    return format_params(params)
 
 
 #--------------------------------------------------------
@@ -126,20 +455,7 @@ def validate_params(service_code: str, params: dict) -> None:
     Check that query inputs are of the correct format.
     Will fail on missing arguments, 
     """
-    if service_code not in REQUIRED_D.keys():
-        raise ElexonAPIException(f"Unknown service_code: {service_code}.")
-
-    passed_set = set(params.keys())
-    required_set = set(REQUIRED_D[service_code])
-
-    if passed_set != required_set:
-        for extra_arg in passed_set - required_set:
-            logger.info(f"Extra argument for {service_code}: {extra_arg}")
-        if not required_set.issubset(passed_set):
-            for missing_arg in required_set - passed_set:
-                logger.warning(f"Missing argument for {service_code}: {missing_arg}.")
-            raise ElexonAPIException("Missing arguments for {service_code}.")
-    return
+    get_plan(service_code).validate(params)
 
 
 def validate_response(service_code: str, params: dict, r_dict: dict) -> None:
@@ -154,20 +470,9 @@ def validate_response(service_code: str, params: dict, r_dict: dict) -> None:
         Parsed response through xml.
     """
     r_metadata = r_dict['responseMetadata']
-    r_httpdesc = r_metadata['description']
-    r_query = r_metadata['queryString']
-    
-    if r_httpdesc != 'Success':
-        logger.warning(f"Bad Query. Description : {r_httpdesc}")
-        msg = (f"Bad query description. Query string: {r_query}")
-        raise ElexonAPIException(msg)
-    
+    data_item = None
     if RESPONSE_D[service_code]:
-        r_body = r_dict['responseBody']
-        r_servicecode = r_body['dataItem']
-        if r_servicecode != service_code:
-            raise ElexonAPIException(
-                "Service codes don't match \n" +
-                f"Requested code is {service_code}" +
-                f"Returned code is {r_servicecode}")
-    return
+        # "No Content" responses have no body
+        data_item = (r_dict.get('responseBody') or {}).get('dataItem')
+    validate_metadata(service_code, r_metadata['description'],
+                      r_metadata['queryString'], data_item)
@@ -10,6 +10,28 @@ API_BASE_URL        = f'https://api.bmreports.com/BMRS'
 API_KEY_FILENAME    = 'api_key.txt'
 HEADER              = {'Accept': 'application/xml'}
 
+#---------------------------------------------
+#           Connection Pool
+#---------------------------------------------
+POOL_CONNECTIONS    = 10    # number of host pools kept by the sync session
+POOL_MAXSIZE        = 10    # max connections per host (sync and async)
+KEEPALIVE_TIMEOUT   = 30.   # seconds an idle async connection is kept open
+
+#---------------------------------------------
+#           Compression
+#---------------------------------------------
+ACCEPT_ENCODING     = 'gzip, deflate'               # decoded by urllib3 and aiohttp
+BROTLI_MODULES      = ('brotli', 'brotlicffi')      # either one enables 'br'
+
+#---------------------------------------------
+#           Retries
+#---------------------------------------------
+REQUEST_TIMEOUT     = 60.   # seconds
+MAX_RETRIES         = 3
+BACKOFF_FACTOR      = 0.5   # seconds, doubled at each retry
+MAX_BACKOFF         = 30.   # seconds
+RETRY_STATUSES      = {429, 500, 502, 503, 504}
+
 #---------------------------------------------
 #           Date/Datetime Info
 #---------------------------------------------
@@ -27,12 +49,15 @@ TIME_PARAMS = ["StartTime", "EndTime"]
 
 DATETIME_PARAMS = ["FromDateTime", "ToDateTime"]
 
+MONTH_FORMAT    = '%b'
+
 #---------------------------------------------
 #           Required Params
 #---------------------------------------------
 
 DEFAULT_PARAM_VALUES = {
-    'Period': '*' # by default, get all periods
+    'Period': '*', # by default, get all periods
+    'SettlementPeriod': '*',
 }
 
 # parameters common to all services (mandatory)
@@ -160,6 +185,193 @@ GROUP_TO_REQUIRED = {
         16  :   ["FromSettlementDate"]
     }
 
+#---------------------------------------------
+#           Column Types
+#---------------------------------------------
+# dtype of response columns, by column name
+COLUMN_DTYPES = {
+    # dates and times
+    'settlementDate'                    : 'datetime64[ns]',
+    'startTimeOfHalfHrPeriod'           : 'datetime64[ns]',
+    'publishingPeriodCommencingTime'    : 'datetime64[ns]',
+    'reportSnapshotTime'                : 'datetime64[ns]',
+    'spotTime'                          : 'datetime64[ns]',
+    'timeFrom'                          : 'datetime64[ns]',
+    'timeTo'                            : 'datetime64[ns]',
+    'acceptanceTime'                    : 'datetime64[ns]',
+    # periods and counters
+    'settlementPeriod'                  : 'int16',
+    'numberOfBids'                      : 'int16',
+    'bidOfferPairNumber'                : 'int16',
+    'acceptanceNumber'                  : 'int32',
+    # quantities and prices
+    'quantity'                          : 'float32',
+    'imbalancePriceAmountGBP'           : 'float32',
+    'imbalanceQuantityMAW'              : 'float32',
+    'systemSellPrice'                   : 'float32',
+    'systemBuyPrice'                    : 'float32',
+    'marketIndexPrice'                  : 'float32',
+    'marketIndexVolume'                 : 'float32',
+    'bidPrice'                          : 'float32',
+    'offerPrice'                        : 'float32',
+    'bidOfferLevelFrom'                 : 'float32',
+    'bidOfferLevelTo'                   : 'float32',
+    'pnLevelFrom'                       : 'float32',
+    'pnLevelTo'                         : 'float32',
+    'levelFrom'                         : 'float32',
+    'levelTo'                           : 'float32',
+    'demand'                            : 'float32',
+    'frequency'                         : 'float32',
+    # labels
+    'recordType'                        : 'category',
+    'fuelType'                          : 'category',
+    'bmUnitID'                          : 'category',
+    'bmUnitType'                        : 'category',
+    'leadPartyName'                     : 'category',
+    'ngcBmUnitName'                     : 'category',
+    'priceCategory'                     : 'category',
+    'documentType'                      : 'category',
+    'businessType'                      : 'category',
+    'processType'                       : 'category',
+    'curveType'                         : 'category',
+    'resolution'                        : 'category',
+    'activeFlag'                        : 'category',
+    'docStatus'                         : 'category',
+}
+
+# generation by fuel type columns (FUELHH, FUELINST, ...)
+FUEL_COLUMNS = ['ccgt', 'ocgt', 'oil', 'coal', 'nuclear', 'wind', 'ps',
+                'npshyd', 'other', 'biomass', 'intfr', 'intirl', 'intned',
+                'intew', 'intnem', 'intelec', 'intifa2', 'intnsl']
+
+# service-specific dtypes, override COLUMN_DTYPES
+SERVICE_DTYPES_D = {
+    'FUELHH'    : {c: 'float32' for c in FUEL_COLUMNS},
+    'FUELINST'  : {c: 'float32' for c in FUEL_COLUMNS},
+}
+
+#---------------------------------------------
+#           Settlement Periods
+#---------------------------------------------
+TIMEZONE                    = 'Europe/London'
+SETTLEMENT_PERIOD_MINUTES   = 30
+
+#---------------------------------------------
+#           Incremental Sync
+#---------------------------------------------
+# columns identifying a row, when present (see NATURAL_KEYS_D)
+NATURAL_KEY_COLUMNS = ['recordType', 'bmUnitID', 'fuelType', 'priceCategory',
+                       'settlementDate', 'settlementPeriod',
+                       'startTimeOfHalfHrPeriod', 'publishingPeriodCommencingTime',
+                       'spotTime', 'timeFrom', 'acceptanceNumber',
+                       'bidOfferPairNumber']
+
+# service-specific natural keys, override NATURAL_KEY_COLUMNS
+NATURAL_KEYS_D = {}
+
+# settlement date columns, by priority
+SETTLEMENT_DATE_COLUMNS = ['settlementDate', 'startTimeOfHalfHrPeriod']
+
+# timestamp columns tracked by windowed services, by priority
+TIMESTAMP_COLUMNS = ['spotTime', 'publishingPeriodCommencingTime',
+                     'reportSnapshotTime', 'startTimeOfHalfHrPeriod']
+
+#---------------------------------------------
+#           Panels
+#---------------------------------------------
+# label columns spread into one column per value by query_panel, when present
+PANEL_KEY_COLUMNS = ['recordType', 'priceCategory', 'fuelType', 'dataProviderId']
+
+# service-specific panel keys, override PANEL_KEY_COLUMNS
+PANEL_KEYS_D = {}
+
+#---------------------------------------------
+#           Range Queries
+#---------------------------------------------
+# how a date range is split into requests, for each group
+GROUP_TO_RANGE_SPLIT = {
+        1   :   'day',
+        2   :   'week',
+        3   :   'month',
+        4   :   'year',
+        5   :   'window',
+        6   :   'window',
+        7   :   'window',
+        8   :   'day',
+        9   :   'window',
+        12  :   'window',
+        13  :   'day',
+        15  :   'window',
+        16  :   'day',
+    }
+
+DEFAULT_WINDOW      = 1     # days covered by each windowed request
+DEFAULT_MAX_WORKERS = POOL_MAXSIZE
+DEFAULT_MAX_PENDING = 4     # parsed chunks held at once by iter_range
+
+# largest window (days) requested by adaptive windows, for each group
+GROUP_TO_MAX_WINDOW = {
+        5   :   1,
+        6   :   7,
+        7   :   7,
+        9   :   1,
+        12  :   7,
+        15  :   7,
+    }
+
+# overrides of GROUP_TO_MAX_WINDOW for single services, e.g. {'FUELHH': 31}
+MAX_WINDOW_D = {}
+
+MIN_WINDOW          = 1 / 48    # days, smallest datetime window (one period)
+SLOW_WINDOW         = 30.       # seconds, windows taking longer are shrunk
+
+#---------------------------------------------
+#           Job Queue
+#---------------------------------------------
+JOB_FILENAME        = 'jobs.sqlite'
+JOB_LEASE           = 15 * 60   # seconds before a running unit counts as abandoned
+JOB_MAX_ATTEMPTS    = 3
+JOB_RATE_WINDOW     = 5 * 60    # seconds of completed units used for throughput
+JOB_REPORT_INTERVAL = 10.       # seconds between progress reports
+
+#---------------------------------------------
+#           Polling
+#---------------------------------------------
+# known publication cadence (seconds) of near-real-time services
+POLL_CADENCE_D = {
+    'FREQ'          : 2 * 60,
+    'FUELINST'      : 5 * 60,
+    'FUELINSTHHCUR' : 5 * 60,
+    'LATESTACCEPTS' : 60,
+    'ROLSYSDEM'     : 5 * 60,
+    'SYSWARN'       : 5 * 60,
+}
+DEFAULT_POLL_CADENCE = 5 * 60   # seconds, for other services
+POLL_MIN_INTERVAL    = 15.      # seconds, between polls of a service
+POLL_HISTORY         = 10       # publications kept to learn the cadence
+POLL_LOOKBACK        = 60 * 60  # seconds, first window of datetime windowed services
+
+#---------------------------------------------
+#           Response Cache
+#---------------------------------------------
+CACHE_FILENAME          = 'responses.sqlite'
+CACHE_MAX_BYTES         = 512 * 2**20
+DEFAULT_CACHE_TTL       = 15 * 60   # seconds, for data which may still change
+
+# data older than this (days) is considered final and never expires
+CACHE_FINAL_AFTER       = 7
+
+# services published more often than the default TTL
+CACHE_TTL_D = {
+    'FREQ'          : 60,
+    'FUELINST'      : 5 * 60,
+    'FUELINSTHHCUR' : 5 * 60,
+    'LATESTACCEPTS' : 60,
+    'ROLSYSDEM'     : 5 * 60,
+    'SYSWARN'       : 60,
+    'SYSWARNTDYTOM' : 60,
+}
+
 # to be implemented (as dict?)
 OPTIONAL_PARAMS = [
     'FuelType',
@@ -177,6 +389,9 @@ REQUIRED_D = {service: COMMON_PARAMS + GROUP_TO_REQUIRED[group]
 #---------------------------------------------
 #           Response Info
 #---------------------------------------------
+# description of successful queries without data (e.g. periods not published yet)
+NO_CONTENT_DESCRIPTION = 'No Content'
+
 # NOTE convert to list?
 RESPONSE_D = {'B0610': True,
               'B0620': True,
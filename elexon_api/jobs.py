@@ -0,0 +1,464 @@
+"""
+jobs.py
+=======
+
+Resumable backfills, run by several worker processes.
+
+A backfill is expanded into work units, one per request of
+:func:`~elexon_api.backfill.split_range` (service code and
+parameters, checked against the required parameters of the
+service), stored in a :class:`JobQueue`: a SQLite database with
+the status, attempts and result location of each unit.
+
+Workers (:func:`run_worker`, or :func:`run_workers` to start
+several processes) claim units one at a time, write the result of
+each to its own file, and mark it done. Nothing is kept in memory:
+after a crash, running the same job again only runs the units which
+are not done. Units claimed by a worker which died are claimed again
+once their lease expires, failed units are retried up to
+``max_attempts`` times.
+
+Workers on several machines can share a queue on shared storage.
+The database uses SQLite's default (rollback) journal, which works
+on network file systems with working locks, unlike WAL.
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from .config import (DEFAULT_WINDOW, JOB_FILENAME, JOB_LEASE, JOB_MAX_ATTEMPTS,
+                     JOB_RATE_WINDOW, JOB_REPORT_INTERVAL)
+from .plan import get_plan, format_params
+from .cache import make_cache_key
+from .metrics import Metrics
+from .utils import ElexonAPIException, NoContentError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+FORMATS = ('parquet', 'csv')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id              INTEGER PRIMARY KEY,
+    job             TEXT NOT NULL,
+    key             TEXT NOT NULL,
+    service_code    TEXT NOT NULL,
+    params          TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    worker          TEXT,
+    claimed         REAL,
+    finished        REAL,
+    rows            INTEGER,
+    nbytes          INTEGER,
+    result          TEXT,
+    error           TEXT,
+    UNIQUE (job, key)
+);
+CREATE INDEX IF NOT EXISTS units_status ON units (job, status);
+"""
+
+
+class Unit(NamedTuple):
+    """Work unit: one query."""
+    id: int
+    service_code: str
+    params: dict
+    attempts: int = 0
+
+
+class JobProgress(NamedTuple):
+    """Counts, throughput and ETA of a job."""
+    total: int
+    pending: int
+    running: int
+    done: int
+    failed: int
+    rows: int
+    nbytes: int
+    units_per_s: float
+    rows_per_s: float
+    bytes_per_s: float
+    eta: Optional[float]
+
+    def __str__(self) -> str:
+        eta = '?' if self.eta is None else f"{self.eta / 60:.1f} min"
+        return (f"{self.done}/{self.total} units done "
+                f"({self.running} running, {self.failed} failed), "
+                f"{self.rows:,} rows, {self.nbytes / 1e6:,.1f} MB, "
+                f"{self.units_per_s:.2f} requests/s, {self.bytes_per_s / 1e6:.2f} MB/s, "
+                f"{self.rows_per_s:,.0f} rows/s, ETA {eta}")
+
+
+def expand_units(service_codes: Iterable[str],
+                 start,
+                 end,
+                 window: int = DEFAULT_WINDOW,
+                 **params) -> List[tuple]:
+    """Work units of a backfill: ``(service_code, params)`` of each request.
+
+    Ranges are split by :func:`~elexon_api.backfill.split_range` (fixed
+    windows, so that units are the same from one run to the next), and
+    the parameters of each unit checked against those required by the
+    service. Dates are formatted, so that units can be stored.
+    """
+    from .backfill import split_range
+
+    units = []
+    for service_code in service_codes:
+        plan = get_plan(service_code)
+        for request_params in split_range(service_code, start, end, window):
+            unit_params = format_params({**params, **request_params})
+            for k, v in plan.defaults.items():
+                unit_params.setdefault(k, v)
+            # APIKey is set by the workers
+            plan.validate({**unit_params, 'APIKey': None})
+            units.append((service_code, unit_params))
+    return units
+
+
+class JobQueue:
+    """SQLite-backed queue of work units.
+
+    Each process (or thread) should open its own queue on the same path.
+
+    Parameters
+    ----------
+    path : str or Path
+        Database file, created if needed.
+    job : str
+        Name of the job, several jobs can share a database.
+    lease : float
+        Seconds after which a running unit is considered abandoned
+        (its worker died) and can be claimed again.
+    max_attempts : int
+        Attempts of a unit before it stays failed.
+    """
+
+    def __init__(self, path=JOB_FILENAME, job: str = 'default',
+                 lease: float = JOB_LEASE, max_attempts: int = JOB_MAX_ATTEMPTS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.job = job
+        self.lease = lease
+        self.max_attempts = max_attempts
+        # autocommit, transactions are explicit
+        self._conn = sqlite3.connect(str(path), timeout=60., isolation_level=None)
+        self._conn.executescript(_SCHEMA)
+
+    def add(self, units: Iterable[tuple]) -> int:
+        """Add ``(service_code, params)`` units, skipping known ones.
+
+        Returns the number of units added.
+        """
+        rows = [(self.job, make_cache_key(service_code, params), service_code,
+                 json.dumps(params, sort_keys=True), PENDING)
+                for service_code, params in units]
+        with self._transaction():
+            before = self._count()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO units (job, key, service_code, params, status) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            return self._count() - before
+
+    def claim(self, worker: str) -> Optional[Unit]:
+        """Take the next unit to run, ``None`` if there is none left.
+
+        Pending units come first, then failed units and running units
+        whose lease expired, if they have attempts left.
+        """
+        now = time.time()
+        with self._transaction():
+            # abandoned units without attempts left stay failed
+            self._conn.execute(
+                "UPDATE units SET status = ?, error = ? WHERE job = ? "
+                "AND status = ? AND claimed < ? AND attempts >= ?",
+                (FAILED, 'Lease expired', self.job, RUNNING,
+                 now - self.lease, self.max_attempts))
+            row = self._conn.execute(
+                "SELECT id, service_code, params, attempts FROM units "
+                "WHERE job = ? AND (status = ? "
+                "OR (status = ? AND attempts < ?) "
+                "OR (status = ? AND claimed < ?)) "
+                "ORDER BY status = ? DESC, id LIMIT 1",
+                (self.job, PENDING, FAILED, self.max_attempts,
+                 RUNNING, now - self.lease, PENDING)).fetchone()
+            if row is None:
+                return None
+            unit_id, service_code, params, attempts = row
+            self._conn.execute(
+                "UPDATE units SET status = ?, attempts = attempts + 1, "
+                "worker = ?, claimed = ? WHERE id = ?",
+                (RUNNING, worker, now, unit_id))
+        return Unit(unit_id, service_code, json.loads(params), attempts + 1)
+
+    def complete(self, unit: Unit, rows: int, result: str = None,
+                 nbytes: int = None) -> None:
+        """Mark unit as done, with the location of its result and
+        the size of its response."""
+        self._conn.execute(
+            "UPDATE units SET status = ?, finished = ?, rows = ?, result = ?, "
+            "nbytes = ?, error = NULL WHERE id = ?",
+            (DONE, time.time(), rows, result, nbytes, unit.id))
+
+    def fail(self, unit: Unit, error: BaseException) -> None:
+        """Mark unit as failed, it is retried if it has attempts left."""
+        self._conn.execute(
+            "UPDATE units SET status = ?, finished = ?, error = ? WHERE id = ?",
+            (FAILED, time.time(), repr(error), unit.id))
+
+    def retry_failed(self) -> int:
+        """Make failed units pending again, with all their attempts."""
+        cursor = self._conn.execute(
+            "UPDATE units SET status = ?, attempts = 0 WHERE job = ? AND status = ?",
+            (PENDING, self.job, FAILED))
+        return cursor.rowcount
+
+    def progress(self, window: float = JOB_RATE_WINDOW) -> JobProgress:
+        """Counts of units by status, throughput over the last ``window``
+        seconds, and estimated time to finish."""
+        now = time.time()
+        counts = dict(self._conn.execute(
+            "SELECT status, COUNT(*) FROM units WHERE job = ? GROUP BY status",
+            (self.job,)).fetchall())
+        rows, nbytes = self._conn.execute(
+            "SELECT COALESCE(SUM(rows), 0), COALESCE(SUM(nbytes), 0) FROM units "
+            "WHERE job = ? AND status = ?",
+            (self.job, DONE)).fetchone()
+        n_recent, recent_rows, recent_bytes, first = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(rows), 0), COALESCE(SUM(nbytes), 0), "
+            "MIN(claimed) FROM units "
+            "WHERE job = ? AND status = ? AND finished >= ?",
+            (self.job, DONE, now - window)).fetchone()
+        retryable, = self._conn.execute(
+            "SELECT COUNT(*) FROM units WHERE job = ? AND status = ? AND attempts < ?",
+            (self.job, FAILED, self.max_attempts)).fetchone()
+
+        # rate since the first recent unit started, or over the window
+        elapsed = min(window, now - first) if first is not None else window
+        units_per_s = n_recent / elapsed if elapsed > 0 else 0.
+        rows_per_s = recent_rows / elapsed if elapsed > 0 else 0.
+        bytes_per_s = recent_bytes / elapsed if elapsed > 0 else 0.
+        remaining = counts.get(PENDING, 0) + counts.get(RUNNING, 0) + retryable
+        eta = remaining / units_per_s if units_per_s else None
+        return JobProgress(total=sum(counts.values()),
+                           pending=counts.get(PENDING, 0),
+                           running=counts.get(RUNNING, 0),
+                           done=counts.get(DONE, 0),
+                           failed=counts.get(FAILED, 0),
+                           rows=rows, nbytes=nbytes, units_per_s=units_per_s,
+                           rows_per_s=rows_per_s, bytes_per_s=bytes_per_s, eta=eta)
+
+    def get_errors(self) -> Dict[int, str]:
+        """Last error of each failed unit."""
+        return dict(self._conn.execute(
+            "SELECT id, error FROM units WHERE job = ? AND status = ?",
+            (self.job, FAILED)).fetchall())
+
+    def get_results(self) -> List[str]:
+        """Result locations of the units done, in unit order."""
+        return [r for r, in self._conn.execute(
+            "SELECT result FROM units WHERE job = ? AND status = ? "
+            "AND result IS NOT NULL ORDER BY id", (self.job, DONE))]
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _count(self) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM units WHERE job = ?", (self.job,)).fetchone()[0]
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` transaction: takes the write lock up front,
+    so that two workers cannot claim the same unit."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *args):
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+#--------------------------------------------------------
+#                       WORKERS
+#--------------------------------------------------------
+class _ByteCounter(Metrics):
+    """Bytes of the responses of the current unit of a worker."""
+
+    def __init__(self):
+        self.nbytes = 0
+
+    def count(self, service_code: str, name: str, value: float = 1) -> None:
+        if name == 'bytes':
+            self.nbytes += value
+
+
+def get_worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def query_unit(client, unit: Unit) -> 'pd.DataFrame':
+    """Items of a unit, with no rows if nothing is published for it."""
+    from .client import query_df
+    try:
+        return query_df(client, unit.service_code, **unit.params)
+    except NoContentError:
+        import pandas as pd
+        return pd.DataFrame()
+
+
+def write_unit_result(df: 'pd.DataFrame', output, unit: Unit,
+                      fmt: str = 'parquet') -> str:
+    """Write result of a unit to its own file, return its path.
+
+    ``<output>/service_code=<service_code>/unit-<id>.<fmt>``, written
+    to a temporary file first, so that a unit run again after a
+    crash replaces a complete file.
+    """
+    if fmt not in FORMATS:
+        raise ElexonAPIException(f"Unknown format: {fmt}, use one of {FORMATS}.")
+    directory = Path(output) / f"service_code={unit.service_code}"
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"unit-{unit.id:08d}.{fmt}"
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    if fmt == 'parquet':
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return str(path)
+
+
+def run_worker(path,
+               output,
+               api_key: str,
+               job: str = 'default',
+               fmt: str = 'parquet',
+               max_units: int = None,
+               client_kwargs: dict = None,
+               **queue_kwargs) -> int:
+    """Claim and run units of a job until there are none left.
+
+    Parameters
+    ----------
+    path : str or Path
+        Queue database.
+    output : str or Path
+        Directory of the results, see :func:`write_unit_result`.
+    api_key : str
+    job : str
+    fmt : {'parquet', 'csv'}
+        Format of the results.
+    max_units : int
+        If passed, stop after this many units.
+    client_kwargs : dict
+        Passed to :class:`~elexon_api.client.Client` (e.g. ``base_url``).
+    **queue_kwargs
+        Passed to :class:`JobQueue` (``lease``, ``max_attempts``).
+
+    Returns
+    -------
+    int
+        Number of units done by this worker.
+    """
+    from .client import Client
+
+    worker = get_worker_name()
+    queue = JobQueue(path, job, **queue_kwargs)
+    counter = _ByteCounter()
+    n_done = 0
+    with Client(api_key, **{'metrics': counter, **(client_kwargs or {})}) as client:
+        while max_units is None or n_done < max_units:
+            unit = queue.claim(worker)
+            if unit is None:
+                break
+            counter.nbytes = 0
+            try:
+                df = query_unit(client, unit)
+                result = None if df.empty else write_unit_result(df, output, unit, fmt)
+            except Exception as e:
+                logger.warning(f"Unit {unit.id} ({unit.service_code}, "
+                               f"attempt {unit.attempts}) failed: {e!r}")
+                queue.fail(unit, e)
+                continue
+            queue.complete(unit, len(df), result, counter.nbytes)
+            n_done += 1
+    queue.close()
+    logger.info(f"Worker {worker} done: {n_done} units.")
+    return n_done
+
+
+def run_workers(path,
+                output,
+                api_key: str,
+                n_workers: int = None,
+                job: str = 'default',
+                progress: Callable[[JobProgress], None] = None,
+                report_interval: float = JOB_REPORT_INTERVAL,
+                lease: float = JOB_LEASE,
+                max_attempts: int = JOB_MAX_ATTEMPTS,
+                **kwargs) -> JobProgress:
+    """Run units of a job in ``n_workers`` processes, until none are left.
+
+    Parameters
+    ----------
+    path, output, api_key, job
+        See :func:`run_worker`.
+    n_workers : int
+        Worker processes, defaults to the number of cores.
+    progress : callable
+        Called with the :class:`JobProgress` every ``report_interval``
+        seconds, and at the end. Logged if not passed.
+    lease, max_attempts
+        See :class:`JobQueue`, used by the workers and for the progress.
+    **kwargs
+        Passed to :func:`run_worker`.
+
+    Returns
+    -------
+    JobProgress
+        Final state of the job.
+    """
+    n_workers = n_workers or os.cpu_count()
+    progress = progress or (lambda p: logger.info(str(p)))
+    queue_kwargs = {'lease': lease, 'max_attempts': max_attempts}
+    queue = JobQueue(path, job, **queue_kwargs)
+    # spawn, not fork: workers start without the threads of this process
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_worker,
+                                 args=(path, output, api_key, job),
+                                 kwargs={**kwargs, **queue_kwargs}, daemon=True)
+                 for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    try:
+        while True:
+            for process in processes:
+                process.join(timeout=report_interval / n_workers)
+            if not any(p.is_alive() for p in processes):
+                break
+            progress(queue.progress())
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    state = queue.progress()
+    progress(state)
+    queue.close()
+    return state
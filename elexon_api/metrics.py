@@ -0,0 +1,315 @@
+"""
+metrics.py
+==========
+
+Instrumentation of queries.
+
+Pass a :class:`Metrics` as the ``metrics`` of a
+:class:`~elexon_api.client.Client` (or to the extract functions of
+:mod:`~elexon_api.utils`) to record, for each query, tagged by
+service code:
+
+* the duration (seconds) of each stage: ``prepare`` (parameters),
+  ``cache`` (lookup), ``wait`` (rate limit and concurrency cap),
+  ``dns``, ``connect`` (async only, included in ``ttfb`` for sync
+  queries), ``ttfb`` (until the response headers are received),
+  ``download``, ``backoff`` (sleeping before retries), ``parse``
+  (XML), ``validate``, ``extract`` (DataFrame building), ``offload``
+  (parse, validate and extract in the client executor, including
+  the transfer), ``store`` (cache), and for the polls of a
+  :class:`~elexon_api.poller.Poller`, ``deliver`` (subscribers) and
+  ``latency`` (from the timestamp of new rows to their delivery);
+* counters: ``bytes`` (of the response body, decompressed),
+  ``wire_bytes`` (as transferred, e.g. gzipped), ``rows``,
+  ``retries``, ``cache_hits``, ``cache_misses``, ``not_modified``
+  (304 responses), ``revalidated`` (expired cached responses
+  reused after a 304), ``unchanged`` (polled payloads identical
+  to the previous one, not parsed) and ``errors`` (failed queries,
+  reported with the stages and retries they went through).
+
+Implement :meth:`Metrics.timing` and :meth:`Metrics.count` to export
+them, or use :class:`MetricsAggregator` (p50/p95 per service),
+:class:`PrometheusMetrics` or :class:`OpenTelemetryMetrics`.
+Without metrics, the query functions only call the no-op methods of
+:data:`NULL_RECORDER`.
+"""
+
+from __future__ import annotations
+
+import time
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from ._lazy import lazy_import
+pd = lazy_import('pandas')
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+PERCENTILES = (50, 95)
+
+
+class Metrics:
+    """Receiver of query metrics, ignores them by default."""
+
+    def timing(self, service_code: str, stage: str, seconds: float) -> None:
+        """Duration of a stage of a query."""
+
+    def count(self, service_code: str, name: str, value: float = 1) -> None:
+        """Increment of a counter."""
+
+
+class Recorder:
+    """Stats of one query, reported to metrics at the end of it.
+
+    Stage durations are measured as laps: :meth:`lap` closes the
+    stage started by the previous lap (or by the creation of the
+    recorder). Repeated stages (e.g. after retries) are summed.
+    Used as a context manager, stats are reported when the block
+    exits, also when it raises (counted in ``errors``).
+    """
+    __slots__ = ('metrics', 'service_code', 'timings', 'counts', '_last')
+
+    def __init__(self, metrics: Metrics, service_code: str = None):
+        self.metrics = metrics
+        self.service_code = service_code
+        self.timings: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.) + now - self._last
+        self._last = now
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def report(self) -> None:
+        """Send stats to metrics."""
+        for stage, seconds in self.timings.items():
+            self.metrics.timing(self.service_code, stage, seconds)
+        for name, value in self.counts.items():
+            self.metrics.count(self.service_code, name, value)
+
+    def __enter__(self) -> 'Recorder':
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is not None:
+            self.count('errors')
+        self.report()
+
+
+class _NullRecorder:
+    """Recorder used when metrics are disabled."""
+    __slots__ = ()
+
+    def lap(self, stage: str) -> None:
+        pass
+
+    def count(self, name: str, value: float = 1) -> None:
+        pass
+
+    def report(self) -> None:
+        pass
+
+    def __enter__(self) -> '_NullRecorder':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+NULL_RECORDER = _NullRecorder()
+
+
+def get_recorder(metrics: Metrics = None, service_code: str = None):
+    """Recorder of a query, :data:`NULL_RECORDER` if ``metrics`` is None."""
+    if metrics is None:
+        return NULL_RECORDER
+    return Recorder(metrics, service_code)
+
+
+def make_trace_config() -> 'aiohttp.TraceConfig':
+    """aiohttp trace config timing DNS resolution and connection.
+
+    Laps the recorder passed as ``trace_request_ctx`` of the request.
+    """
+    import aiohttp
+
+    async def on_dns_resolvehost_end(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.lap('dns')
+
+    async def on_connection_create_end(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.lap('connect')
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+#--------------------------------------------------------
+#                       AGGREGATOR
+#--------------------------------------------------------
+class MetricsAggregator(Metrics):
+    """Keep all values in memory, and summarize them per service.
+
+    Thread-safe, so it can be shared by concurrent queries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        self._counts: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def timing(self, service_code: str, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._timings[service_code, stage].append(seconds)
+
+    def count(self, service_code: str, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counts[service_code, name] += value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._timings.clear()
+            self._counts.clear()
+
+    def get_counts(self) -> Dict[Tuple[str, str], float]:
+        """Counter totals, by (service code, name)."""
+        with self._lock:
+            return dict(self._counts)
+
+    def summary(self) -> pd.DataFrame:
+        """Count, total, p50 and p95 (seconds) of each stage, per service."""
+        with self._lock:
+            timings = {k: sorted(v) for k, v in self._timings.items()}
+        rows = []
+        for (service_code, stage), values in sorted(timings.items(),
+                                                    key=lambda kv: (str(kv[0][0]), kv[0][1])):
+            row = {'service_code': service_code, 'stage': stage,
+                   'count': len(values), 'total': sum(values)}
+            for p in PERCENTILES:
+                row[f'p{p}'] = get_percentile(values, p)
+            rows.append(row)
+        columns = ['service_code', 'stage', 'count', 'total'] + [f'p{p}' for p in PERCENTILES]
+        return pd.DataFrame(rows, columns=columns).set_index(['service_code', 'stage'])
+
+    def report(self) -> str:
+        """Summary as text, one block per service."""
+        with self._lock:
+            timings = {k: sorted(v) for k, v in self._timings.items()}
+            counts = dict(self._counts)
+        lines = []
+        for service_code in sorted({k[0] for k in [*timings, *counts]}, key=str):
+            lines.append(f"{service_code}")
+            lines.append(f"  {'stage':<10} {'count':>7} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+            for (s, stage), values in timings.items():
+                if s == service_code:
+                    lines.append(
+                        f"  {stage:<10} {len(values):>7} "
+                        f"{get_percentile(values, 50) * 1e3:>10.2f} "
+                        f"{get_percentile(values, 95) * 1e3:>10.2f}")
+            service_counts = ', '.join(f"{name}={value:,.0f}"
+                                       for (s, name), value in counts.items()
+                                       if s == service_code)
+            if service_counts:
+                lines.append(f"  {service_counts}")
+            wire_bytes = counts.get((service_code, 'wire_bytes'))
+            if wire_bytes:
+                ratio = counts.get((service_code, 'bytes'), 0) / wire_bytes
+                lines.append(f"  compression ratio={ratio:.1f}")
+        return '\n'.join(lines)
+
+
+def get_percentile(sorted_values: List[float], p: float) -> float:
+    """Percentile of sorted values, linearly interpolated."""
+    if not sorted_values:
+        return float('nan')
+    rank = (len(sorted_values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+#--------------------------------------------------------
+#                       EXPORTERS
+#--------------------------------------------------------
+class PrometheusMetrics(Metrics):
+    """Export to Prometheus through :mod:`prometheus_client`.
+
+    Stages are observed by the histogram ``<namespace>_stage_seconds``
+    and counters incremented in ``<namespace>_events_total``, both
+    labelled by ``service_code`` and ``stage``/``name``.
+
+    Parameters
+    ----------
+    registry : prometheus_client.CollectorRegistry
+        Defaults to the global registry.
+    namespace : str
+    """
+
+    def __init__(self, registry=None, namespace: str = 'elexon_api'):
+        try:
+            import prometheus_client
+        except ImportError:
+            raise NotImplementedError(
+                "PrometheusMetrics is not available"
+                + " because prometheus_client is not installed.")
+        kwargs = {} if registry is None else {'registry': registry}
+        self._timings = prometheus_client.Histogram(
+            'stage_seconds', 'Duration of query stages.',
+            ['service_code', 'stage'], namespace=namespace, **kwargs)
+        self._counts = prometheus_client.Counter(
+            'events', 'Query counters (bytes, rows, retries, cache hits).',
+            ['service_code', 'name'], namespace=namespace, **kwargs)
+
+    def timing(self, service_code: str, stage: str, seconds: float) -> None:
+        self._timings.labels(service_code or '', stage).observe(seconds)
+
+    def count(self, service_code: str, name: str, value: float = 1) -> None:
+        self._counts.labels(service_code or '', name).inc(value)
+
+
+class OpenTelemetryMetrics(Metrics):
+    """Export through an OpenTelemetry meter.
+
+    Stages are recorded by the histogram ``elexon_api.stage.duration``
+    and counters added to ``elexon_api.events``, with attributes
+    ``service_code`` and ``stage``/``name``.
+
+    Parameters
+    ----------
+    meter : opentelemetry.metrics.Meter
+        Defaults to the meter ``elexon_api`` of the global meter provider.
+    """
+
+    def __init__(self, meter=None):
+        if meter is None:
+            try:
+                from opentelemetry import metrics
+            except ImportError:
+                raise NotImplementedError(
+                    "OpenTelemetryMetrics is not available"
+                    + " because opentelemetry-api is not installed.")
+            meter = metrics.get_meter('elexon_api')
+        self._timings = meter.create_histogram(
+            'elexon_api.stage.duration', unit='s',
+            description='Duration of query stages.')
+        self._counts = meter.create_counter(
+            'elexon_api.events',
+            description='Query counters (bytes, rows, retries, cache hits).')
+
+    def timing(self, service_code: str, stage: str, seconds: float) -> None:
+        self._timings.record(seconds, {'service_code': service_code or '',
+                                       'stage': stage})
+
+    def count(self, service_code: str, name: str, value: float = 1) -> None:
+        self._counts.add(value, {'service_code': service_code or '',
+                                 'name': name})
@@ -0,0 +1,199 @@
+"""
+panel.py
+========
+
+Several services side by side, over the same settlement days.
+
+:func:`query_panel` queries every service over a date range
+concurrently, on the client's async session, and returns one wide
+DataFrame: a row per settlement period (or per UTC start of period)
+and a column per service and field. Each result is reshaped onto the
+shared index on its own (labels such as ``recordType`` are spread
+into columns, see :data:`~elexon_api.config.PANEL_KEY_COLUMNS`), then
+all of them are aligned in one index join.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Dict, Iterable, List, Union
+
+from .config import (SETTLEMENT_DATE_COLUMNS, PANEL_KEY_COLUMNS, PANEL_KEYS_D,
+                     DEFAULT_MAX_PENDING)
+from .client import Client
+from .backfill import aiter_range, concat_frames
+from .utils import ElexonAPIException, get_period_start_utc
+
+from ._lazy import lazy_import
+pd = lazy_import('pandas')
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+INDEX_NAMES = ['settlementDate', 'settlementPeriod']
+
+
+async def query_panel_async(client: Client,
+                            services: Union[Iterable[str], Dict[str, dict]],
+                            start,
+                            end=None,
+                            index: str = 'period',
+                            aggfunc: str = 'mean',
+                            max_pending: int = DEFAULT_MAX_PENDING,
+                            sep: str = '_',
+                            **kwargs) -> pd.DataFrame:
+    """Query several services over a date range, as one wide DataFrame.
+
+    Parameters
+    ----------
+    client : Client
+    services : iterable or dict
+        Service codes, or ``{service_code: params}`` to pass additional
+        parameters to the queries of some services (over ``**kwargs``).
+    start, end
+        Range of settlement dates, both included. ``end`` defaults
+        to ``start``.
+    index : {'period', 'utc'}
+        Index of the result: ``(settlementDate, settlementPeriod)``, or
+        the UTC start of each settlement period (``timestamp``).
+    aggfunc : str or callable
+        Aggregation of the rows sharing the same period and labels
+        (e.g. one per acceptance in ``DETSYSPRICES``).
+    max_pending : int
+        Maximum concurrent requests per service.
+    sep : str
+        Separator of the parts of column names, e.g.
+        ``B1770_imbalancePriceAmountGBP_Excess balance``.
+    **kwargs
+        Passed to :func:`~elexon_api.backfill.aiter_range`
+        (e.g. ``check_response``).
+
+    Returns
+    -------
+    pd.DataFrame
+        Numeric fields of every service, one column per service, field
+        and label, aligned on the periods of the range.
+    """
+    if index not in ('period', 'utc'):
+        raise ElexonAPIException(f"Unknown panel index: {index}.")
+    if not isinstance(services, dict):
+        services = dict.fromkeys(services)
+    end = start if end is None else end
+
+    async def _query(service_code: str, params: dict) -> pd.DataFrame:
+        dfs = [df async for df in aiter_range(
+            client, service_code, start, end, max_pending=max_pending,
+            **{**kwargs, **(params or {})})]
+        return concat_frames(dfs, service_code) if dfs else pd.DataFrame()
+
+    frames = await asyncio.gather(*[_query(service_code, params)
+                                    for service_code, params in services.items()])
+    return join_panel(dict(zip(services, frames)), start, end,
+                      index=index, aggfunc=aggfunc, sep=sep)
+
+
+def query_panel(client: Client,
+                services: Union[Iterable[str], Dict[str, dict]],
+                start,
+                end=None,
+                **kwargs) -> pd.DataFrame:
+    """Query several services over a date range, as one wide DataFrame.
+
+    Sync wrapper of :func:`query_panel_async`, running its own event
+    loop: it cannot be called from a running loop (e.g. a notebook
+    cell), use :func:`query_panel_async` there.
+    """
+    async def _run():
+        try:
+            return await query_panel_async(client, services, start, end, **kwargs)
+        finally:
+            await client.close_async_session()
+    return asyncio.run(_run())
+
+
+def join_panel(frames: Dict[str, pd.DataFrame],
+               start=None,
+               end=None,
+               index: str = 'period',
+               aggfunc: str = 'mean',
+               sep: str = '_') -> pd.DataFrame:
+    """Align the items of several services on settlement periods.
+
+    Parameters are those of :func:`query_panel_async`, ``frames``
+    being the items of each service. Rows outside of the
+    ``start``-``end`` dates (if passed) are dropped.
+    """
+    wide = [to_wide(df, service_code, aggfunc=aggfunc, sep=sep)
+            for service_code, df in frames.items() if not df.empty]
+    if not wide:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=INDEX_NAMES))
+    # one join of all the (unique) indexes
+    panel = pd.concat(wide, axis=1, join='outer').sort_index()
+
+    dates = panel.index.get_level_values(0)
+    mask = None
+    if start is not None:
+        mask = dates >= pd.Timestamp(start).normalize()
+    if end is not None:
+        below = dates <= pd.Timestamp(end).normalize()
+        mask = below if mask is None else mask & below
+    if mask is not None:
+        panel = panel[mask]
+
+    if index == 'utc':
+        panel.index = get_period_start_utc(panel.index.get_level_values(0),
+                                           panel.index.get_level_values(1))
+        panel.index.name = 'timestamp'
+    return panel
+
+
+def to_wide(df: pd.DataFrame,
+            service_code: str,
+            aggfunc: str = 'mean',
+            sep: str = '_') -> pd.DataFrame:
+    """Reshape the items of a service to one row per settlement period.
+
+    Numeric fields are kept, labels of :func:`get_panel_keys` spread
+    into columns, and remaining duplicates aggregated by ``aggfunc``.
+    Columns are named ``<service_code><sep><field>[<sep><label>...]``.
+    """
+    date_column = next((c for c in SETTLEMENT_DATE_COLUMNS if c in df), None)
+    if date_column is None or 'settlementPeriod' not in df:
+        raise ElexonAPIException(
+            f"{service_code} items have no settlement date and period.")
+    df = df[df[date_column].notna() & df['settlementPeriod'].notna()]
+
+    keys = get_panel_keys(df, service_code)
+    index_columns = {date_column, 'settlementPeriod', *keys}
+    values = [c for c in df.select_dtypes('number').columns if c not in index_columns]
+    frame = df[values]
+    frame.index = pd.MultiIndex.from_arrays(
+        [df[date_column].dt.normalize().astype('datetime64[ns]'),
+         df['settlementPeriod'].astype('int16'),
+         *(df[k] for k in keys)],
+        names=[*INDEX_NAMES, *keys])
+
+    if not frame.index.is_unique:
+        logger.info(f"{service_code}: aggregating rows of the same period ({aggfunc}).")
+        frame = frame.groupby(level=list(range(frame.index.nlevels)),
+                              observed=True, sort=False).agg(aggfunc)
+    if keys:
+        frame.index = frame.index.remove_unused_levels()
+        frame = frame.unstack(keys)
+    frame = frame.dropna(axis=1, how='all')
+    frame.columns = [sep.join([service_code, *map(str, c)]) if isinstance(c, tuple)
+                     else f"{service_code}{sep}{c}" for c in frame.columns]
+    return frame
+
+
+def get_panel_keys(df: pd.DataFrame, service_code: str) -> List[str]:
+    """Label columns of a service spread into columns of its panel.
+
+    Those of :data:`~elexon_api.config.PANEL_KEYS_D`, or else those of
+    :data:`~elexon_api.config.PANEL_KEY_COLUMNS` taking several values.
+    """
+    if service_code in PANEL_KEYS_D:
+        return [c for c in PANEL_KEYS_D[service_code] if c in df]
+    return [c for c in PANEL_KEY_COLUMNS
+            if c in df and df[c].nunique(dropna=True) > 1]
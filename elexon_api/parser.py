@@ -0,0 +1,237 @@
+"""
+parser.py
+=========
+
+Streaming parser for Elexon API responses.
+
+Items in ``responseBody/responseList`` are read with expat straight
+into one list per column, without building the nested dictionary
+returned by :mod:`xmltodict`. The rest of the response (metadata,
+``dataItem``...) is returned as a dictionary shaped like the
+:mod:`xmltodict` output, so that
+:func:`~elexon_api.client.validate_response` can be used on it.
+"""
+
+from __future__ import annotations
+
+from xml.parsers import expat
+from typing import Dict, Iterable, List, Tuple, Union
+
+from .utils import get_dtypes, convert_column, split_df
+
+from ._lazy import lazy_import
+pd = lazy_import('pandas')
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# depth of the item elements: response/responseBody/responseList/item
+ITEM_DEPTH = 4
+
+# suffixes of column names parsed as datetimes
+DATETIME_SUFFIXES = ('Date', 'Time', 'DateTime')
+
+
+class _ResponseHandler:
+    """Expat callbacks, collecting metadata and item columns."""
+
+    def __init__(self):
+        self.depth = 0
+        self.text = []
+        # stack of (tag, children) for elements outside responseList
+        self.stack = [('', {})]
+        self.in_list = False
+        self.row = None
+        self.field = None
+        self.columns: Dict[str, List] = {}
+        self.n_rows = 0
+        # false once a row is missing any field
+        self.complete = True
+        # fields (in order) of each row, as codes of the distinct tuples of fields
+        self.signatures: Dict[tuple, int] = {}
+        self.row_signatures: List[int] = []
+
+    def start(self, tag, attrs):
+        self.depth += 1
+        self.text = []
+        if self.in_list:
+            if self.depth == ITEM_DEPTH:
+                self.row = {}
+            elif self.depth == ITEM_DEPTH + 1:
+                self.field = tag
+            return
+        if tag == 'responseList' and self.depth == ITEM_DEPTH - 1:
+            self.in_list = True
+            return
+        self.stack.append((tag, {}))
+
+    def end(self, tag):
+        depth = self.depth
+        self.depth -= 1
+        if self.in_list:
+            if depth == ITEM_DEPTH + 1:
+                self.row[self.field] = ''.join(self.text) or None
+            elif depth == ITEM_DEPTH:
+                self._append_row(self.row)
+                self.row = None
+            elif depth == ITEM_DEPTH - 1:
+                self.in_list = False
+            self.text = []
+            return
+        tag, children = self.stack.pop()
+        value = children or (''.join(self.text).strip() or None)
+        self.stack[-1][1][tag] = value
+        self.text = []
+
+    def data(self, text):
+        self.text.append(text)
+
+    def _append_row(self, row: dict) -> None:
+        columns = self.columns
+        for key, value in row.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * self.n_rows
+                self.complete = self.complete and not self.n_rows
+            column.append(value)
+        self.n_rows += 1
+        self.row_signatures.append(
+            self.signatures.setdefault(tuple(row), len(self.signatures)))
+        if len(row) != len(columns):
+            self.complete = False
+            for key, column in columns.items():
+                if len(column) < self.n_rows:
+                    column.append(None)
+
+
+def parse_response(source: Union[bytes, str, Iterable[bytes]]
+                   ) -> Tuple[dict, Dict[str, List]]:
+    """Parse response into metadata and item columns.
+
+    Parameters
+    ----------
+    source
+        Response body, or an iterable of chunks of it.
+
+    Returns
+    -------
+    r_dict : dict
+        Response without the items, shaped like the
+        :mod:`xmltodict` output.
+    columns : dict
+        Values of each item field, ``None`` where missing.
+    """
+    return _parse(source)[:2]
+
+
+class _StopParsing(Exception):
+    pass
+
+
+def parse_metadata(source: Union[bytes, str]) -> dict:
+    """Parse response up to its items, without reading them.
+
+    Much cheaper than :func:`parse_response` on large responses,
+    since the items come last.
+
+    Returns
+    -------
+    r_dict : dict
+        Response without the items, shaped like the
+        :mod:`xmltodict` output.
+    """
+    handler = _ResponseHandler()
+
+    def start(tag, attrs):
+        if tag == 'responseList' and handler.depth == ITEM_DEPTH - 2:
+            raise _StopParsing
+        handler.start(tag, attrs)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+    try:
+        parser.Parse(source, True)
+    except _StopParsing:
+        # close the elements still open (response, responseBody)
+        while len(handler.stack) > 1:
+            tag, children = handler.stack.pop()
+            handler.stack[-1][1][tag] = children or None
+    return handler.stack[0][1]['response']
+
+
+def _parse(source) -> Tuple[dict, Dict[str, List], _ResponseHandler]:
+    """Parse response, also returning the handler (fields of each item)."""
+    handler = _ResponseHandler()
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+
+    if isinstance(source, (bytes, str)):
+        parser.Parse(source, True)
+    else:
+        for chunk in source:
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+
+    r_dict = handler.stack[0][1]['response']
+    return r_dict, handler.columns, handler
+
+
+def columns_to_df(columns: Dict[str, List], 
+                  service_code: str = None) -> pd.DataFrame:
+    """Build DataFrame from item columns.
+
+    Columns with a known dtype for the service (see
+    :func:`~elexon_api.utils.get_dtypes`) are converted to it,
+    the others to numbers or datetimes where possible.
+    """
+    dtypes = get_dtypes(service_code)
+    return pd.DataFrame({
+        k: convert_column(pd.Series(v, dtype=object), dtypes[k]) 
+           if k in dtypes else _infer_column(k, v)
+        for k, v in columns.items()})
+
+
+def _infer_column(name: str, values: List) -> pd.Series:
+    """Convert to numeric or datetime if all values can be converted."""
+    series = pd.Series(values, dtype=object)
+    n_valid = series.notna().sum()
+
+    numeric = pd.to_numeric(series, errors='coerce')
+    if numeric.notna().sum() == n_valid:
+        return numeric
+
+    if name.endswith(DATETIME_SUFFIXES):
+        datetimes = pd.to_datetime(series, errors='coerce', format='ISO8601')
+        if datetimes.notna().sum() == n_valid:
+            return datetimes
+    return series
+
+
+def parse_df(source: Union[bytes, str, Iterable[bytes]],
+             service_code: str = None) -> Tuple[dict, pd.DataFrame]:
+    """Parse response into metadata and a typed DataFrame of its items."""
+    r_dict, columns = parse_response(source)
+    return r_dict, columns_to_df(columns, service_code)
+
+
+def parse_frames_by_record_type(source: Union[bytes, str, Iterable[bytes]],
+                                service_code: str = None
+                                ) -> Tuple[dict, Dict[str, pd.DataFrame]]:
+    """Parse response into metadata and one DataFrame per record type.
+
+    Streaming counterpart of
+    :func:`~elexon_api.utils.extract_df_by_record_type`.
+    """
+    r_dict, columns, handler = _parse(source)
+    df = columns_to_df(columns, service_code)
+    fields = None
+    if not handler.complete or len(handler.signatures) > 1:
+        fields = (list(handler.signatures), handler.row_signatures)
+    return r_dict, split_df(df, 'recordType', fields=fields)
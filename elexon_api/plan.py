@@ -0,0 +1,98 @@
+"""
+plan.py
+=======
+
+Precompiled query plans.
+
+A :class:`ServicePlan` holds everything needed to turn the
+parameters of a query into the request of a service: the
+required parameters (as a frozenset), their default values,
+the formatter of each date/time parameter and the service URL.
+Plans are built once per service and reused by every query.
+"""
+
+import datetime as dt
+from functools import lru_cache
+from typing import Dict, FrozenSet, Tuple
+
+from .config import (API_BASE_URL, API_VERSION,
+                     DATE_FORMAT, TIME_FORMAT, DATETIME_FORMAT,
+                     DATE_PARAMS, TIME_PARAMS, DATETIME_PARAMS,
+                     REQUIRED_D, DEFAULT_PARAM_VALUES)
+from .utils import ElexonAPIException
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# {param: (format, types formatted)}, pd.Timestamp is a datetime
+FORMATTERS: Dict[str, Tuple[str, tuple]] = {
+    **{k: (DATE_FORMAT, (dt.date,)) for k in DATE_PARAMS},
+    **{k: (TIME_FORMAT, (dt.time, dt.datetime)) for k in TIME_PARAMS},
+    **{k: (DATETIME_FORMAT, (dt.datetime,)) for k in DATETIME_PARAMS},
+}
+
+
+def format_params(params: dict) -> dict:
+    """Format date, time and datetime params (in place)."""
+    for k, v in params.items():
+        formatter = FORMATTERS.get(k)
+        if formatter is not None and isinstance(v, formatter[1]):
+            params[k] = v.strftime(formatter[0])
+    return params
+
+
+class ServicePlan:
+    """Compiled request building for one service.
+
+    Use :func:`get_plan` rather than creating plans directly,
+    so that they are built once.
+    """
+    __slots__ = ('service_code', 'required', 'defaults', 'url')
+
+    def __init__(self, service_code: str,
+                 base_url: str = API_BASE_URL,
+                 api_version: str = API_VERSION):
+        if service_code not in REQUIRED_D:
+            raise ElexonAPIException(f"Unknown service_code: {service_code}.")
+        required = REQUIRED_D[service_code]
+        self.service_code = service_code
+        self.required: FrozenSet[str] = frozenset(required)
+        self.defaults: Dict[str, str] = {
+            k: v for k, v in DEFAULT_PARAM_VALUES.items() if k in self.required}
+        self.url = f"{base_url}/{service_code}/{api_version}"
+
+    def build(self, api_key: str, params: dict, check: bool = True) -> dict:
+        """Prepare query parameters, and validate them if ``check``.
+
+        ``params`` is updated in place and returned.
+        """
+        params['APIKey'] = api_key
+        for k, v in self.defaults.items():
+            if params.get(k) is None:
+                params[k] = v
+        format_params(params)
+        if check:
+            self.validate(params)
+        return params
+
+    def validate(self, params: dict) -> None:
+        """Check that all required parameters are passed."""
+        keys = params.keys()
+        if keys == self.required:
+            return
+        for extra_arg in keys - self.required:
+            logger.info(f"Extra argument for {self.service_code}: {extra_arg}")
+        missing = self.required - keys
+        if missing:
+            for missing_arg in missing:
+                logger.warning(f"Missing argument for {self.service_code}: {missing_arg}.")
+            raise ElexonAPIException(f"Missing arguments for {self.service_code}.")
+
+
+@lru_cache(maxsize=None)
+def get_plan(service_code: str,
+             base_url: str = API_BASE_URL,
+             api_version: str = API_VERSION) -> ServicePlan:
+    """Plan of service, built on first use."""
+    return ServicePlan(service_code, base_url, api_version)
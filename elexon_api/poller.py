@@ -0,0 +1,387 @@
+"""
+poller.py
+=========
+
+Polling of near-real-time services (``FREQ``, ``FUELINST``,
+``SYSWARN``, ``LATESTACCEPTS``...), delivering new rows as they are
+published.
+
+A :class:`Poller` polls each service at its publication cadence
+(:data:`~elexon_api.config.POLL_CADENCE_D`, then learnt from the
+publications seen) rather than on a fixed timer: after a publication,
+the next poll is one cadence later, then sooner and sooner if the
+next one is late. The items of each response are fingerprinted
+before being parsed: an unchanged payload is skipped without parsing
+it. Rows not in the previous payload (on the natural keys of the
+service) are delivered to subscribers, callbacks or asyncio queues,
+with the latency from their publication (timestamp of the rows) to
+their delivery.
+"""
+
+from __future__ import annotations
+
+import time
+import asyncio
+import hashlib
+import inspect
+import datetime as dt
+from collections import deque
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+from .config import (HEADER, SERVICE_TO_GROUP, REQUIRED_D, TIMESTAMP_COLUMNS,
+                     POLL_CADENCE_D, DEFAULT_POLL_CADENCE, POLL_MIN_INTERVAL,
+                     POLL_HISTORY, POLL_LOOKBACK)
+from .client import Client
+from .plan import get_plan
+from .response import Response
+from .metrics import get_recorder
+from .backfill import WINDOW_PARAMS, DATETIME_WINDOW_GROUPS
+from .sync import get_natural_keys
+from .utils import ElexonAPIException, get_settlement_period
+from .async_client import fetch_body_async
+
+from ._lazy import lazy_import
+pd = lazy_import('pandas')
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class Update(NamedTuple):
+    """New rows of a service, as delivered to subscribers."""
+    service_code: str
+    df: pd.DataFrame
+    fetched: float
+    published: Optional[pd.Timestamp] = None
+    latency: Optional[float] = None
+
+
+class _ServiceState:
+    """What the poller knows of a service."""
+    __slots__ = ('params', 'fingerprint', 'df', 'mark', 'publications',
+                 'misses', 'polls', 'unchanged', 'updates', 'rows', 'errors',
+                 'latency')
+
+    def __init__(self, params):
+        self.params = params
+        self.fingerprint: Optional[bytes] = None
+        self.df: Optional[pd.DataFrame] = None
+        self.mark: Optional[dt.datetime] = None
+        # times (seconds) of the new payloads seen
+        self.publications = deque(maxlen=POLL_HISTORY)
+        self.misses = 0
+        self.polls = 0
+        self.unchanged = 0
+        self.updates = 0
+        self.rows = 0
+        self.errors = 0
+        self.latency: Optional[float] = None
+
+
+class Poller:
+    """Long-running poller of services, delivering new rows.
+
+    Parameters
+    ----------
+    client : Client
+        Its session is used for the polls. Give it no ``cache``, or a
+        short TTL, so that polls reach the API.
+    services : iterable or dict
+        Service codes, or ``{service_code: params}``. Params can be a
+        dict, or a callable returning the params of each poll. They
+        are optional for services without parameters and those
+        queried by window: datetime windows start at the last
+        timestamp seen (``lookback`` before the first poll), date
+        windows cover the current settlement date.
+    cadence : dict
+        Publication cadence (seconds) of some services, overrides
+        :data:`~elexon_api.config.POLL_CADENCE_D`.
+    min_interval : float
+        Shortest time (seconds) between two polls of a service.
+    lookback : float
+        Seconds covered by the first poll of datetime windowed services.
+
+    Examples
+    --------
+    >>> poller = Poller(client, ['FUELINST', 'FREQ'])
+    >>> poller.subscribe(lambda update: print(update.service_code, len(update.df)))
+    >>> poller.run(duration=3600)
+    """
+
+    def __init__(self,
+                 client: Client,
+                 services: Union[Iterable[str], Dict[str, Union[dict, Callable[[], dict]]]],
+                 cadence: Dict[str, float] = None,
+                 min_interval: float = POLL_MIN_INTERVAL,
+                 lookback: float = POLL_LOOKBACK):
+        if not isinstance(services, dict):
+            services = dict.fromkeys(services)
+        self.client = client
+        self.cadence = {**POLL_CADENCE_D, **(cadence or {})}
+        self.min_interval = min_interval
+        self.lookback = lookback
+        self._states: Dict[str, _ServiceState] = {}
+        for service_code, params in services.items():
+            if params is None and not _has_default_params(service_code):
+                raise ElexonAPIException(
+                    f"Parameters of {service_code} are needed to poll it.")
+            self._states[service_code] = _ServiceState(params)
+        self._subscribers: List[tuple] = []
+        self._stop: Optional[asyncio.Event] = None
+
+    #--------------------------------------------------------
+    #                       SUBSCRIBERS
+    #--------------------------------------------------------
+    def subscribe(self, callback: Callable[[Update], None],
+                  service_codes: Iterable[str] = None) -> Callable[[Update], None]:
+        """Call ``callback`` with each :class:`Update` (of ``service_codes``
+        if passed). Coroutine functions are awaited."""
+        self._subscribers.append(
+            (callback, None if service_codes is None else set(service_codes)))
+        return callback
+
+    def get_queue(self, service_codes: Iterable[str] = None,
+                  maxsize: int = 0) -> asyncio.Queue:
+        """Queue receiving each :class:`Update` (of ``service_codes`` if passed).
+
+        A full queue holds back the polls of its services, until
+        items are taken from it.
+        """
+        queue = asyncio.Queue(maxsize)
+        self.subscribe(queue.put, service_codes)
+        return queue
+
+    async def _deliver(self, update: Update) -> None:
+        for callback, service_codes in self._subscribers:
+            if service_codes is not None and update.service_code not in service_codes:
+                continue
+            try:
+                result = callback(update)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception(f"Subscriber failed on {update.service_code} update.")
+
+    #--------------------------------------------------------
+    #                       SCHEDULE
+    #--------------------------------------------------------
+    def get_cadence(self, service_code: str) -> float:
+        """Publication cadence (seconds): median interval between the
+        payloads seen, once there are a few, else the configured one."""
+        publications = self._states[service_code].publications
+        if len(publications) >= 3:
+            intervals = sorted(b - a for a, b in zip(publications, list(publications)[1:]))
+            return max(self.min_interval, intervals[len(intervals) // 2])
+        return self.cadence.get(service_code, DEFAULT_POLL_CADENCE)
+
+    def get_delay(self, service_code: str) -> float:
+        """Seconds until the next poll of a service.
+
+        One cadence after a new payload, then halving the wait after
+        each unchanged one (``min_interval`` at least).
+        """
+        state = self._states[service_code]
+        cadence = self.get_cadence(service_code)
+        if state.misses == 0:
+            return cadence
+        return max(self.min_interval, cadence / 2 ** state.misses)
+
+    #--------------------------------------------------------
+    #                       POLL
+    #--------------------------------------------------------
+    async def poll(self, service_code: str) -> Optional[Update]:
+        """Poll a service once, deliver and return its update
+        (``None`` if the payload is unchanged)."""
+        state = self._states[service_code]
+        recorder = get_recorder(self.client.metrics, service_code)
+        plan = get_plan(service_code, self.client.base_url, self.client.api_version)
+        params = plan.build(self.client.api_key, self._get_params(service_code))
+        recorder.lap('prepare')
+
+        state.polls += 1
+        r_bytes, _, _ = await fetch_body_async(
+            self.client, service_code, params, HEADER, recorder)
+        fetched = time.time()
+        fingerprint = get_fingerprint(r_bytes)
+        if fingerprint == state.fingerprint:
+            state.unchanged += 1
+            state.misses += 1
+            recorder.count('unchanged')
+            recorder.report()
+            return None
+
+        response = Response.from_bytes(r_bytes, service_code, params)
+        response.validate()
+        df = response.to_df()
+        recorder.lap('parse')
+        new_rows = self._get_new_rows(service_code, df)
+        first = state.fingerprint is None
+        state.fingerprint = fingerprint
+        state.df = df
+        state.misses = 0
+        self._add_publication(service_code, df, fetched)
+        if new_rows.empty:
+            recorder.report()
+            return None
+
+        published = get_published(new_rows)
+        latency = None
+        if published is not None and not first:
+            latency = time.time() - published.timestamp()
+            if self.client.metrics is not None:
+                self.client.metrics.timing(service_code, 'latency', latency)
+            state.latency = latency
+        update = Update(service_code, new_rows, fetched, published, latency)
+        state.updates += 1
+        state.rows += len(new_rows)
+        recorder.count('rows', len(new_rows))
+        await self._deliver(update)
+        recorder.lap('deliver')
+        recorder.report()
+        return update
+
+    def _get_params(self, service_code: str) -> dict:
+        state = self._states[service_code]
+        if callable(state.params):
+            return dict(state.params())
+        if state.params is not None:
+            return dict(state.params)
+        group = SERVICE_TO_GROUP.get(service_code)
+        if group not in WINDOW_PARAMS:
+            return {}
+        from_param, to_param = WINDOW_PARAMS[group]
+        now = dt.datetime.now(dt.timezone.utc)
+        if group in DATETIME_WINDOW_GROUPS:
+            start = state.mark or (now - dt.timedelta(seconds=self.lookback))
+            return {from_param: start.replace(tzinfo=None, microsecond=0),
+                    to_param: now.replace(tzinfo=None, microsecond=0)}
+        today = get_settlement_period(now)[0]
+        return {from_param: today, to_param: today}
+
+    def _get_new_rows(self, service_code: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Rows of ``df`` not in the previous payload."""
+        previous = self._states[service_code].df
+        if previous is None or previous.empty or df.empty:
+            return df
+        keys = get_natural_keys(service_code, df.columns) or list(df.columns)
+        keys = [k for k in keys if k in previous]
+        if not keys:
+            return df
+        is_known = (pd.MultiIndex.from_frame(df[keys].astype(object))
+                    .isin(pd.MultiIndex.from_frame(previous[keys].astype(object))))
+        return df[~is_known].reset_index(drop=True)
+
+    def _add_publication(self, service_code: str, df: pd.DataFrame,
+                         fetched: float) -> None:
+        """Keep the time of a new payload: the latest timestamp of its
+        rows if any (then also the start of the next datetime window),
+        else the time it was fetched."""
+        state = self._states[service_code]
+        published = get_published(df)
+        if published is None:
+            state.publications.append(fetched)
+            return
+        state.mark = published.tz_localize(None).to_pydatetime()
+        if not state.publications or published.timestamp() > state.publications[-1]:
+            state.publications.append(published.timestamp())
+
+    #--------------------------------------------------------
+    #                       RUN
+    #--------------------------------------------------------
+    async def run_async(self, duration: float = None) -> None:
+        """Poll all services until :meth:`stop` (or for ``duration`` seconds)."""
+        self._stop = asyncio.Event()
+        tasks = [asyncio.create_task(self._run_service(service_code))
+                 for service_code in self._states]
+        try:
+            await asyncio.wait_for(self._stop.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self, duration: float = None) -> None:
+        """Poll all services, running its own event loop.
+
+        Sync wrapper of :meth:`run_async`, it cannot be called from a
+        running loop, and asyncio queues of :meth:`get_queue` can't be
+        used with it (use callbacks).
+        """
+        async def _run():
+            try:
+                await self.run_async(duration)
+            finally:
+                await self.client.close_async_session()
+        asyncio.run(_run())
+
+    def stop(self) -> None:
+        """Stop :meth:`run_async` (from a callback or another task)."""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def _run_service(self, service_code: str) -> None:
+        state = self._states[service_code]
+        while not self._stop.is_set():
+            try:
+                await self.poll(service_code)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.errors += 1
+                state.misses += 1
+                logger.warning(f"Poll of {service_code} failed: {e!r}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.get_delay(service_code))
+            except asyncio.TimeoutError:
+                pass
+
+    @property
+    def stats(self) -> pd.DataFrame:
+        """Polls, unchanged payloads, updates, rows, errors, cadence
+        (seconds) and last latency (seconds) of each service."""
+        return pd.DataFrame.from_dict({
+            service_code: {'polls': s.polls, 'unchanged': s.unchanged,
+                           'updates': s.updates, 'rows': s.rows, 'errors': s.errors,
+                           'cadence': self.get_cadence(service_code),
+                           'latency': s.latency}
+            for service_code, s in self._states.items()}, orient='index')
+
+
+def get_fingerprint(body: bytes) -> bytes:
+    """Hash of the items of a response body.
+
+    The metadata (which echoes the query string) is left out, so that
+    polls with different windows returning the same items match.
+    """
+    start = body.find(b'<responseBody')
+    view = memoryview(body)[start:] if start >= 0 else body
+    return hashlib.blake2b(view, digest_size=16).digest()
+
+
+def get_published(df: pd.DataFrame) -> Optional[pd.Timestamp]:
+    """Latest timestamp of rows (first of
+    :data:`~elexon_api.config.TIMESTAMP_COLUMNS` found, naive
+    timestamps being UTC), ``None`` if none."""
+    column = next((c for c in TIMESTAMP_COLUMNS if c in df), None)
+    if column is None or df.empty or not pd.api.types.is_datetime64_any_dtype(df[column]):
+        return None
+    published = df[column].max()
+    if pd.isna(published):
+        return None
+    if published.tzinfo is None:
+        return published.tz_localize('UTC')
+    return published.tz_convert('UTC')
+
+
+def _has_default_params(service_code: str) -> bool:
+    """Whether the poller can build the params of a service."""
+    if service_code not in REQUIRED_D:
+        raise ElexonAPIException(f"Unknown service_code: {service_code}.")
+    group = SERVICE_TO_GROUP.get(service_code)
+    if group in WINDOW_PARAMS and group != 5:
+        return True
+    return set(REQUIRED_D[service_code]) <= {'APIKey'}
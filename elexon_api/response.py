@@ -0,0 +1,165 @@
+"""
+response.py
+===========
+
+Compact result of a query.
+
+A :class:`Response` keeps the raw body of a response and its
+metadata (description, query string, data item), read without
+parsing the items. DataFrames are parsed from the body on first
+access and memoized. Much lighter than the :mod:`xmltodict`
+dictionary returned by :func:`~elexon_api.client.query`, so
+that many responses can be kept, e.g. to audit a batch job or
+re-extract its data.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Optional
+
+from .config import RESPONSE_D, NO_CONTENT_DESCRIPTION
+from .utils import BadDescriptionError, ElexonAPIException, NoContentError
+from .parser import (parse_metadata, parse_response, columns_to_df,
+                     parse_frames_by_record_type)
+
+from ._lazy import lazy_import
+xmltodict = lazy_import('xmltodict')
+pd = lazy_import('pandas')
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class Response:
+    """Response of a query: metadata, raw body and memoized DataFrames.
+
+    Parameters
+    ----------
+    body : bytes
+        Raw (decompressed) response body.
+    service_code : str
+    params : dict
+        Query parameters, the API key is not kept.
+    http_code, error_type, description, query_string, data_item : str
+        Metadata of the response, see :meth:`from_bytes`.
+    """
+    __slots__ = ('body', 'service_code', 'params', 'http_code', 'error_type',
+                 'description', 'query_string', 'data_item', '_df', '_frames')
+
+    def __init__(self,
+                 body: bytes,
+                 service_code: str = None,
+                 params: dict = None,
+                 http_code: str = None,
+                 error_type: str = None,
+                 description: str = None,
+                 query_string: str = None,
+                 data_item: str = None):
+        self.body = body
+        self.service_code = service_code
+        self.params = {k: v for k, v in (params or {}).items() if k != 'APIKey'}
+        self.http_code = http_code
+        self.error_type = error_type
+        self.description = description
+        self.query_string = query_string
+        self.data_item = data_item
+        self._df = None
+        self._frames = None
+
+    @classmethod
+    def from_bytes(cls, body: bytes, service_code: str = None,
+                   params: dict = None) -> Response:
+        """Read metadata of a response body (see :func:`~elexon_api.parser.parse_metadata`)."""
+        r_dict = parse_metadata(body)
+        r_metadata = r_dict.get('responseMetadata') or {}
+        r_body = r_dict.get('responseBody') or {}
+        return cls(body, service_code, params,
+                   http_code=r_metadata.get('httpCode'),
+                   error_type=r_metadata.get('errorType'),
+                   description=r_metadata.get('description'),
+                   query_string=r_metadata.get('queryString'),
+                   data_item=r_body.get('dataItem'))
+
+    @property
+    def metadata(self) -> dict:
+        """Metadata, shaped like ``responseMetadata`` of the response."""
+        return {'httpCode': self.http_code, 'errorType': self.error_type,
+                'description': self.description, 'queryString': self.query_string}
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the raw body."""
+        return len(self.body)
+
+    def validate(self) -> None:
+        """Check response validity, see :func:`validate_metadata`."""
+        validate_metadata(self.service_code, self.description,
+                          self.query_string, self.data_item)
+
+    def to_df(self) -> pd.DataFrame:
+        """Items as a DataFrame, with the dtypes of the service.
+
+        Parsed on first call, the same DataFrame is returned afterwards
+        (don't mutate it, or :meth:`clear` first).
+        """
+        if self._df is None:
+            _, columns = parse_response(self.body)
+            self._df = columns_to_df(columns, self.service_code)
+        return self._df
+
+    def to_frames_by_record_type(self) -> Dict[str, pd.DataFrame]:
+        """One DataFrame per record type, memoized like :meth:`to_df`."""
+        if self._frames is None:
+            # parsed again, keeping the fields of each record type
+            _, self._frames = parse_frames_by_record_type(self.body, self.service_code)
+        return self._frames
+
+    def to_dict(self) -> dict:
+        """Response parsed by :mod:`xmltodict`, as returned by
+        :func:`~elexon_api.client.query` (not memoized)."""
+        return xmltodict.parse(self.body)['response']
+
+    def clear(self) -> None:
+        """Drop the memoized DataFrames, keeping the body."""
+        self._df = None
+        self._frames = None
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}(service_code={self.service_code!r}, "
+                f"description={self.description!r}, nbytes={self.nbytes})")
+
+
+def validate_metadata(service_code: str,
+                      description: Optional[str],
+                      query_string: Optional[str],
+                      data_item: Optional[str]) -> None:
+    """Check response validity from its metadata (for applicable signals).
+
+    Parameters
+    ----------
+    service_code : str
+    description : str
+        ``responseMetadata/description``, must be ``'Success'``.
+        Raises :class:`~elexon_api.utils.NoContentError` if ``'No Content'``,
+        :class:`~elexon_api.utils.BadDescriptionError` otherwise.
+    query_string : str
+        ``responseMetadata/queryString``, for the error message.
+    data_item : str
+        ``responseBody/dataItem``, must match ``service_code``
+        if the service returns it.
+    """
+    if description == NO_CONTENT_DESCRIPTION:
+        raise NoContentError(f"No content. Query string: {query_string}")
+    if description != 'Success':
+        logger.warning(f"Bad Query. Description : {description}")
+        msg = (f"Bad query description: {description}. "
+               f"Query string: {query_string}")
+        raise BadDescriptionError(msg, description)
+
+    if RESPONSE_D[service_code]:
+        if data_item != service_code:
+            raise ElexonAPIException(
+                "Service codes don't match \n" +
+                f"Requested code is {service_code}" +
+                f"Returned code is {data_item}")
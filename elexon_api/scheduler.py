@@ -0,0 +1,352 @@
+"""
+scheduler.py
+============
+
+Rate limiting and retries for API requests.
+
+A :class:`Scheduler` sits behind both the sync and the async
+clients: it caps the number of requests in flight, spaces
+them with a token bucket, and retries throttled (429),
+failed (5xx) or timed out requests with exponential backoff
+and jitter, honouring ``Retry-After``. Retries happen per
+request, so one failure does not abort a batch of queries.
+
+Bodies are decompressed as they are read (``Content-Encoding``
+negotiated by the client sessions), and ``304 Not Modified``
+responses to conditional requests are returned, not raised.
+"""
+
+import time
+import random
+import asyncio
+import threading
+import email.utils
+import datetime as dt
+from typing import NamedTuple, Optional
+
+import requests
+
+from .config import (REQUEST_TIMEOUT, MAX_RETRIES, BACKOFF_FACTOR,
+                     MAX_BACKOFF, RETRY_STATUSES)
+from .metrics import Recorder, NULL_RECORDER
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class TokenBucket:
+    """Token bucket, shared by threads and coroutines.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    capacity : float
+        Maximum number of tokens, i.e. the allowed burst.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token, return how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(0., -self._tokens / self.rate)
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+NOT_MODIFIED = 304
+
+
+class FetchResult(NamedTuple):
+    """Body (decompressed), status and validators of a response."""
+    body: bytes
+    status: int = 200
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == NOT_MODIFIED
+
+
+class RetryableError(Exception):
+    """Response with a retryable status.
+
+    Only raised internally while retries are left, the last
+    attempt raises the usual HTTP error.
+    """
+
+    def __init__(self, status: int, url: str, retry_after: Optional[float]):
+        super().__init__(f"{status} response for url: {url}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a ``Retry-After`` header (delay or date)."""
+    if not value:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = dt.datetime.now(date.tzinfo)
+    return max(0., (date - now).total_seconds())
+
+
+class Scheduler:
+    """Schedule requests with rate limit, concurrency cap and retries.
+
+    Parameters
+    ----------
+    rate : float
+        Maximum requests per second, unlimited if ``None``.
+    burst : int
+        Requests allowed at once before ``rate`` applies.
+    max_in_flight : int
+        Maximum concurrent requests, unlimited if ``None``.
+    max_retries : int
+        Retries after the first attempt.
+    backoff_factor : float
+        Base delay (seconds), doubled at each retry. The actual
+        delay is drawn uniformly below it ("full jitter").
+    max_backoff : float
+        Cap on the backoff delay, including delays from ``Retry-After``.
+    timeout : float
+        Timeout of each request (seconds).
+    retry_statuses : set
+        HTTP statuses which are retried.
+
+    Attributes
+    ----------
+    retries : int
+        Number of retries so far.
+    """
+
+    def __init__(self,
+                 rate: float = None,
+                 burst: int = 1,
+                 max_in_flight: int = None,
+                 max_retries: int = MAX_RETRIES,
+                 backoff_factor: float = BACKOFF_FACTOR,
+                 max_backoff: float = MAX_BACKOFF,
+                 timeout: float = REQUEST_TIMEOUT,
+                 retry_statuses: set = RETRY_STATUSES):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.retry_statuses = set(retry_statuses)
+        self.retries = 0
+        self._retries_lock = threading.Lock()
+        self._bucket = None if rate is None else TokenBucket(rate, burst)
+        self._semaphore = (None if max_in_flight is None
+                           else threading.BoundedSemaphore(max_in_flight))
+        self._async_semaphore = None
+        self._async_loop = None
+
+    def get_delay(self, attempt: int, retry_after: float = None) -> float:
+        """Delay before retry number ``attempt`` (starting from 0).
+
+        ``retry_after`` (from the server) is followed, up to ``max_backoff``.
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        cap = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    def _should_retry(self, attempt: int, error: Exception, recorder) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        with self._retries_lock:
+            self.retries += 1
+        recorder.count('retries')
+        logger.info(f"Retrying after error ({attempt + 1}/{self.max_retries}): {error}")
+        return True
+
+    #--------------------------------------------------------
+    #                       SYNC
+    #--------------------------------------------------------
+    def fetch(self, session: requests.Session, url: str,
+              params: dict, headers: dict,
+              recorder: Recorder = NULL_RECORDER) -> bytes:
+        """GET ``url`` and return the response body.
+
+        Stages and retries are recorded by ``recorder``
+        (see :mod:`~elexon_api.metrics`).
+        """
+        return self.fetch_response(session, url, params, headers, recorder).body
+
+    def fetch_response(self, session: requests.Session, url: str,
+                       params: dict, headers: dict,
+                       recorder: Recorder = NULL_RECORDER) -> FetchResult:
+        """GET ``url`` and return the response body, status and validators.
+
+        Same as :meth:`fetch`, for conditional requests: pass
+        ``If-None-Match``/``If-Modified-Since`` in ``headers``, the
+        result is then empty and ``not_modified`` if the API
+        answers 304.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._fetch_once(session, url, params, headers, recorder,
+                                        retry=attempt < self.max_retries)
+            except RetryableError as e:
+                error, retry_after = e, e.retry_after
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, retry_after = e, None
+            if not self._should_retry(attempt, error, recorder):
+                raise error
+            time.sleep(self.get_delay(attempt, retry_after))
+            recorder.lap('backoff')
+            attempt += 1
+
+    def _fetch_once(self, session, url, params, headers, recorder,
+                    retry: bool) -> FetchResult:
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            if self._bucket is not None:
+                self._bucket.acquire()
+            recorder.lap('wait')
+            # stream, to time headers and body separately
+            response = session.get(url, params=params, headers=headers,
+                                   timeout=self.timeout, stream=True)
+            recorder.lap('ttfb')
+            r_bytes = response.content
+            recorder.lap('download')
+            if retry and response.status_code in self.retry_statuses:
+                raise RetryableError(
+                    response.status_code, response.url,
+                    parse_retry_after(response.headers.get('Retry-After')))
+            response.raise_for_status()
+            # bytes read off the socket, before decompression
+            wire_bytes = response.raw.tell()
+            return self._get_result(r_bytes, wire_bytes, response.status_code,
+                                    response.headers, recorder)
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    @staticmethod
+    def _get_result(r_bytes: bytes, wire_bytes: int, status: int,
+                    headers, recorder) -> FetchResult:
+        recorder.count('bytes', len(r_bytes))
+        recorder.count('wire_bytes', wire_bytes)
+        if status == NOT_MODIFIED:
+            recorder.count('not_modified')
+        return FetchResult(r_bytes, status, headers.get('ETag'),
+                           headers.get('Last-Modified'))
+
+    #--------------------------------------------------------
+    #                       ASYNC
+    #--------------------------------------------------------
+    def _get_async_semaphore(self) -> Optional[asyncio.Semaphore]:
+        """Semaphore bound to the running loop."""
+        if self.max_in_flight is None:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._async_loop = loop
+        return self._async_semaphore
+
+    async def fetch_async(self, session: 'aiohttp.ClientSession', url: str,
+                          params: dict, headers: dict,
+                          recorder: Recorder = NULL_RECORDER) -> bytes:
+        """GET ``url`` and return the response body.
+
+        Stages and retries are recorded by ``recorder``
+        (see :mod:`~elexon_api.metrics`).
+        """
+        result = await self.fetch_response_async(
+            session, url, params, headers, recorder)
+        return result.body
+
+    async def fetch_response_async(self, session: 'aiohttp.ClientSession',
+                                   url: str, params: dict, headers: dict,
+                                   recorder: Recorder = NULL_RECORDER) -> FetchResult:
+        """GET ``url`` and return the response body, status and validators.
+
+        Async version of :meth:`fetch_response`.
+        """
+        import aiohttp
+
+        attempt = 0
+        while True:
+            try:
+                return await self._fetch_once_async(
+                    session, url, params, headers, recorder,
+                    retry=attempt < self.max_retries)
+            except RetryableError as e:
+                error, retry_after = e, e.retry_after
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error, retry_after = e, None
+            if not self._should_retry(attempt, error, recorder):
+                raise error
+            await asyncio.sleep(self.get_delay(attempt, retry_after))
+            recorder.lap('backoff')
+            attempt += 1
+
+    async def _fetch_once_async(self, session, url, params, headers, recorder,
+                                retry: bool) -> FetchResult:
+        import aiohttp
+
+        semaphore = self._get_async_semaphore()
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            if self._bucket is not None:
+                await self._bucket.acquire_async()
+            recorder.lap('wait')
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            # DNS and connection are lapped by the session trace config, if any
+            async with session.get(url, params=params, headers=headers,
+                                   timeout=timeout,
+                                   trace_request_ctx=recorder) as response:
+                recorder.lap('ttfb')
+                if retry and response.status in self.retry_statuses:
+                    raise RetryableError(
+                        response.status, str(response.url),
+                        parse_retry_after(response.headers.get('Retry-After')))
+                response.raise_for_status()
+                r_bytes = await response.read()
+                recorder.lap('download')
+                return self._get_result(r_bytes, get_wire_bytes(response),
+                                        response.status, response.headers, recorder)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+
+def get_wire_bytes(response: 'aiohttp.ClientResponse') -> int:
+    """Bytes of the body of a read response, before decompression."""
+    content = response.content
+    # total_raw_bytes is only counted by recent aiohttp versions
+    return getattr(content, 'total_raw_bytes', content.total_bytes)
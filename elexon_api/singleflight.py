@@ -0,0 +1,92 @@
+"""
+singleflight.py
+===============
+
+Coalescing of concurrent identical queries.
+
+While a query is in flight, identical queries (same service code
+and parameters) wait for it and share its result instead of
+calling the API again. Works across threads (sync queries) and
+within each event loop (async queries).
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, sharing its outcome.
+
+    The result object is shared by all callers: treat it as read-only.
+
+    Attributes
+    ----------
+    coalesced : int
+        Number of calls which waited for another one instead of running.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Call ``fn``, or wait for the call in flight with the same key."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            logger.debug(f"Coalesced call: {key}")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key: Hashable,
+                       fn: Callable[[], Awaitable]) -> Any:
+        """Await ``fn()``, or the call in flight with the same key."""
+        # asyncio futures belong to a loop
+        key = (asyncio.get_running_loop(), key)
+        future = self._async_calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            logger.debug(f"Coalesced call: {key[1]}")
+            # shield, so that a cancelled waiter does not cancel the leader
+            return await asyncio.shield(future)
+
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark as retrieved, in case nobody else is waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._async_calls[key]
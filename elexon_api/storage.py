@@ -0,0 +1,153 @@
+"""
+storage.py
+==========
+
+Local Parquet datasets of query results.
+
+Frames are stored with the dtypes of their service (see
+:func:`~elexon_api.utils.apply_dtypes`), partitioned by service
+code (and record type, if any) and by settlement date::
+
+    root/service_code=FUELHH/date=2019-06-15/part-<uuid>.parquet
+
+Reads push the date range and column selection down to the
+files, which are memory-mapped, so only the needed partitions
+and columns are loaded. Requires :mod:`pyarrow`.
+"""
+
+import uuid
+import datetime as dt
+from pathlib import Path
+from typing import Dict, List, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+
+from .config import SETTLEMENT_DATE_COLUMNS, TIMESTAMP_COLUMNS
+from .utils import ElexonAPIException, apply_dtypes
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+PARTITION_COLUMN = 'date'
+MISSING_DATE = 'unknown'
+
+_PARTITIONING = ds.partitioning(
+    pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive')
+
+
+class ParquetStore:
+    """Parquet datasets, one per service.
+
+    Parameters
+    ----------
+    root : str or Path
+        Directory of the datasets.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+
+    def get_path(self, service_code: str, record_type: str = None) -> Path:
+        path = self.root / f"service_code={service_code}"
+        if record_type is not None:
+            path = path / f"record_type={record_type}"
+        return path
+
+    def write(self, df: pd.DataFrame, service_code: str,
+              record_type: str = None, replace: bool = False) -> None:
+        """Append frame to the dataset of service.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            As returned by :func:`~elexon_api.utils.extract_df`.
+        service_code : str
+        record_type : str
+            If passed, store in a separate dataset for this record type.
+        replace : bool
+            If true, replace the dates already stored instead of appending.
+        """
+        if df.empty:
+            return
+        df = apply_dtypes(df, service_code)
+        df[PARTITION_COLUMN] = _get_partition_dates(df, service_code)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(
+            table, self.get_path(service_code, record_type),
+            format='parquet',
+            partitioning=_PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior='delete_matching' if replace
+                                   else 'overwrite_or_ignore')
+
+    def write_frames(self, frames: Dict[str, pd.DataFrame], service_code: str,
+                     replace: bool = False) -> None:
+        """Write output of :func:`~elexon_api.utils.extract_df_by_record_type`."""
+        for record_type, df in frames.items():
+            self.write(df, service_code, record_type, replace=replace)
+
+    def read(self, service_code: str,
+             start: Union[str, dt.date] = None,
+             end: Union[str, dt.date] = None,
+             columns: List[str] = None,
+             record_type: str = None) -> pd.DataFrame:
+        """Read dataset of service.
+
+        Parameters
+        ----------
+        service_code : str
+        start, end
+            Settlement date range (both included). Only matching
+            partitions are read.
+        columns : list
+            Columns to read, all if ``None``.
+        record_type : str
+            Record type, for datasets written by :meth:`write_frames`.
+        """
+        path = self.get_path(service_code, record_type)
+        if not path.is_dir():
+            raise ElexonAPIException(f"No data stored for {service_code}.")
+        dataset = ds.dataset(str(path), format='parquet',
+                             partitioning=_PARTITIONING,
+                             filesystem=self._filesystem)
+        table = dataset.to_table(columns=columns,
+                                 filter=_date_filter(start, end))
+        df = table.to_pandas()
+        if columns is None or PARTITION_COLUMN not in columns:
+            df = df.drop(columns=PARTITION_COLUMN, errors='ignore')
+        return df
+
+    def get_dates(self, service_code: str, record_type: str = None) -> List[str]:
+        """Settlement dates stored for service."""
+        path = self.get_path(service_code, record_type)
+        prefix = f"{PARTITION_COLUMN}="
+        return sorted(p.name[len(prefix):] for p in path.glob(f"{prefix}*"))
+
+
+def _get_partition_dates(df: pd.DataFrame, service_code: str) -> pd.Series:
+    """Settlement date of each row, as ``YYYY-MM-DD`` strings."""
+    column = next((c for c in SETTLEMENT_DATE_COLUMNS + TIMESTAMP_COLUMNS
+                   if c in df), None)
+    if column is None:
+        raise ElexonAPIException(
+            f"No date column found to partition {service_code} data.")
+    return df[column].dt.strftime('%Y-%m-%d').fillna(MISSING_DATE)
+
+
+def _date_filter(start, end):
+    """Filter on the date partitions, ``None`` if unbounded."""
+    expr = None
+    if start is not None:
+        expr = ds.field(PARTITION_COLUMN) >= pd.Timestamp(start).strftime('%Y-%m-%d')
+    if end is not None:
+        upper = ds.field(PARTITION_COLUMN) <= pd.Timestamp(end).strftime('%Y-%m-%d')
+        expr = upper if expr is None else expr & upper
+    if expr is not None:
+        # rows without a date are never in a bounded range
+        expr = expr & (ds.field(PARTITION_COLUMN) != MISSING_DATE)
+    return expr
@@ -0,0 +1,287 @@
+"""
+sync.py
+=======
+
+Incremental sync of services into a local dataset.
+
+For each service, the latest settlement period (or timestamp, or
+date) seen is stored as a high-water mark. A sync only asks for
+what comes after it:
+
+* services queried by settlement date and period (groups 1 and 8)
+  request the missing periods of the current day one by one, and
+  whole days (``'*'``) only for past days;
+* services queried by datetime window (group 9) request the window
+  from the high-water mark to now;
+* services queried by date window (groups 6, 12, 15) request the
+  days from the high-water mark to today.
+
+Periods of the current day are only requested once published, and
+queries without data ("No Content") count as no rows. New rows are
+merged into the dataset, a :class:`~elexon_api.storage.ParquetStore`
+partitioned by date, dropping duplicates on the natural keys of the
+service (see :data:`~elexon_api.config.NATURAL_KEY_COLUMNS`): only
+the partitions of the dates fetched are rewritten.
+"""
+
+import os
+import json
+import datetime as dt
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import pandas as pd
+
+from .config import (SERVICE_TO_GROUP, NATURAL_KEY_COLUMNS, NATURAL_KEYS_D,
+                     SETTLEMENT_DATE_COLUMNS, TIMESTAMP_COLUMNS)
+from .client import Client, query_df
+from .backfill import WINDOW_PARAMS
+from .utils import (ElexonAPIException, NoContentError, apply_dtypes,
+                    get_settlement_period, get_periods_per_day)
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+STATE_FILENAME = 'sync_state.json'
+
+# name of the period parameter of services synced by period
+PERIOD_PARAMS = {1: 'Period', 8: 'SettlementPeriod'}
+DATE_WINDOW_GROUPS = {6, 12, 15}
+DATETIME_WINDOW_GROUPS = {9}
+
+
+def get_natural_keys(service_code: str, columns) -> List[str]:
+    """Columns identifying a row of service, among ``columns``."""
+    keys = NATURAL_KEYS_D.get(service_code, NATURAL_KEY_COLUMNS)
+    return [k for k in keys if k in columns]
+
+
+class SyncState:
+    """High-water marks of each service, stored in a JSON file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.is_file():
+            with open(self.path, 'r') as f:
+                self._marks = json.load(f)
+        else:
+            self._marks = {}
+
+    def get(self, service_code: str) -> Optional[dict]:
+        return self._marks.get(service_code)
+
+    def set(self, service_code: str, mark: dict) -> None:
+        self._marks[service_code] = mark
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._marks, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class IncrementalSync:
+    """Keep a local copy of services, fetching only new data.
+
+    Parameters
+    ----------
+    client : Client
+    path : str or Path
+        Directory of the state file and datasets (a
+        :class:`~elexon_api.storage.ParquetStore`, partitioned by date).
+        Requires :mod:`pyarrow`.
+    start : date
+        Where to start from, for services never synced. Defaults to today.
+    """
+
+    def __init__(self, client: Client, path, start: dt.date = None):
+        from .storage import ParquetStore
+
+        self.client = client
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.state = SyncState(self.path / STATE_FILENAME)
+        self.store = ParquetStore(self.path)
+        self.start = start
+
+    def get_dataset_path(self, service_code: str) -> Path:
+        return self.store.get_path(service_code)
+
+    def load(self, service_code: str, start=None, end=None) -> pd.DataFrame:
+        """Local dataset of service (between ``start`` and ``end`` dates,
+        if passed), empty if never synced."""
+        if not self.get_dataset_path(service_code).is_dir():
+            return pd.DataFrame()
+        return apply_dtypes(self.store.read(service_code, start, end), service_code)
+
+    def sync(self, service_code: str, now: dt.datetime = None,
+             **params) -> pd.DataFrame:
+        """Fetch data after the high-water mark and merge it into the dataset.
+
+        Fetched data is merged (and the mark moved) request by request,
+        so that a failure keeps what was fetched before it.
+
+        Parameters
+        ----------
+        service_code : str
+        now : datetime
+            Current time (UTC), defaults to now.
+        **params
+            Additional parameters, passed to every query.
+
+        Returns
+        -------
+        pd.DataFrame
+            Rows which were not in the dataset yet.
+        """
+        now = now or dt.datetime.now(dt.timezone.utc)
+        group = SERVICE_TO_GROUP.get(service_code)
+        mark = self.state.get(service_code)
+
+        if group in PERIOD_PARAMS:
+            fetch = self._fetch_periods
+        elif group in DATETIME_WINDOW_GROUPS:
+            fetch = self._fetch_datetime_window
+        elif group in DATE_WINDOW_GROUPS:
+            fetch = self._fetch_date_window
+        else:
+            raise ElexonAPIException(
+                f"Incremental sync is not supported for {service_code}.")
+
+        new_rows = []
+        for fetched in fetch(service_code, group, mark, now, params):
+            rows = self._merge(service_code, fetched)
+            if len(rows):
+                mark = self._get_mark(service_code, group, rows, mark)
+                self.state.set(service_code, mark)
+                new_rows.append(rows)
+        new_rows = _concat(new_rows)
+        logger.info(f"Synced {service_code}: {len(new_rows)} new rows.")
+        return new_rows
+
+    #--------------------------------------------------------
+    #                       FETCH
+    #--------------------------------------------------------
+    def _get_start_date(self, mark: Optional[dict], now: dt.datetime) -> dt.date:
+        if mark is not None:
+            return dt.date.fromisoformat(mark['date'])
+        return self.start or get_settlement_period(now)[0]
+
+    def _fetch_periods(self, service_code, group, mark, now, params) -> Iterator[pd.DataFrame]:
+        """Past days whole, then the published periods of today one by one."""
+        period_param = PERIOD_PARAMS[group]
+        date_param = 'SettlementDate'
+        today, current_period = get_settlement_period(now)
+        date = self._get_start_date(mark, now)
+        last_period = mark['period'] if mark is not None else 0
+        if last_period >= get_periods_per_day([date])[0]:
+            # day complete, start from the next one
+            date += dt.timedelta(days=1)
+            last_period = 0
+
+        while date <= today:
+            if date < today:
+                df = self._query_df(service_code,
+                                    **{**params, date_param: date, period_param: '*'})
+                if len(df) and last_period:
+                    df = df[df['settlementPeriod'] > last_period]
+                yield df
+            else:
+                # the current period is not published yet
+                dfs = [self._query_df(service_code,
+                                      **{**params, date_param: date, period_param: period})
+                       for period in range(last_period + 1, current_period)]
+                yield _concat(dfs)
+            date += dt.timedelta(days=1)
+            last_period = 0
+
+    def _fetch_datetime_window(self, service_code, group, mark, now, params) -> Iterator[pd.DataFrame]:
+        from_param, to_param = WINDOW_PARAMS[group]
+        if mark is not None:
+            start = dt.datetime.fromisoformat(mark['timestamp'])
+        else:
+            start = dt.datetime.combine(self._get_start_date(None, now), dt.time())
+        end = now.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        yield self._query_df(service_code, **{**params, from_param: start, to_param: end})
+
+    def _fetch_date_window(self, service_code, group, mark, now, params) -> Iterator[pd.DataFrame]:
+        from_param, to_param = WINDOW_PARAMS[group]
+        start = self._get_start_date(mark, now)
+        today = get_settlement_period(now)[0]
+        yield self._query_df(service_code, **{**params, from_param: start, to_param: today})
+
+    def _query_df(self, service_code: str, **params) -> pd.DataFrame:
+        """Query, with no rows if nothing is published for the parameters."""
+        try:
+            return query_df(self.client, service_code, **params)
+        except NoContentError:
+            return pd.DataFrame()
+
+    #--------------------------------------------------------
+    #                       MERGE
+    #--------------------------------------------------------
+    def _merge(self, service_code: str, fetched: pd.DataFrame) -> pd.DataFrame:
+        """Merge fetched rows into dataset, return the new ones.
+
+        Only the date partitions of the fetched rows are read and
+        rewritten, so the cost does not grow with the history.
+        """
+        if fetched.empty:
+            return fetched
+        fetched = apply_dtypes(fetched, service_code)
+        keys = get_natural_keys(service_code, fetched.columns)
+        if not keys:
+            raise ElexonAPIException(f"No natural keys found for {service_code}.")
+
+        dates = fetched[_find_column(service_code, fetched,
+                                     SETTLEMENT_DATE_COLUMNS + TIMESTAMP_COLUMNS)]
+        known = self.load(service_code, start=dates.min(), end=dates.max())
+        if known.empty:
+            new_rows = fetched.drop_duplicates(keys, keep='last')
+            merged = new_rows
+        else:
+            is_known = (pd.MultiIndex.from_frame(fetched[keys].astype(object))
+                        .isin(pd.MultiIndex.from_frame(known[keys].astype(object))))
+            new_rows = fetched[~is_known].drop_duplicates(keys, keep='last')
+            merged = (pd.concat([known, fetched], ignore_index=True)
+                      .drop_duplicates(keys, keep='last'))
+            # categories differ between frames, restore dtypes after concat
+            merged = apply_dtypes(merged, service_code)
+
+        # only dates with new or revised rows are rewritten
+        self.store.write(merged.reset_index(drop=True), service_code, replace=True)
+        return new_rows.reset_index(drop=True)
+
+    def _get_mark(self, service_code, group, new_rows, mark) -> dict:
+        """High-water mark after new rows."""
+        if group in DATETIME_WINDOW_GROUPS:
+            column = _find_column(service_code, new_rows, TIMESTAMP_COLUMNS)
+            latest = new_rows[column].max()
+            if mark is not None:
+                latest = max(latest, pd.Timestamp(mark['timestamp']))
+            return {'timestamp': latest.isoformat()}
+
+        dates = new_rows[_find_column(service_code, new_rows, SETTLEMENT_DATE_COLUMNS)]
+        last_date = dates.max()
+        new_mark = {'date': last_date.date().isoformat()}
+        if group in PERIOD_PARAMS:
+            periods = new_rows.loc[dates == last_date, 'settlementPeriod']
+            new_mark['period'] = int(periods.max())
+        if mark is not None and (mark['date'], mark.get('period', 0)) > \
+                (new_mark['date'], new_mark.get('period', 0)):
+            return mark
+        return new_mark
+
+
+def _find_column(service_code: str, df: pd.DataFrame, candidates: List[str]) -> str:
+    column = next((c for c in candidates if c in df), None)
+    if column is None:
+        raise ElexonAPIException(
+            f"None of {candidates} found in {service_code} data.")
+    return column
+
+
+def _concat(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return pd.DataFrame()
+    return pd.concat(dfs, ignore_index=True)
@@ -1,10 +1,21 @@
+from __future__ import annotations
+
 import os
+import datetime as dt
 from pathlib import Path
-import pandas as pd
+from zoneinfo import ZoneInfo
 from collections import defaultdict
-from typing import Dict, List
+from typing import Dict, List, Tuple
+
+from .config import (REQUIRED_D, API_KEY_FILENAME,
+                     COLUMN_DTYPES, SERVICE_DTYPES_D,
+                     TIMEZONE, SETTLEMENT_PERIOD_MINUTES,
+                     SETTLEMENT_DATE_COLUMNS)
+from .metrics import get_recorder
 
-from .config import REQUIRED_D, API_KEY_FILENAME
+from ._lazy import lazy_import
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 import logging
 logger = logging.getLogger(__name__)
@@ -31,14 +42,163 @@ class ElexonAPIException(Exception):
     pass
 
 
-def extract_df(r_dict: dict) -> pd.DataFrame:
+class NoContentError(ElexonAPIException):
+    """Query without data: nothing published (yet) for its parameters."""
+
+
+class BadDescriptionError(ElexonAPIException):
+    """Query answered with an error ``responseMetadata/description``."""
+
+    def __init__(self, msg: str, description: str = None):
+        super().__init__(msg)
+        self.description = description
+
+
+def get_settlement_period(timestamp: dt.datetime = None) -> Tuple[dt.date, int]:
+    """Settlement date and period of a datetime, defaults to now.
+
+    Naive datetimes are assumed to be UTC. Periods are counted
+    from local midnight, so there are 46 or 50 of them on
+    clock-change days.
+    """
+    tz = ZoneInfo(TIMEZONE)
+    if timestamp is None:
+        timestamp = dt.datetime.now(dt.timezone.utc)
+    elif timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=dt.timezone.utc)
+    date = timestamp.astimezone(tz).date()
+    midnight = dt.datetime.combine(date, dt.time(), tzinfo=tz)
+    elapsed = timestamp - midnight.astimezone(dt.timezone.utc)
+    period = int(elapsed / dt.timedelta(minutes=SETTLEMENT_PERIOD_MINUTES)) + 1
+    return date, period
+
+
+def get_period_start_utc(dates, periods) -> pd.DatetimeIndex:
+    """UTC start of settlement periods, vectorized.
+
+    Local midnight is converted to UTC once per unique date, then
+    periods are added as offsets, so clock-change days (46 or 50
+    periods) are handled without converting every row. Missing
+    dates or periods give ``NaT``.
+
+    Parameters
+    ----------
+    dates
+        Settlement dates (array-like of dates, naive datetimes or
+        date strings).
+    periods
+        Settlement periods, starting from 1.
+    """
+    codes, midnights = _get_midnights_utc(pd.DatetimeIndex(dates))
+    periods = pd.to_numeric(pd.Series(np.asarray(periods, dtype=object)), errors='coerce')
+    offsets = pd.to_timedelta(
+        (periods.to_numpy(dtype='float64') - 1) * SETTLEMENT_PERIOD_MINUTES, unit='min')
+    return midnights.take(codes, allow_fill=True, fill_value=pd.NaT) + offsets
+
+
+def get_settlement_periods(timestamps) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """Settlement dates and periods of timestamps, vectorized.
+
+    Inverse of :func:`get_period_start_utc`, and vectorized
+    :func:`get_settlement_period`: naive timestamps are assumed
+    to be UTC. Missing timestamps give ``NaT`` and period 0.
+
+    Returns
+    -------
+    dates : pd.DatetimeIndex
+        Settlement dates (naive, at midnight).
+    periods : np.ndarray
+        Settlement periods (int16), starting from 1.
+    """
+    timestamps = pd.DatetimeIndex(timestamps)
+    if timestamps.tz is None:
+        timestamps = timestamps.tz_localize('UTC')
+    dates = timestamps.tz_convert(TIMEZONE).tz_localize(None).normalize()
+    codes, midnights = _get_midnights_utc(dates)
+    elapsed = timestamps - midnights.take(codes, allow_fill=True, fill_value=pd.NaT)
+    periods = elapsed // pd.Timedelta(minutes=SETTLEMENT_PERIOD_MINUTES) + 1
+    return dates, np.nan_to_num(periods.to_numpy(dtype='float64')).astype('int16')
+
+
+def get_periods_per_day(dates) -> np.ndarray:
+    """Number of settlement periods of each date: 48, or 46 and 50
+    on clock-change days."""
+    dates = pd.DatetimeIndex(dates).normalize()
+    codes, midnights = _get_midnights_utc(dates)
+    # same order of unique dates, shifted by a day
+    _, next_midnights = _get_midnights_utc(dates + pd.Timedelta(days=1))
+    day = (next_midnights - midnights) // pd.Timedelta(minutes=SETTLEMENT_PERIOD_MINUTES)
+    return np.asarray(day, dtype='int16')[codes]
+
+
+def get_period_params(start, end,
+                      date_param: str = 'SettlementDate',
+                      period_param: str = 'Period') -> List[dict]:
+    """Parameters of the queries of each settlement period between two timestamps.
+
+    For services queried by settlement date and period, e.g. to ask
+    for the last few periods only. Naive timestamps are assumed to be
+    UTC, the periods containing ``start`` and ``end`` are included.
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    freq = pd.Timedelta(minutes=SETTLEMENT_PERIOD_MINUTES)
+    timestamps = pd.date_range(start.floor(freq), end, freq=freq)
+    dates, periods = get_settlement_periods(timestamps)
+    return [{date_param: d.date(), period_param: int(p)}
+            for d, p in zip(dates, periods)]
+
+
+def _get_midnights_utc(dates: pd.DatetimeIndex) -> Tuple[np.ndarray, pd.DatetimeIndex]:
+    """Codes of dates and UTC time of local midnight of each unique date."""
+    codes, uniques = pd.factorize(dates.normalize())
+    # local midnight is never ambiguous nor missing in Europe/London
+    midnights = pd.DatetimeIndex(uniques).tz_localize(TIMEZONE).tz_convert('UTC')
+    return codes, midnights
+
+
+def add_timestamp(df: pd.DataFrame, column: str = 'timestamp') -> pd.DataFrame:
+    """Add UTC start of the settlement period of each row, in place.
+
+    Computed from the settlement date (first column of
+    :data:`~elexon_api.config.SETTLEMENT_DATE_COLUMNS` found) and
+    ``settlementPeriod`` columns by :func:`get_period_start_utc`.
+    Frames without them are returned unchanged.
+    """
+    date_column = next((c for c in SETTLEMENT_DATE_COLUMNS if c in df), None)
+    if date_column is None or 'settlementPeriod' not in df:
+        logger.info("No settlement date and period, timestamp not added.")
+        return df
+    df[column] = get_period_start_utc(df[date_column], df['settlementPeriod'])
+    return df
+
+
+def has_items(r_dict: dict) -> bool:
+    """Check whether response contains any item."""
+    r_body = r_dict.get('responseBody') or {}
+    r_list = r_body.get('responseList') or {}
+    return bool(r_list.get('item'))
+
+
+def extract_df(r_dict: dict, service_code: str = None, 
+               metrics: 'Metrics' = None,
+               timestamp: bool = False) -> pd.DataFrame:
     """Extract DataFrame from dictionary.
 
     Parameters
     ----------
     r_dict
         Obtained from response through xmltodict.
+    service_code : str
+        If passed, convert columns to the dtypes of the service
+        (see :func:`apply_dtypes`).
+    metrics : Metrics
+        If passed, record duration and rows
+        (see :mod:`~elexon_api.metrics`).
+    timestamp : bool
+        If true, add the UTC start of the settlement period of
+        each row (see :func:`add_timestamp`).
     """
+    recorder = get_recorder(metrics, service_code)
     r_body       = r_dict['responseBody']
     r_items_list = r_body['responseList']['item']
     try:
@@ -51,13 +211,141 @@ def extract_df(r_dict: dict) -> pd.DataFrame:
             logger.error("Failed to create DataFrame.")
             raise e
     
+    if service_code is not None:
+        df_items = apply_dtypes(df_items, service_code)
+    if timestamp:
+        add_timestamp(df_items)
+    recorder.lap('extract')
+    recorder.count('rows', len(df_items))
+    recorder.report()
     return df_items
 
 
-def extract_df_by_record_type(r_dict: dict) -> Dict[str,pd.DataFrame]:
+def extract_df_by_record_type(r_dict: dict, 
+                              service_code: str = None,
+                              metrics: 'Metrics' = None,
+                              timestamp: bool = False) -> Dict[str,pd.DataFrame]:
+    """Extract one DataFrame per record type from dictionary.
+
+    Items are split per record type in Python, each frame keeping
+    the fields of its own items. The vectorized split (a single
+    frame, sorted once and sliced, see :func:`split_df`) works on
+    the response body: :meth:`~elexon_api.response.Response.to_frames_by_record_type`
+    or :func:`~elexon_api.parser.parse_frames_by_record_type`.
+
+    Parameters
+    ----------
+    r_dict
+        Obtained from response through xmltodict.
+    service_code : str
+        If passed, convert columns to the dtypes of the service
+        (see :func:`apply_dtypes`).
+    metrics : Metrics
+        If passed, record duration and rows
+        (see :mod:`~elexon_api.metrics`).
+    timestamp : bool
+        If true, add the UTC start of the settlement period of
+        each row (see :func:`add_timestamp`).
+    """
+    recorder = get_recorder(metrics, service_code)
     content: List[dict] = r_dict['responseBody']['responseList']['item']
+    if isinstance(content, dict):
+        content = [content]
     records_d = split_list_of_dicts(content, 'recordType')
-    return {k: pd.DataFrame(l) for k,l in records_d.items()}
+    frames = {k: pd.DataFrame(l) for k,l in records_d.items()}
+    if service_code is not None:
+        frames = {k: apply_dtypes(df, service_code) for k,df in frames.items()}
+    if timestamp:
+        frames = {k: add_timestamp(df) for k,df in frames.items()}
+    recorder.lap('extract')
+    recorder.count('rows', sum(map(len, frames.values())))
+    recorder.report()
+    return frames
+
+
+def split_df(df: pd.DataFrame, key: str,
+             fields: Tuple[List[tuple], List[int]] = None) -> Dict[str,pd.DataFrame]:
+    """Split DataFrame based on the values of a column.
+
+    Equivalent to building one DataFrame per value from
+    :func:`split_list_of_dicts`: groups are in order of first
+    appearance, each with a new index. Rows are reordered with a
+    single stable sort on the factorized column, then each group
+    is a contiguous slice.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    key : str
+        Column to split on.
+    fields : tuple
+        Fields of the items the rows were built from, when they
+        differ between items: ``(signatures, row_signatures)``, the
+        distinct tuples of fields and the index of the tuple of each
+        row. Each group then only has the fields of its own items (in
+        order of first appearance), including empty ones. If ``None``,
+        every item has every field and groups have all the columns.
+    """
+    codes, uniques = pd.factorize(df[key], use_na_sentinel=False)
+    group_columns = None
+    if fields is not None:
+        group_columns = _get_group_columns(codes, *fields)
+    counts = np.bincount(codes, minlength=len(uniques))
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    if len(uniques) > 1 and (np.diff(codes) < 0).any():
+        df = df.take(np.argsort(codes, kind='stable'))
+
+    result = {}
+    for i, value in enumerate(uniques):
+        group = df.iloc[bounds[i]:bounds[i+1]]
+        if group_columns is not None:
+            group = group[group_columns[i]]
+        result[value] = group.reset_index(drop=True)
+    return result
+
+
+def _get_group_columns(codes: np.ndarray, signatures: List[tuple],
+                       row_signatures: List[int]) -> List[List[str]]:
+    """Fields of each group, in order of first appearance in its rows."""
+    pairs = pd.DataFrame({'group': codes, 'signature': row_signatures},
+                         copy=False).drop_duplicates()
+    columns = [{} for _ in range(codes.max() + 1 if len(codes) else 0)]
+    for group, signature in pairs.itertuples(index=False):
+        columns[group].update(dict.fromkeys(signatures[signature]))
+    return [list(c) for c in columns]
+
+
+def get_dtypes(service_code: str) -> Dict[str,str]:
+    """Get dtype of each known column of service."""
+    return {**COLUMN_DTYPES, **SERVICE_DTYPES_D.get(service_code, {})}
+
+
+def apply_dtypes(df: pd.DataFrame, service_code: str) -> pd.DataFrame:
+    """Convert known columns to the dtypes of service.
+
+    Dtypes are taken from :data:`~elexon_api.config.COLUMN_DTYPES`,
+    updated with :data:`~elexon_api.config.SERVICE_DTYPES_D`.
+    Values which cannot be converted become missing; integer
+    columns with missing values use the nullable integer dtype.
+    Other columns are left untouched.
+    """
+    dtypes = get_dtypes(service_code)
+    return pd.DataFrame({
+        k: convert_column(v, dtypes[k]) if k in dtypes else v
+        for k, v in df.items()}, index=df.index)
+
+
+def convert_column(series: pd.Series, dtype: str) -> pd.Series:
+    """Convert column of strings to dtype."""
+    if dtype == 'category':
+        return series.astype('category')
+    if dtype.startswith('datetime64'):
+        return pd.to_datetime(series, errors='coerce', format='ISO8601').astype(dtype)
+    numeric = pd.to_numeric(series, errors='coerce')
+    if dtype.startswith('int') and numeric.isna().any():
+        # e.g. int16 -> Int16
+        dtype = dtype.capitalize()
+    return numeric.astype(dtype)
 
 
 def split_list_of_dicts(dict_list: List[dict], key: str) -> Dict[str,List[dict]]:
@@ -0,0 +1,121 @@
+"""
+windows.py
+==========
+
+Adaptive size of the requests of windowed services.
+
+Services queried by date or datetime window (groups 5, 6, 7, 9,
+12 and 15) reject, time out on or truncate windows which are too
+large, and the limit is not documented. An :class:`AdaptiveWindow`
+keeps, for each service, the window used to split a range into
+requests (see :mod:`~elexon_api.backfill`): it starts at the
+configured maximum, is halved when a window fails or is slow
+(failed windows are bisected and queried again), and grows back
+after fast successes, staying below the smallest window which
+failed.
+"""
+
+import threading
+from typing import Dict
+
+from .config import (SERVICE_TO_GROUP, GROUP_TO_MAX_WINDOW, MAX_WINDOW_D,
+                     DEFAULT_WINDOW, MIN_WINDOW, SLOW_WINDOW)
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class AdaptiveWindow:
+    """Window (days) of the requests of each windowed service, learnt from queries.
+
+    Thread-safe, so it can be shared by concurrent range queries
+    (e.g. as the ``window_sizer`` of a :class:`~elexon_api.client.Client`).
+
+    Parameters
+    ----------
+    max_window : dict
+        Largest window of some services, ``{service_code: days}``.
+        Defaults to :data:`~elexon_api.config.MAX_WINDOW_D`, then
+        to :data:`~elexon_api.config.GROUP_TO_MAX_WINDOW`.
+    min_window : float
+        Smallest window (days), never split further. Date windows
+        are at least one day.
+    slow : float
+        Duration (seconds) above which a successful window counts
+        as too large.
+
+    Attributes
+    ----------
+    failures, slow_windows : int
+        Number of failed and slow windows so far.
+    """
+
+    def __init__(self,
+                 max_window: Dict[str, float] = None,
+                 min_window: float = MIN_WINDOW,
+                 slow: float = SLOW_WINDOW):
+        self.max_window = {**MAX_WINDOW_D, **(max_window or {})}
+        self.min_window = min_window
+        self.slow = slow
+        self.failures = 0
+        self.slow_windows = 0
+        self._windows: Dict[str, float] = {}
+        # smallest failed or slow window of each service
+        self._ceilings: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get_max_window(self, service_code: str) -> float:
+        """Configured largest window of a service."""
+        if service_code in self.max_window:
+            return self.max_window[service_code]
+        group = SERVICE_TO_GROUP.get(service_code)
+        return GROUP_TO_MAX_WINDOW.get(group, DEFAULT_WINDOW)
+
+    def get_window(self, service_code: str) -> float:
+        """Window to use for the next request of a service."""
+        with self._lock:
+            window = self._windows.get(service_code)
+        if window is None:
+            return self.get_max_window(service_code)
+        return window
+
+    def record_success(self, service_code: str, window: float, seconds: float) -> None:
+        """Shrink the window after a slow request, grow it after a fast one."""
+        if seconds > self.slow:
+            with self._lock:
+                self.slow_windows += 1
+            self._shrink(service_code, window)
+            logger.info(f"{service_code}: {window:g} days window took {seconds:.1f}s.")
+            return
+        with self._lock:
+            current = self._windows.get(service_code)
+            # only a success at the current size tells it can grow
+            if current is None or window < current:
+                return
+            new = min(current * 2, self.get_max_window(service_code))
+            ceiling = self._ceilings.get(service_code)
+            if ceiling is not None and new >= ceiling:
+                new = max(current, (current + ceiling) / 2)
+            self._windows[service_code] = new
+
+    def record_failure(self, service_code: str, window: float) -> None:
+        """Shrink the window after a failed request."""
+        with self._lock:
+            self.failures += 1
+        self._shrink(service_code, window)
+
+    def _shrink(self, service_code: str, window: float) -> None:
+        with self._lock:
+            current = self._windows.get(service_code, self.get_max_window(service_code))
+            new = max(self.min_window, min(current, window / 2))
+            self._ceilings[service_code] = min(window, self._ceilings.get(service_code, window))
+            if new < current:
+                logger.info(f"{service_code}: window reduced to {new:g} days.")
+            self._windows[service_code] = new
+
+    def reset(self) -> None:
+        """Forget the learnt windows."""
+        with self._lock:
+            self._windows.clear()
+            self._ceilings.clear()
@@ -13,6 +13,9 @@ setup(
     version='0.3.0',
     description=('Elexon API wrapper.'),
     author='Giorgio Balestrieri',
-    packages=find_packages(exclude=['contrib', 'docs', 'tests', 'examples']),
-    install_requires=['requests', 'pandas', 'xmltodict', 'aiohttp', 'asyncio']
+    packages=find_packages(exclude=['contrib', 'docs', 'tests', 'examples',
+                                    'benchmarks', 'benchmarks.*']),
+    install_requires=['requests', 'pandas', 'xmltodict', 'aiohttp', 'asyncio'],
+    extras_require={'parquet': ['pyarrow']},
+    entry_points={'console_scripts': ['elexon-export=elexon_api.cli:main']},
     )
\ No newline at end of file